@@ -8,15 +8,39 @@ Core Features:
 - Console Output: Shows only chat flow (Thinking, Tool Use, Response) & critical errors.
 - Tools: Weather, Search, Firecrawl, GitHub, CodeExec(Ack), DateTime, VectorSearch
 - Increased Context Window (1M tokens).
-- Vector DB (in-memory), Conversation Memory Pruning.
+- Vector DB (Upstash or local memory-mapped IVF index via VECTOR_DB_BACKEND), Conversation Memory Pruning + background summary compaction (AGENT_CONTEXT_TOKENS).
 - Streaming Responses.
 - Structured Logging (Detailed logs -> file).
 - File Handling.
+- Fast Start: `--fast-start` / AGENT_FAST_START=1 skips the pip check; tool deps load lazily; per-phase startup timings.
+- Async Core: `--async` / AGENT_ASYNC=1 drives turns with litellm.acompletion on one event loop (achat_turn); I/O tools have native async paths.
+- Server Mode: `--serve` / AGENT_SERVE=1 exposes the turn loop over HTTP with Server-Sent Events; per-session memory, idle sessions spilled to disk.
 """
 
 # --- Installations ---
 import subprocess
 import sys
+import os
+import time
+from contextlib import contextmanager
+
+# --- Startup Profiling ---
+# Fast start (`--fast-start` or AGENT_FAST_START=1) skips the pip check; heavy tool
+# dependencies are always imported on first use via lazy_import().
+FAST_START = "--fast-start" in sys.argv or os.environ.get("AGENT_FAST_START", "").lower() in ("1", "true", "yes")
+STARTUP_T0 = time.perf_counter()
+STARTUP_TIMINGS = {}
+LAZY_IMPORT_TIMINGS = {}
+
+@contextmanager
+def startup_phase(name):
+    t0 = time.perf_counter()
+    try: yield
+    finally: STARTUP_TIMINGS[name] = time.perf_counter() - t0
+
+def format_startup_timings():
+    phases = " | ".join(f"{k} {v*1000:.0f}ms" for k, v in STARTUP_TIMINGS.items())
+    return f"Startup: {phases} | total {(time.perf_counter() - STARTUP_T0)*1000:.0f}ms"
 
 def install_packages():
     packages = [
@@ -24,7 +48,7 @@ def install_packages():
         "python-dotenv",
         "requests",
         "duckduckgo-search",
-        "firecrawl-py",
+        "h2", # HTTP/2 for the shared async client
         "sentence-transformers",
         "numpy",
         "matplotlib",
@@ -43,24 +67,45 @@ def install_packages():
          print("Error: 'pip' command not found. Please ensure Python environment is set up correctly.", file=sys.stderr) # Console print for setup error
          sys.exit(1)
 
-install_packages()
+with startup_phase("install"):
+    if not FAST_START: install_packages()
 
 # --- Imports ---
-import litellm, os, base64, json, mimetypes, getpass, requests, traceback, logging, numpy as np, time, io
-from pathlib import Path
-from duckduckgo_search import DDGS
-from firecrawl import FirecrawlApp
-from datetime import datetime
-from collections import defaultdict
-from contextlib import redirect_stdout, redirect_stderr
-import matplotlib.pyplot as plt
-from github import Github, GithubException
-import tempfile
-import shutil
-from dotenv import load_dotenv # For .env file
+with startup_phase("imports"):
+    import base64, json, mimetypes, getpass, traceback, logging, io, importlib, hashlib, re, heapq, itertools
+    from pathlib import Path
+    from datetime import datetime, timezone
+    from collections import defaultdict, deque, OrderedDict
+    from contextlib import redirect_stdout, redirect_stderr
+    import shutil
+    import threading
+    import queue
+    import atexit
+    import sqlite3
+    import unicodedata
+    import contextvars
+    import contextlib
+    import concurrent.futures
+    import uuid
+    import asyncio
+    import functools
+    import inspect
+    import weakref
+    from types import SimpleNamespace
+    from dotenv import load_dotenv # For .env file
+
+def lazy_import(module_name):
+    """Import a heavy dependency on first use and record how long it took."""
+    module = sys.modules.get(module_name)
+    if module is not None: return module
+    t0 = time.perf_counter()
+    module = importlib.import_module(module_name)
+    LAZY_IMPORT_TIMINGS[module_name] = time.perf_counter() - t0
+    return module
 
 # --- Load Environment Variables ---
-load_dotenv()
+with startup_phase("dotenv"):
+    load_dotenv()
 print("Attempted to load API keys from .env file.") # Console print for setup
 
 # --- Setup Logging (Clean Console) ---
@@ -87,6 +132,12 @@ class ToolExecutionError(AgentException): pass
 class APIKeyError(AgentException): pass
 class VectorDBError(AgentException): pass
 class GitHubToolError(ToolExecutionError): pass
+class GitHubAPIError(GitHubToolError):
+    def __init__(self, status, message): super().__init__(f"GitHub API error: {status} - {message}"); self.status = status
+class GitHubRateLimitError(GitHubAPIError):
+    def __init__(self, status, message, retry_at):
+        GitHubToolError.__init__(self, f"GitHub rate limit: {message}. Do not retry before {datetime.fromtimestamp(retry_at).strftime('%H:%M:%S')}.")
+        self.status = status; self.retry_at = retry_at
 
 # --- API Key Setup (from Environment) ---
 logger.info("Setting up API Keys from environment...") # To file only
@@ -106,57 +157,640 @@ def get_optional_key(env_var):
         logger.info(f"Found optional key: {env_var}") # To file only
     return key
 
-try:
-    gemini_api_key = get_required_key("GEMINI_API_KEY")
-    openweathermap_api_key = get_optional_key("OPENWEATHERMAP_API_KEY")
-    firecrawl_api_key = get_optional_key("FIRECRAWL_API_KEY")
-    github_api_key = get_optional_key("GITHUB_API_KEY")
-    stability_api_key = get_optional_key("STABILITY_API_KEY")
-    aws_access_key = get_optional_key("AWS_ACCESS_KEY_ID")
-    aws_secret_key = get_optional_key("AWS_SECRET_ACCESS_KEY")
-except APIKeyError as e:
-    print(f"Error: {e}. Please ensure it's set in your .env file or environment.", file=sys.stderr) # Console Error
-    sys.exit(1)
-except Exception as e:
-     logger.critical(f"Unexpected error during API key setup: {e}", exc_info=True) # File CRITICAL
-     print(f"Unexpected critical error during API key setup: {e}", file=sys.stderr) # Console CRITICAL
-     sys.exit(1)
+with startup_phase("api_keys"):
+    try:
+        gemini_api_key = get_required_key("GEMINI_API_KEY")
+        openweathermap_api_key = get_optional_key("OPENWEATHERMAP_API_KEY")
+        firecrawl_api_key = get_optional_key("FIRECRAWL_API_KEY")
+        github_api_key = get_optional_key("GITHUB_API_KEY")
+        stability_api_key = get_optional_key("STABILITY_API_KEY")
+        aws_access_key = get_optional_key("AWS_ACCESS_KEY_ID")
+        aws_secret_key = get_optional_key("AWS_SECRET_ACCESS_KEY")
+    except APIKeyError as e:
+        print(f"Error: {e}. Please ensure it's set in your .env file or environment.", file=sys.stderr) # Console Error
+        sys.exit(1)
+    except Exception as e:
+         logger.critical(f"Unexpected error during API key setup: {e}", exc_info=True) # File CRITICAL
+         print(f"Unexpected critical error during API key setup: {e}", file=sys.stderr) # Console CRITICAL
+         sys.exit(1)
 logger.info("API Keys configured.") # To file only
 
 
 # --- Memory Management ---
-# (Unchanged - uses logger internally)
+# Token counts are estimated once per message and cached next to it; the system message is
+# pinned outside the deque so pruning is a popleft() down to a low watermark in one pass.
+# Eviction and compaction work on whole turns: an assistant `tool_calls` message always
+# leaves together with its `tool` results. When `context_tokens` is set, only the rolling
+# summary plus the most recent turns that fit the budget are sent to the model.
 class ConversationMemory:
     CHARS_PER_TOKEN_ESTIMATE = 4
-    def __init__(self, max_tokens=1_000_000, system_message=None): # Increased limit
-        self.messages = []; self.system_message = system_message
-        if system_message: self.messages.append(system_message); self.token_count = self._estimate_tokens(system_message)
-        else: self.token_count = 0
-        self.max_tokens = max_tokens; logger.info(f"Memory init: max_tokens={max_tokens}")
+    PRUNE_WATERMARK = 0.9 # Once over budget, evict down to this fraction of max_tokens
+    COMPACT_TARGET = 0.5 # Compaction folds old turns until the body is this fraction of context_tokens
+    SUMMARY_PREFIX = "Summary of the earlier conversation (older turns were compacted):\n"
+    def __init__(self, max_tokens=1_000_000, system_message=None, prune_watermark=None, context_tokens=None): # Increased limit
+        self.system_message = system_message; self.max_tokens = max_tokens; self.context_tokens = context_tokens
+        self.prune_watermark = prune_watermark if prune_watermark is not None else self.PRUNE_WATERMARK
+        self._body = deque() # (message, est_tokens) pairs, oldest first
+        self._system_tokens = self._estimate_tokens(system_message) if system_message else 0
+        self.summary = None; self.summary_tokens = 0
+        self.token_count = self._system_tokens; self._snapshot = None
+        self._lock = threading.RLock(); self._compaction_thread = None
+        logger.info(f"Memory init: max_tokens={max_tokens}, context_tokens={context_tokens}")
     def _estimate_tokens(self, message): return len(json.dumps(message)) // self.CHARS_PER_TOKEN_ESTIMATE
+    @property
+    def messages(self): return self.get_messages()
     def add_message(self, message):
         est_tokens = self._estimate_tokens(message)
-        while self.token_count + est_tokens > self.max_tokens and len(self.messages) > (1 if self.system_message else 0): self._prune_history()
-        if self.token_count + est_tokens > self.max_tokens: logger.warning(f"Msg ({est_tokens} tk) too large. Skipping."); return False
-        self.messages.append(message); self.token_count += est_tokens; logger.debug(f"Msg added. Role: {message.get('role')}, Tokens: {self.token_count}"); return True
-    def _prune_history(self):
-        if len(self.messages) <= (1 if self.system_message else 0): logger.warning("Cannot prune."); return
-        idx = 1 if self.system_message else 0
-        if idx < len(self.messages):
-            removed = self.messages.pop(idx); removed_tk = self._estimate_tokens(removed)
-            self.token_count -= removed_tk; logger.info(f"Pruned msg (Role: {removed.get('role')}). Tokens: {self.token_count}")
-        else: logger.warning("Pruning failed: No non-system msgs.")
-    def get_messages(self): return self.messages
+        with self._lock:
+            if self.token_count + est_tokens > self.max_tokens and self._body:
+                target = min(int(self.max_tokens * self.prune_watermark), self.max_tokens - est_tokens)
+                self._prune_history(target)
+            if self.token_count + est_tokens > self.max_tokens: logger.warning(f"Msg ({est_tokens} tk) too large. Skipping."); return False
+            self._body.append((message, est_tokens)); self.token_count += est_tokens; self._snapshot = None
+        logger.debug(f"Msg added. Role: {message.get('role')}, Tokens: {self.token_count}"); return True
+    def _pop_turn(self):
+        """Pops the oldest message plus any `tool` results that belong to it."""
+        msg, tokens = self._body.popleft(); popped = [msg]
+        if msg.get("role") == "assistant" and msg.get("tool_calls"):
+            while self._body and self._body[0][0].get("role") == "tool":
+                m, tk = self._body.popleft(); popped.append(m); tokens += tk
+        self.token_count -= tokens
+        return popped
+    def _prune_history(self, target_tokens=None):
+        """Evicts the oldest non-system turns until token_count <= target_tokens (single pass)."""
+        with self._lock:
+            if not self._body: logger.warning("Cannot prune."); return 0
+            if target_tokens is None: target_tokens = self.token_count - 1
+            removed = 0
+            while self._body and self.token_count > target_tokens: removed += len(self._pop_turn())
+            self._snapshot = None
+        logger.info(f"Pruned {removed} msg(s). Tokens: {self.token_count}")
+        return removed
+    def _body_tokens(self): return self.token_count - self._system_tokens - self.summary_tokens
+    def _summary_message(self): return {"role": "system", "content": self.SUMMARY_PREFIX + self.summary}
+    def compact(self, summarizer):
+        """Folds the oldest turns into the rolling summary until the body fits COMPACT_TARGET.
+
+        `summarizer(previous_summary, messages) -> str` runs without holding the lock, so
+        new messages can be added meanwhile; only the folded turns are removed afterwards.
+        """
+        with self._lock:
+            if not self.context_tokens or self._body_tokens() <= self.context_tokens: return False
+            excess = self._body_tokens() - int(self.context_tokens * self.COMPACT_TARGET)
+            fold = []; folded_tokens = 0
+            for msg, tk in self._body:
+                # Never cut between an assistant tool_calls message and its tool results
+                if folded_tokens >= excess and msg.get("role") != "tool": break
+                fold.append(msg); folded_tokens += tk
+            previous = self.summary
+        if not fold: return False
+        try: new_summary = summarizer(previous, fold)
+        except Exception as e: logger.error(f"Memory compaction failed: {e}", exc_info=True); return False
+        if not new_summary: return False
+        folded_ids = {id(m) for m in fold}
+        with self._lock:
+            removed = 0
+            while self._body and id(self._body[0][0]) in folded_ids:
+                _, tk = self._body.popleft(); self.token_count -= tk; removed += 1
+            self.token_count -= self.summary_tokens; self.summary = new_summary
+            self.summary_tokens = self._estimate_tokens(self._summary_message()); self.token_count += self.summary_tokens
+            self._snapshot = None
+        logger.info(f"Compacted {removed} msg(s) into summary ({self.summary_tokens} tk). Tokens: {self.token_count}")
+        return True
+    def compact_in_background(self, summarizer):
+        """Starts compaction on a daemon thread (e.g. while the user is typing)."""
+        with self._lock:
+            if self._compaction_thread and self._compaction_thread.is_alive(): return False
+            if not self.context_tokens or self._body_tokens() <= self.context_tokens: return False
+            self._compaction_thread = threading.Thread(target=self.compact, args=(summarizer,), name="memory-compaction", daemon=True)
+            self._compaction_thread.start()
+        return True
+    def wait_for_compaction(self, timeout=None):
+        thread = self._compaction_thread
+        if thread: thread.join(timeout)
+    def get_messages(self):
+        with self._lock:
+            if self._snapshot is None:
+                head = [self.system_message] if self.system_message else []
+                if self.summary: head.append(self._summary_message())
+                window = deque(); budget = self.context_tokens
+                for msg, tk in reversed(self._body):
+                    if budget is not None and window and budget - tk < 0: break
+                    window.appendleft(msg)
+                    if budget is not None: budget -= tk
+                # A window must not open on tool results whose tool_calls message was cut off
+                while len(window) > 1 and window[0].get("role") == "tool": window.popleft()
+                self._snapshot = head + list(window)
+            return self._snapshot
     def get_last_user_message_content(self):
-        for msg in reversed(self.messages):
-            if msg.get("role") == "user": return msg.get("content")
+        with self._lock:
+            for msg, _ in reversed(self._body):
+                if msg.get("role") == "user": return msg.get("content")
         return None
+    def to_dict(self):
+        """JSON-serialisable state (the system message is not included; it is supplied on restore)."""
+        with self._lock: return {"max_tokens": self.max_tokens, "context_tokens": self.context_tokens, "prune_watermark": self.prune_watermark, "summary": self.summary, "messages": [m for m, _ in self._body]}
+    @classmethod
+    def from_dict(cls, state, system_message=None):
+        memory = cls(max_tokens=state.get("max_tokens", 1_000_000), system_message=system_message, prune_watermark=state.get("prune_watermark"), context_tokens=state.get("context_tokens"))
+        if state.get("summary"):
+            memory.summary = state["summary"]; memory.summary_tokens = memory._estimate_tokens(memory._summary_message()); memory.token_count += memory.summary_tokens
+        for message in state.get("messages", []):
+            tokens = memory._estimate_tokens(message); memory._body.append((message, tokens)); memory.token_count += tokens
+        return memory
+
+def make_llm_summarizer(model_name, max_chars_per_message=2000):
+    """Returns a ConversationMemory summarizer backed by a non-streaming LLM call."""
+    def render(messages):
+        lines = []
+        for m in messages:
+            content = m.get("content")
+            if isinstance(content, list): text = " ".join(p.get("text", "") if p.get("type") == "text" else f"[{p.get('type')}]" for p in content)
+            else: text = content or ""
+            if m.get("tool_calls"): text += " [called tools: " + ", ".join(tc.get("function", {}).get("name") or "?" for tc in m["tool_calls"]) + "]"
+            lines.append(f"{m.get('role')}: {text[:max_chars_per_message]}")
+        return "\n".join(lines)
+    def summarize(previous_summary, messages):
+        litellm = lazy_import("litellm")
+        prompt = (
+            "Update the running summary of a conversation between a user and an agent. "
+            "Keep facts, decisions, file names, URLs, repo names and open tasks; drop chit-chat. "
+            "Reply with the updated summary only.\n\n"
+            f"Current summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{render(messages)}"
+        )
+        response = litellm.completion(model=model_name, messages=[{"role": "user", "content": prompt}])
+        return response.choices[0].message.content
+    return summarize
+
+# --- Caching ---
+class LRUTTLCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after being set."""
+    def __init__(self, max_entries=256, ttl=300):
+        self.max_entries = max_entries; self.ttl = ttl
+        self._data = OrderedDict(); self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]; self.counters["expirations"] += 1; entry = None
+            if entry is None: self.counters["misses"] += 1; return default
+            self._data.move_to_end(key); self.counters["hits"] += 1
+            return entry[1]
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value); self._data.move_to_end(key)
+            while len(self._data) > self.max_entries: self._data.popitem(last=False); self.counters["evictions"] += 1
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None: self._data.clear()
+            else: self._data.pop(key, None)
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {**self.counters, "size": len(self._data), "hit_rate": round(self.counters["hits"] / lookups, 3) if lookups else 0.0}
 
 # --- Vector Database for Semantic Memory ---
+CURRENT_SESSION = contextvars.ContextVar("agent_session", default=None) # Stamped on memory writes as metadata["session"]
+
+class ContentDeduplicator:
+    """Derives VectorDB ids from a normalised content hash and filters repeated writes.
+
+    Identical text maps to the same id, so a repeat add is a no-op (or a metadata refresh when
+    non-volatile metadata changed). With `near_dup` enabled, a 64-bit SimHash over word
+    3-shingles, indexed by 4 LSH bands of 16 bits, drops chunks within `max_hamming` bits of
+    one already written.
+    """
+    VOLATILE_METADATA = ("time", "ts")
+    BANDS = 4
+
+    def __init__(self, near_dup=False, max_hamming=3, max_entries=100_000):
+        self.near_dup = near_dup; self.max_hamming = max_hamming; self.max_entries = max_entries
+        self._seen = OrderedDict() # id -> metadata fingerprint (LRU)
+        self._simhashes = {}; self._bands = defaultdict(set); self._lock = threading.Lock()
+        self.counters = {"new": 0, "duplicate": 0, "refresh": 0, "near_duplicate": 0}
+
+    @staticmethod
+    def normalize(text): return unicodedata.normalize("NFC", " ".join(text.split()))
+    def content_id(self, text): return hashlib.sha256(self.normalize(text).encode("utf-8")).hexdigest()
+    def _fingerprint(self, metadata):
+        return json.dumps({k: v for k, v in (metadata or {}).items() if k not in self.VOLATILE_METADATA}, sort_keys=True, default=str)
+
+    @staticmethod
+    def simhash(text):
+        words = text.lower().split(); shingles = [" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+        weights = [0] * 64
+        for sh in shingles:
+            h = int.from_bytes(hashlib.blake2b(sh.encode("utf-8"), digest_size=8).digest(), "big")
+            for bit in range(64): weights[bit] += 1 if h >> bit & 1 else -1
+        return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+    def _band_keys(self, h, namespace=""): return [(namespace, b, h >> (b * 16) & 0xFFFF) for b in range(self.BANDS)]
+
+    def check(self, text, metadata=None, namespace=""):
+        """Returns (vector_id, action) where action is new, duplicate, refresh or near_duplicate."""
+        vector_id = self.content_id(text); fp = self._fingerprint(metadata); key = (namespace, vector_id)
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                action = "duplicate" if self._seen[key] == fp else "refresh"
+                self._seen[key] = fp; self.counters[action] += 1
+                return vector_id, action
+            h = None
+            if self.near_dup:
+                h = self.simhash(self.normalize(text))
+                candidates = set().union(*(self._bands.get(k, ()) for k in self._band_keys(h, namespace)))
+                if any(bin(h ^ self._simhashes[c]).count("1") <= self.max_hamming for c in candidates):
+                    self.counters["near_duplicate"] += 1
+                    return vector_id, "near_duplicate"
+            self._seen[key] = fp; self.counters["new"] += 1
+            if h is not None:
+                self._simhashes[key] = h
+                for k in self._band_keys(h, namespace): self._bands[k].add(key)
+            while len(self._seen) > self.max_entries:
+                old, _ = self._seen.popitem(last=False); old_h = self._simhashes.pop(old, None)
+                if old_h is not None:
+                    for k in self._band_keys(old_h, old[0]): self._bands[k].discard(old)
+        return vector_id, "new"
+
+    def forget(self, vector_id, namespace=""):
+        """Un-records a checked id whose write was dropped or failed, so the same text is written next time."""
+        key = (namespace, vector_id)
+        with self._lock:
+            self._seen.pop(key, None); h = self._simhashes.pop(key, None)
+            if h is not None:
+                for k in self._band_keys(h, namespace): self._bands[k].discard(key)
+
+class VectorDBWriter:
+    """Write-behind buffer for VectorDB: add() enqueues, a daemon thread upserts in batches.
+
+    A batch is flushed when it reaches `batch_size` records or `flush_interval` seconds after
+    its first record. The queue is bounded; a full queue blocks the caller for at most
+    `put_timeout` seconds (back-pressure) before the record is dropped. Dropped records and
+    those of a failed batch are passed to `on_lost`.
+    """
+    def __init__(self, index, batch_size=32, flush_interval=0.5, max_queue=1000, put_timeout=2.0, embedder=None, on_lost=None):
+        self.index = index; self.embedder = embedder; self.on_lost = on_lost; self.batch_size = batch_size; self.flush_interval = flush_interval; self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue); self._pending = 0; self._idle = threading.Condition()
+        self._stopped = threading.Event()
+        self.counters = {"enqueued": 0, "flushed": 0, "batches": 0, "dropped": 0, "failed": 0, "flush_ms_total": 0.0, "flush_ms_max": 0.0}
+        self._thread = threading.Thread(target=self._run, name="vdb-writer", daemon=True); self._thread.start()
+    def submit(self, record, block=True):
+        """Enqueues `record`; with block=False (event-loop callers) a full queue drops it at once."""
+        if self._stopped.is_set(): return False
+        with self._idle: self._pending += 1
+        try: self._queue.put(record, block, self.put_timeout)
+        except queue.Full:
+            with self._idle: self._pending -= 1; self._idle.notify_all()
+            self.counters["dropped"] += 1; logger.warning("VDB write queue full; entry dropped.")
+            if self.on_lost: self.on_lost([record])
+            return False
+        self.counters["enqueued"] += 1
+        return True
+    def _run(self):
+        while not (self._stopped.is_set() and self._queue.empty()):
+            try: batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty: continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try: batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty: break
+            self._flush_batch(batch)
+    @staticmethod
+    def write_records(index, embedder, records):
+        """Writes a batch: texts without a vector are embedded in one call (if `embedder`), refreshes
+        become metadata-only updates and the rest is one upsert per namespace. A refresh of an id
+        upserted earlier in the batch is folded into that upsert; other refreshes are applied after
+        the upserts, and an upsert drops an earlier refresh of its id, so the last write wins."""
+        pending = [r for r in records if "vector" not in r and not r.get("refresh")]
+        if embedder is not None and pending:
+            for r, vec in zip(pending, embedder.embed([r["data"] for r in pending])): r["vector"] = vec.tolist()
+        by_namespace = defaultdict(dict); refreshes = {} # ns -> {id: upsert}; (ns, id) -> metadata
+        for r in records:
+            r = dict(r); ns = r.pop("namespace", "") or ""
+            if not r.pop("refresh", False): refreshes.pop((ns, r["id"]), None); by_namespace[ns][r["id"]] = r
+            elif r["id"] in by_namespace[ns]: by_namespace[ns][r["id"]]["metadata"] = r["metadata"]
+            else: refreshes[(ns, r["id"])] = r["metadata"]
+        for ns, upserts in by_namespace.items():
+            if upserts: index.upsert(list(upserts.values()), **({"namespace": ns} if ns else {}))
+        for (ns, id_), metadata in refreshes.items(): index.update(id=id_, metadata=metadata, **({"namespace": ns} if ns else {})) # Metadata-only: no re-embedding
+
+    def _flush_batch(self, batch):
+        t0 = time.perf_counter()
+        try:
+            self.write_records(self.index, self.embedder, batch)
+            self.counters["flushed"] += len(batch); self.counters["batches"] += 1
+            logger.debug(f"VDB flushed {len(batch)} entries.")
+        except Exception as e:
+            self.counters["failed"] += len(batch); logger.error(f"VDB batch upsert error ({len(batch)} entries): {e}", exc_info=True)
+            if self.on_lost: self.on_lost(batch)
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            self.counters["flush_ms_total"] += ms; self.counters["flush_ms_max"] = max(self.counters["flush_ms_max"], ms)
+            with self._idle: self._pending -= len(batch); self._idle.notify_all()
+    def flush(self, timeout=None):
+        """Blocks until every submitted record has been upserted (or timeout). Returns True if drained."""
+        with self._idle: return self._idle.wait_for(lambda: self._pending <= 0, timeout)
+    def close(self, timeout=10):
+        self._stopped.set(); self._thread.join(timeout)
+    def stats(self):
+        c = dict(self.counters); total_ms = c.pop("flush_ms_total")
+        c["queue_length"] = self._queue.qsize()
+        c["flush_ms_avg"] = round(total_ms / c["batches"], 2) if c["batches"] else 0.0
+        return c
+
+class EmbeddingPipeline:
+    """Batched text encoder with a persistent embedding cache keyed by (model, content hash).
+
+    embed() looks every text up in SQLite in one query, encodes only the misses in a single
+    vectorised encoder call and stores them, so re-writing the same strings costs no encoding.
+    """
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, model_name=None, embed_fn=None, cache_path=None, batch_size=64):
+        self.np = lazy_import("numpy")
+        self.model_name = model_name or os.environ.get("VECTOR_DB_EMBED_MODEL", "all-MiniLM-L6-v2")
+        self.batch_size = batch_size; self._embed_fn = embed_fn; self._model = None; self._lock = threading.Lock()
+        cache_path = Path(cache_path or os.environ.get("EMBEDDING_CACHE_PATH", ".agent_cache/embeddings.sqlite")); cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(cache_path), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, sha TEXT NOT NULL, vec BLOB NOT NULL, PRIMARY KEY (model, sha))")
+        self._db.commit()
+        self.counters = {"hits": 0, "misses": 0, "encode_calls": 0}
+
+    def _encode(self, texts):
+        if self._embed_fn: return self._embed_fn(texts)
+        if self._model is None: self._model = lazy_import("sentence_transformers").SentenceTransformer(self.model_name)
+        return self._model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True)
+
+    def embed(self, texts):
+        np = self.np
+        shas = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in texts]
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(shas))
+            for i in range(0, len(unique), self.LOOKUP_CHUNK):
+                chunk = unique[i:i + self.LOOKUP_CHUNK]
+                rows = self._db.execute(f"SELECT sha, vec FROM embeddings WHERE model = ? AND sha IN ({', '.join('?' * len(chunk))})", (self.model_name, *chunk))
+                for sha, blob in rows: found[sha] = np.frombuffer(blob, dtype=np.float32)
+        missing = [sha for sha in unique if sha not in found]
+        self.counters["hits"] += len(unique) - len(missing); self.counters["misses"] += len(missing)
+        if missing:
+            first_text = {}
+            for sha, t in zip(shas, texts): first_text.setdefault(sha, t)
+            encoded = np.asarray(self._encode([first_text[sha] for sha in missing]), dtype=np.float32).reshape(len(missing), -1)
+            self.counters["encode_calls"] += 1
+            with self._lock:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", [(self.model_name, sha, vec.tobytes()) for sha, vec in zip(missing, encoded)])
+                self._db.commit()
+            found.update(zip(missing, encoded))
+        return np.stack([found[sha] for sha in shas]) if shas else np.empty((0, 0), dtype=np.float32)
+
+class LocalVectorIndex:
+    """In-process vector index implementing the subset of upstash_vector.Index that VectorDB uses.
+
+    Embeddings are L2-normalised float16 rows in a memory-mapped file; ids, text and metadata
+    live in SQLite next to it, so the index survives restarts without re-embedding. Once
+    `ivf_threshold` entries exist, an IVF index (spherical k-means centroids + inverted lists)
+    limits each query to the `nprobe` closest lists instead of scanning every row.
+    """
+    IVF_THRESHOLD = 4096
+    INITIAL_CAPACITY = 1024
+    SCAN_CHUNK = 65536
+    PREFILTER_SCAN_LIMIT = 200_000 # Filtered partitions up to this size are scanned exactly
+    STRUCTURED_FILTERS = True # query() takes VectorDB filter dicts, pushed down as indexed SQL
+
+    def __init__(self, path=None, embed_fn=None, model_name=None, nprobe=8, ivf_threshold=None, embedder=None):
+        self.np = lazy_import("numpy")
+        self.path = Path(path or os.environ.get("VECTOR_DB_PATH", ".agent_cache/vectors")); self.path.mkdir(parents=True, exist_ok=True)
+        self.nprobe = nprobe; self.ivf_threshold = ivf_threshold or self.IVF_THRESHOLD
+        self.embedder = embedder or EmbeddingPipeline(model_name, embed_fn, cache_path=self.path / "embeddings.sqlite")
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.path / "index.sqlite"), check_same_thread=False)
+        self._migrate()
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (row INTEGER PRIMARY KEY, namespace TEXT NOT NULL DEFAULT '', id TEXT NOT NULL, data TEXT, metadata TEXT, list INTEGER, "
+                         "type TEXT, ts REAL, url TEXT, session TEXT, UNIQUE (namespace, id))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_partition ON entries (namespace, type, ts)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_url ON entries (url)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_session ON entries (session)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+        self._multi_namespace = self._db.execute("SELECT 1 FROM entries WHERE namespace != '' LIMIT 1").fetchone() is not None
+        self.dim = int(self._setting("dim") or 0); self.count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        self._matrix = None; self._capacity = 0
+        if self.dim: self._open_matrix(max(self.count, (self._matrix_file.stat().st_size // (2 * self.dim)) if self._matrix_file.exists() else 0))
+        self._centroids = None; self._lists = defaultdict(list); self._list_arrays = {}
+        centroid_file = self.path / "centroids.npy"
+        if centroid_file.exists():
+            self._centroids = self.np.load(centroid_file)
+            for row, lst in self._db.execute("SELECT row, list FROM entries WHERE list IS NOT NULL ORDER BY row"): self._lists[lst].append(row)
+        logger.info(f"Local vector index at {self.path}: {self.count} entries, dim={self.dim}, ivf={'on' if self._centroids is not None else 'off'}")
+
+    def _migrate(self):
+        """Upgrades an index created before namespaces and filter columns existed.
+
+        Its `id` is UNIQUE on its own, which ALTER TABLE cannot relax, so the table is rebuilt in one
+        transaction: rows keep their row numbers (matrix positions) and IVF lists, and the filter
+        columns are filled in from the stored metadata.
+        """
+        columns = {c[1] for c in self._db.execute("PRAGMA table_info(entries)")}
+        if not columns or "namespace" in columns: return
+        logger.info(f"Migrating local vector index at {self.path} to namespaces and filter columns.")
+        with self._db:
+            self._db.execute("BEGIN") # DDL too: an interrupted migration leaves the old table untouched
+            self._db.execute("ALTER TABLE entries RENAME TO entries_v1")
+            self._db.execute("CREATE TABLE entries (row INTEGER PRIMARY KEY, namespace TEXT NOT NULL DEFAULT '', id TEXT NOT NULL, data TEXT, metadata TEXT, list INTEGER, "
+                             "type TEXT, ts REAL, url TEXT, session TEXT, UNIQUE (namespace, id))")
+            self._db.execute("INSERT INTO entries (row, id, data, metadata, list) SELECT row, id, data, metadata, list FROM entries_v1")
+            self._db.executemany("UPDATE entries SET type = ?, ts = ?, url = ?, session = ? WHERE row = ?",
+                                 [(*self._filter_columns(json.loads(m or "{}")), row) for row, m in self._db.execute("SELECT row, metadata FROM entries").fetchall()])
+            self._db.execute("DROP TABLE entries_v1")
+
+    @property
+    def _matrix_file(self): return self.path / "vectors.f16"
+    def _setting(self, key):
+        row = self._db.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    def _set_setting(self, key, value): self._db.execute("INSERT OR REPLACE INTO settings VALUES (?, ?)", (key, str(value)))
+
+    def _open_matrix(self, capacity):
+        capacity = max(capacity, self.INITIAL_CAPACITY)
+        if self._matrix is not None: self._matrix.flush(); self._matrix = None
+        with open(self._matrix_file, "ab") as f: f.truncate(max(capacity * self.dim * 2, f.seek(0, 2)))
+        self._matrix = self.np.memmap(self._matrix_file, dtype=self.np.float16, mode="r+", shape=(capacity, self.dim))
+        self._capacity = capacity
+
+    def embed(self, texts):
+        np = self.np
+        vecs = np.asarray(self.embedder.embed(texts), dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True); norms[norms == 0] = 1.0
+        return vecs / norms
+
+    @staticmethod
+    def _filter_columns(metadata):
+        metadata = metadata or {}; ts = metadata.get("ts")
+        return (metadata.get("type"), float(ts) if isinstance(ts, (int, float)) else None, metadata.get("url"), metadata.get("session"))
+
+    def upsert(self, vectors, namespace=""):
+        items = [v if isinstance(v, dict) else {"id": v[0], "vector": v[1], "metadata": v[2] if len(v) > 2 else None} for v in vectors]
+        to_embed = [i for i, v in enumerate(items) if v.get("vector") is None]
+        embedded = self.embed([items[i]["data"] for i in to_embed]) if to_embed else None
+        vecs = [None] * len(items)
+        for j, i in enumerate(to_embed): vecs[i] = embedded[j]
+        for i, v in enumerate(items):
+            if vecs[i] is None: vecs[i] = self.embed_vector(v["vector"])
+        with self._lock:
+            if not self.dim: self.dim = len(vecs[0]); self._set_setting("dim", self.dim)
+            if namespace: self._multi_namespace = True
+            for v, vec in zip(items, vecs):
+                existing = self._db.execute("SELECT row, list FROM entries WHERE namespace = ? AND id = ?", (namespace, str(v["id"]))).fetchone()
+                if existing: row, old_lst = existing
+                else:
+                    row = self.count; old_lst = None; self.count += 1
+                    if self.count > self._capacity: self._open_matrix(self._capacity * 2)
+                self._matrix[row] = vec
+                lst = int(self._assign(vec[None, :])[0]) if self._centroids is not None else None
+                if lst is not None and lst != old_lst: # New vector for an existing id may belong to another list
+                    if old_lst is not None: self._lists[old_lst].remove(row); self._list_arrays.pop(old_lst, None)
+                    self._lists[lst].append(row); self._list_arrays.pop(lst, None)
+                cols = self._filter_columns(v.get("metadata"))
+                if existing: self._db.execute("UPDATE entries SET data = ?, metadata = ?, list = ?, type = ?, ts = ?, url = ?, session = ? WHERE row = ?", (v.get("data"), json.dumps(v.get("metadata") or {}), lst, *cols, row))
+                else: self._db.execute("INSERT INTO entries (row, namespace, id, data, metadata, list, type, ts, url, session) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                       (row, namespace, str(v["id"]), v.get("data"), json.dumps(v.get("metadata") or {}), lst, *cols))
+            self._matrix.flush(); self._db.commit()
+            trained = int(self._setting("trained_count") or 0)
+            if self.count >= self.ivf_threshold and (self._centroids is None or self.count > 4 * trained): self._train()
+        return "Success"
+
+    def update(self, id, metadata=None, data=None, namespace="", **kwargs):
+        with self._lock:
+            if metadata is not None: self._db.execute("UPDATE entries SET metadata = ?, type = ?, ts = ?, url = ?, session = ? WHERE namespace = ? AND id = ?", (json.dumps(metadata), *self._filter_columns(metadata), namespace, str(id)))
+            if data is not None: self._db.execute("UPDATE entries SET data = ? WHERE namespace = ? AND id = ?", (data, namespace, str(id)))
+            self._db.commit()
+        return True
+
+    def embed_vector(self, vector):
+        vec = self.np.asarray(vector, dtype=self.np.float32); norm = self.np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _assign(self, vecs): return self.np.argmax(vecs @ self._centroids.T, axis=1)
+
+    def _train(self, iterations=10, sample_size=50_000):
+        """(Re)builds the IVF centroids with spherical k-means over a sample, then reassigns every row."""
+        np = self.np; rng = np.random.default_rng(0)
+        nlist = int(min(4096, max(16, self.count ** 0.5)))
+        sample_rows = np.sort(rng.choice(self.count, size=min(sample_size, self.count), replace=False))
+        sample = np.asarray(self._matrix[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for k in range(nlist):
+                members = sample[labels == k]
+                if len(members): centroids[k] = members.sum(axis=0)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        self._centroids = centroids; self._lists = defaultdict(list); self._list_arrays = {}
+        updates = []
+        for start in range(0, self.count, self.SCAN_CHUNK):
+            block = np.asarray(self._matrix[start:min(start + self.SCAN_CHUNK, self.count)], dtype=np.float32) # Rows past count are unused capacity
+            for offset, lst in enumerate(self._assign(block)):
+                self._lists[int(lst)].append(start + offset); updates.append((int(lst), start + offset))
+        self._db.executemany("UPDATE entries SET list = ? WHERE row = ?", updates)
+        self._set_setting("trained_count", self.count); self._db.commit()
+        np.save(self.path / "centroids.npy", centroids)
+        logger.info(f"Local vector index trained: {nlist} lists over {self.count} entries.")
+
+    def _candidate_rows(self, q):
+        np = self.np
+        if self._centroids is None: return None
+        probe = np.argsort(-(self._centroids @ q))[:self.nprobe]
+        arrays = []
+        for lst in probe:
+            lst = int(lst)
+            if lst not in self._list_arrays: self._list_arrays[lst] = np.asarray(self._lists.get(lst, []), dtype=np.int64)
+            arrays.append(self._list_arrays[lst])
+        return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+
+    def _filtered_rows(self, namespace="", filters=None):
+        """Rows in the namespace matching `filters` (indexed SQL), or None when nothing restricts the scan."""
+        clauses, params = [], []
+        if namespace or self._multi_namespace: clauses.append("namespace = ?"); params.append(namespace)
+        filters = filters or {}
+        types = filters.get("type")
+        if types:
+            types = [types] if isinstance(types, str) else list(types)
+            clauses.append(f"type IN ({', '.join('?' * len(types))})"); params.extend(types)
+        if filters.get("since") is not None: clauses.append("ts >= ?"); params.append(float(filters["since"]))
+        if filters.get("until") is not None: clauses.append("ts <= ?"); params.append(float(filters["until"]))
+        if filters.get("url"):
+            clauses.append("url GLOB ?" if "*" in filters["url"] else "url = ?"); params.append(filters["url"])
+        if filters.get("session"): clauses.append("session = ?"); params.append(filters["session"])
+        if not clauses: return None
+        rows = self._db.execute(f"SELECT row FROM entries WHERE {' AND '.join(clauses)}", params).fetchall()
+        return self.np.fromiter((r[0] for r in rows), dtype=self.np.int64, count=len(rows))
+
+    def query(self, data=None, vector=None, top_k=10, include_metadata=False, include_data=False, namespace="", filters=None, **kwargs):
+        np = self.np
+        if not self.count: return []
+        q = self.embed([data])[0] if vector is None else self.embed_vector(vector)
+        with self._lock:
+            allowed = self._filtered_rows(namespace, filters)
+            # Small partitions are scanned exactly; large ones go through IVF and are then masked
+            rows = self._candidate_rows(q) if allowed is None or len(allowed) > self.PREFILTER_SCAN_LIMIT else None
+            if allowed is not None: rows = allowed if rows is None else rows[np.isin(rows, allowed)]
+            if rows is None:
+                scores = np.concatenate([np.asarray(self._matrix[s:min(s + self.SCAN_CHUNK, self.count)], dtype=np.float32) @ q for s in range(0, self.count, self.SCAN_CHUNK)])
+                rows = np.arange(self.count)
+            else: scores = np.asarray(self._matrix[rows], dtype=np.float32) @ q if len(rows) else np.empty(0, dtype=np.float32)
+            if not len(rows): return []
+            k = min(top_k, len(rows)); best = np.argpartition(-scores, k - 1)[:k]; best = best[np.argsort(-scores[best])]
+            results = []
+            for b in best:
+                ident, text, meta = self._db.execute("SELECT id, data, metadata FROM entries WHERE row = ?", (int(rows[b]),)).fetchone()
+                results.append(SimpleNamespace(id=ident, score=min(1.0, float((1 + scores[b]) / 2)), # Same [0, 1] scale as Upstash cosine
+                                               data=text if include_data else None, metadata=json.loads(meta) if include_metadata else None))
+            return results
+
+    def info(self): return SimpleNamespace(vector_count=self.count, dimension=self.dim, index_size=self.count * self.dim * 2)
+
 class VectorDB:
-    def __init__(self):
+    BACKENDS = ("upstash", "local", "auto")
+
+    def __init__(self, backend=None, index=None, namespace=None):
         self.initialized = False
-        self.index = None
+        self.index = index
+        self.writer = None
+        self.namespace = namespace if namespace is not None else os.environ.get("VECTOR_DB_NAMESPACE", "")
+        self.dedup = ContentDeduplicator(
+            near_dup=os.environ.get("VECTOR_DB_NEAR_DUP", "").lower() in ("1", "true", "yes"),
+            max_hamming=int(os.environ.get("VECTOR_DB_NEAR_DUP_BITS", 3)),
+        )
+        # Cache keys include write_version, so any accepted write makes older entries unreachable
+        self.query_cache = LRUTTLCache(
+            max_entries=int(os.environ.get("VECTOR_DB_QUERY_CACHE_SIZE", 256)),
+            ttl=float(os.environ.get("VECTOR_DB_QUERY_CACHE_TTL", 300)),
+        )
+        self.write_version = 0; self._version_lock = threading.Lock() # Writes arrive from tool threads and the event loop
+        self.embedder = None # Client-side embedding for remote indexes (VECTOR_DB_EMBED_CLIENT_SIDE=1)
+        self._async_index = None # upstash_vector.AsyncIndex, created on first asearch()
+        self.backend = "custom" if index is not None else (backend or os.environ.get("VECTOR_DB_BACKEND", "upstash")).lower()
+        if index is not None: self.initialized = True
+        if self.backend in ("upstash", "auto"): self._init_upstash()
+        if self.backend == "local" or (self.backend == "auto" and not self.initialized): self._init_local()
+        if self.backend not in self.BACKENDS + ("custom",): logger.error(f"Unknown VECTOR_DB_BACKEND '{self.backend}'.")
+        if self.initialized and self.backend == "upstash" and os.environ.get("VECTOR_DB_EMBED_CLIENT_SIDE", "").lower() in ("1", "true", "yes"):
+            try: self.embedder = EmbeddingPipeline()
+            except ImportError as e: logger.error(f"Client-side embedding needs numpy/sentence-transformers: {e}")
+        if self.initialized and os.environ.get("VECTOR_DB_WRITE_BEHIND", "1").lower() not in ("0", "false", "no"):
+            self.writer = VectorDBWriter(
+                self.index,
+                batch_size=int(os.environ.get("VECTOR_DB_BATCH_SIZE", 32)),
+                flush_interval=float(os.environ.get("VECTOR_DB_FLUSH_INTERVAL", 0.5)),
+                max_queue=int(os.environ.get("VECTOR_DB_MAX_QUEUE", 1000)),
+                embedder=self.embedder,
+                on_lost=self._forget,
+            )
+            atexit.register(self.close)
+
+    def _init_upstash(self):
         try:
             from upstash_vector import Index
             
@@ -170,7 +804,50 @@ class VectorDB:
         except Exception as e:
             logger.error(f"Upstash Vector DB initialization failed: {e}", exc_info=True)
 
-    def add(self, text, metadata=None):
+    def _init_local(self):
+        try:
+            self.index = LocalVectorIndex()
+            self.initialized = True
+            logger.info("Local Vector DB initialized successfully")
+        except ImportError as e:
+            logger.error(f"Local vector index needs numpy/sentence-transformers: {e}")
+        except Exception as e:
+            logger.error(f"Local Vector DB initialization failed: {e}", exc_info=True)
+
+    def _prepare_record(self, text, metadata, namespace, vector=None):
+        """Builds the upsert record for `text`, or returns None when the write is a duplicate."""
+        # Numeric timestamp + session id make time-range and session filters pushable
+        metadata = dict(metadata or {}); metadata.setdefault("ts", time.time())
+        if CURRENT_SESSION.get(): metadata.setdefault("session", CURRENT_SESSION.get())
+
+        # Content-hash ID: the same text always maps to the same vector
+        vector_id, action = self.dedup.check(text, metadata, namespace)
+        if action in ("duplicate", "near_duplicate"):
+            logger.debug(f"VDB add skipped ({action}): {text[:50]}...")
+            return None
+
+        # Add to vector store with proper format for Upstash Vector
+        record = {
+            "id": vector_id,
+            "data": text,  # Using data field instead of values
+            "metadata": metadata,
+            "namespace": namespace
+        }
+        if vector is not None: record["vector"] = [float(x) for x in vector]
+        if action == "refresh": record["refresh"] = True
+        with self._version_lock: self.write_version += 1
+        return record
+
+    def _write_now(self, records):
+        """Synchronous write path (write-behind disabled)."""
+        try: VectorDBWriter.write_records(self.index, self.embedder, records)
+        except Exception: self._forget(records); raise
+
+    def _forget(self, records):
+        """Records that never reached the index must not count as seen by the deduplicator."""
+        for r in records: self.dedup.forget(r["id"], r["namespace"])
+
+    def add(self, text, metadata=None, namespace=None, vector=None, block=True):
         if not self.is_ready():
             logger.warning("VDB add skipped: Not initialized.")
             return False
@@ -179,16 +856,10 @@ class VectorDB:
             return False
 
         try:
-            # Create a unique ID for the vector
-            import uuid
-            vector_id = str(uuid.uuid4())
-
-            # Add to vector store with proper format for Upstash Vector
-            self.index.upsert([{
-                "id": vector_id,
-                "data": text,  # Using data field instead of values
-                "metadata": metadata or {}
-            }])
+            record = self._prepare_record(text, metadata, self.namespace if namespace is None else namespace, vector)
+            if record is None: return True
+            if self.writer: return self.writer.submit(record, block)
+            self._write_now([record])
             
             logger.debug(f"Added VDB entry: {text[:50]}...")
             return True
@@ -196,41 +867,163 @@ class VectorDB:
             logger.error(f"VDB add error: {e}", exc_info=True)
             return False
 
-    def search(self, query, top_k=3):
+    def add_many(self, texts, metadatas=None, namespace=None, vectors=None, block=True):
+        """Bulk add (scrape chunks, search snippets): embedded and upserted as one batch. Returns #accepted."""
+        if not self.is_ready():
+            logger.warning("VDB add_many skipped: Not initialized.")
+            return 0
+        namespace = self.namespace if namespace is None else namespace
+        metadatas = metadatas or [None] * len(texts); vectors = vectors if vectors is not None else [None] * len(texts)
+        try:
+            records = [self._prepare_record(t, m, namespace, v) for t, m, v in zip(texts, metadatas, vectors) if t and isinstance(t, str)]
+            records = [r for r in records if r is not None]
+            if self.writer: return sum(self.writer.submit(r, block) for r in records)
+            if records: self._write_now(records)
+            logger.debug(f"Added {len(records)} VDB entries in one batch.")
+            return len(records)
+        except Exception as e:
+            logger.error(f"VDB add_many error: {e}", exc_info=True)
+            return 0
+
+    async def aadd(self, text, metadata=None, namespace=None, vector=None):
+        """Async add: with write-behind add() only enqueues, never waiting on a full queue (the record is dropped
+        instead of blocking the event loop); otherwise the upsert runs on a worker thread."""
+        if self.writer: return self.add(text, metadata, namespace, vector, block=False)
+        return await asyncio.to_thread(self.add, text, metadata, namespace, vector)
+
+    async def aadd_many(self, texts, metadatas=None, namespace=None, vectors=None):
+        if self.writer: return self.add_many(texts, metadatas, namespace, vectors, block=False)
+        return await asyncio.to_thread(self.add_many, texts, metadatas, namespace, vectors)
+
+    def _query_cache_key(self, query, top_k, filters=None, namespace=""):
+        return (self.write_version, namespace, self.dedup.normalize(query).casefold(), top_k, json.dumps(filters, sort_keys=True, default=str) if filters else None)
+
+    @staticmethod
+    def _quote(value): return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+    def _upstash_filter(self, filters):
+        """Translates a filter dict (type, since, until, url, session) into an Upstash metadata filter."""
+        clauses = []
+        types = filters.get("type")
+        if types:
+            types = [types] if isinstance(types, str) else list(types)
+            clauses.append(f"type IN ({', '.join(self._quote(t) for t in types)})")
+        if filters.get("since") is not None: clauses.append(f"ts >= {float(filters['since'])}")
+        if filters.get("until") is not None: clauses.append(f"ts <= {float(filters['until'])}")
+        if filters.get("url"): clauses.append(f"url {'GLOB' if '*' in filters['url'] else '='} {self._quote(filters['url'])}")
+        if filters.get("session"): clauses.append(f"session = {self._quote(filters['session'])}")
+        return " AND ".join(clauses)
+
+    def _search_key(self, query, top_k, filters, namespace):
+        namespace = self.namespace if namespace is None else namespace
+        filters = {k: v for k, v in (filters or {}).items() if v not in (None, "", [])}
+        return namespace, filters, self._query_cache_key(query, top_k, filters, namespace)
+
+    def _query_kwargs(self, query, filters, namespace, vector):
+        # Filters are pushed down so only the matching partition is ranked
+        query_kwargs = {"namespace": namespace} if namespace else {}
+        if filters:
+            if getattr(self.index, "STRUCTURED_FILTERS", False): query_kwargs["filters"] = filters
+            else: query_kwargs["filter"] = self._upstash_filter(filters)
+        if vector is None and self.embedder is not None: vector = self.embedder.embed([query])[0]
+        if vector is not None: query_kwargs["vector"] = [float(x) for x in vector]
+        else: query_kwargs["data"] = query  # FIX: use 'data' instead of 'query'
+        return query_kwargs
+
+    @staticmethod
+    def _format_matches(results):
+        return [{
+            "text": getattr(match, "data", "") or "",
+            "similarity": getattr(match, "score", 0.0),
+            "metadata": getattr(match, "metadata", {}) or {}
+        } for match in results]
+
+    def search(self, query, top_k=3, filters=None, namespace=None, vector=None):
         if not self.is_ready():
             logger.error("VDB search fail: Not initialized.")
             raise VectorDBError("VDB not initialized")
 
+        namespace, filters, cache_key = self._search_key(query, top_k, filters, namespace)
+        cached = self.query_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"VDB search '{query[:30]}...' served from cache.")
+            return list(cached)
+
+        # Read-your-writes: give buffered entries a moment to land before querying
+        if self.writer: self.writer.flush(timeout=2.0)
         try:
-            # Perform vector search
             results = self.index.query(
-                data=query,  # FIX: use 'data' instead of 'query'
                 top_k=top_k,
-                include_metadata=True
+                include_metadata=True,
+                include_data=True,
+                **self._query_kwargs(query, filters, namespace, vector)
             )
-
-            formatted_results = []
-            for match in results:
-                formatted_results.append({
-                    "text": getattr(match, "data", ""),
-                    "similarity": getattr(match, "score", 0.0),
-                    "metadata": getattr(match, "metadata", {})
-                })
+            formatted_results = self._format_matches(results)
 
             logger.info(f"VDB search '{query[:30]}...' returned {len(formatted_results)} results.")
-            return formatted_results
+            self.query_cache.set(cache_key, formatted_results)
+            return list(formatted_results)
 
         except Exception as e:
             logger.error(f"VDB search error: {e}", exc_info=True)
             raise VectorDBError(f"VDB search failed: {e}")
 
+    def _get_async_index(self):
+        """Upstash's AsyncIndex (same env config as Index); None for local/custom indexes or if unavailable."""
+        if self.backend != "upstash": return None
+        if self._async_index is None:
+            try: self._async_index = lazy_import("upstash_vector").AsyncIndex.from_env()
+            except Exception as e: logger.warning(f"Upstash AsyncIndex unavailable, async search uses threads: {e}"); self._async_index = False
+        return self._async_index or None
+
+    async def asearch(self, query, top_k=3, filters=None, namespace=None, vector=None):
+        """Async search: cache hits return inline, Upstash is queried via AsyncIndex; the local index
+        and client-side embedding are CPU-bound and run on a worker thread."""
+        if not self.is_ready(): raise VectorDBError("VDB not initialized")
+        namespace, filters, cache_key = self._search_key(query, top_k, filters, namespace)
+        cached = self.query_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"VDB search '{query[:30]}...' served from cache.")
+            return list(cached)
+        async_index = self._get_async_index() if self.embedder is None or vector is not None else None
+        if async_index is None: return await asyncio.to_thread(self.search, query, top_k, filters, namespace, vector)
+
+        if self.writer: await asyncio.to_thread(self.writer.flush, 2.0)
+        try:
+            results = await async_index.query(top_k=top_k, include_metadata=True, include_data=True, **self._query_kwargs(query, filters, namespace, vector))
+            formatted_results = self._format_matches(results)
+        except Exception as e:
+            logger.error(f"VDB async search error: {e}", exc_info=True)
+            raise VectorDBError(f"VDB search failed: {e}")
+        logger.info(f"VDB search '{query[:30]}...' returned {len(formatted_results)} results.")
+        self.query_cache.set(cache_key, formatted_results)
+        return list(formatted_results)
+
     def is_ready(self):
         return self.initialized and self.index is not None
-vector_db = VectorDB()
+
+    def stats(self):
+        return {
+            **(self.writer.stats() if self.writer else {}),
+            **{f"dedup_{k}": v for k, v in self.dedup.counters.items()},
+            **{f"query_cache_{k}": v for k, v in self.query_cache.stats().items()},
+            **{f"embedding_{k}": v for k, v in (self.embedder or getattr(self.index, "embedder", None) or SimpleNamespace(counters={})).counters.items()},
+        }
+
+    def close(self):
+        """Flushes buffered writes; registered with atexit."""
+        if self.writer:
+            self.writer.close()
+            logger.info(f"VDB writer closed: {self.writer.stats()}")
+with startup_phase("vector_db"):
+    vector_db = VectorDB()
 
 # --- Tool Implementation (Object-Oriented) ---
 # (Base Tool class and specific tool implementations unchanged - use logger internally)
 class Tool:
+    max_concurrency = None # Max parallel executions of this tool within the shared pool (None = pool size)
+    speculative = True # May start before the model's stream has finished (SpeculativeToolRunner); False for side effects or per-call billing
+    cache_ttl = None # Seconds to memoise successful results (ToolResultCache); None = never cached
     def __init__(self, name, description, parameters=None, required=None):
         self.name = name; self.description = description
         if parameters and not isinstance(parameters, dict): raise ValueError("Params must be dict.")
@@ -238,79 +1031,323 @@ class Tool:
         if required and not isinstance(required, list): raise ValueError("Required must be list.")
         self.required = required or []
         if self.required: self.parameters["required"] = self.required
-    def get_schema(self): return {"type": "function", "function": {"name": self.name, "description": self.description, "parameters": self.parameters}}
+        self._slot = threading.BoundedSemaphore(self.max_concurrency) if self.max_concurrency else contextlib.nullcontext() # Built eagerly: tools are shared across sessions/threads
+    def get_schema(self):
+        if getattr(self, "_schema", None) is None: self._schema = {"type": "function", "function": {"name": self.name, "description": self.description, "parameters": self.parameters}}
+        return self._schema
     def validate_args(self, args):
         if not isinstance(args, dict): raise ToolExecutionError("Args must be dict.")
         missing = [p for p in self.required if p not in args or args[p] is None]
         if missing: raise ToolExecutionError(f"Missing required: {', '.join(missing)}")
         return True
     def execute(self, **kwargs): raise NotImplementedError("Subclass must implement")
+    def concurrency_slot(self): return self._slot
+    def cacheable(self, args): return self.cache_ttl is not None # Only idempotent, read-only calls
+    def invalidates_cache(self, args): return False # True for writes that make cached reads of this tool stale
+    def cache_key_args(self, args):
+        """Canonical form of `args` for result caching; subclasses fold in defaults and normalise values."""
+        return {k: (" ".join(v.split()) if isinstance(v, str) else v) for k, v in args.items() if v not in (None, "", [], {})}
+    async def aexecute(self, **kwargs):
+        """Async entry point. Default: run execute() on the tool pool, so blocking or CPU-bound tools never stall the event loop."""
+        ctx = contextvars.copy_context() # Carry CURRENT_SESSION into the worker thread
+        return await asyncio.get_running_loop().run_in_executor(get_tool_executor(), functools.partial(ctx.run, self.execute, **kwargs))
+    def async_slot(self):
+        """Event-loop counterpart of concurrency_slot() (asyncio.Semaphore, one per loop)."""
+        loop = asyncio.get_running_loop()
+        if getattr(self, "_aslot_loop", None) is not loop: self._aslot = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else contextlib.nullcontext(); self._aslot_loop = loop
+        return self._aslot
+
+class ToolResultCache:
+    """Memoises successful results of idempotent tool calls, keyed on tool name + canonicalised arguments.
+
+    A tool opts in with `cache_ttl` and `cacheable(args)`; mutating calls are never cached and, when
+    `invalidates_cache(args)` is true, drop every cached result of that tool. TTLs can be overridden per
+    tool with AGENT_TOOL_CACHE_TTL='{"get_current_weather": 300}' (0 disables); AGENT_TOOL_CACHE=0 turns
+    the cache off. The memory tier is an LRUTTLCache; AGENT_TOOL_CACHE_DISK=1 adds a SQLite tier
+    (AGENT_TOOL_CACHE_PATH) that survives restarts and is shared between processes.
+    """
+    def __init__(self, max_entries=None, disk_path=None, enabled=None, ttl_overrides=None):
+        self.enabled = enabled if enabled is not None else os.environ.get("AGENT_TOOL_CACHE", "1").lower() not in ("0", "false", "no")
+        self.memory = LRUTTLCache(max_entries=int(max_entries or os.environ.get("AGENT_TOOL_CACHE_SIZE", 512)))
+        self.ttl_overrides = ttl_overrides if ttl_overrides is not None else json.loads(os.environ.get("AGENT_TOOL_CACHE_TTL", "{}"))
+        self.counters = defaultdict(lambda: {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "invalidations": 0})
+        self._generations = defaultdict(int) # Bumped by invalidation; part of the memory key
+        self._lock = threading.Lock(); self.disk = None; self._disk_stores = 0
+        if disk_path is None and os.environ.get("AGENT_TOOL_CACHE_DISK", "").lower() in ("1", "true", "yes"):
+            disk_path = os.environ.get("AGENT_TOOL_CACHE_PATH", os.path.join(".agent_cache", "tool_results.sqlite"))
+        if disk_path and self.enabled:
+            os.makedirs(os.path.dirname(disk_path) or ".", exist_ok=True)
+            self.disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self.disk.execute("PRAGMA journal_mode=WAL")
+            self.disk.execute("CREATE TABLE IF NOT EXISTS tool_results (key TEXT PRIMARY KEY, tool TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL)")
+            self.disk.execute("CREATE INDEX IF NOT EXISTS tool_results_expires ON tool_results (expires)")
+        self.disk_max_rows = int(os.environ.get("AGENT_TOOL_CACHE_DISK_ROWS", 10_000))
+
+    def ttl_for(self, tool, args):
+        if not self.enabled or not tool.cacheable(args): return None
+        ttl = self.ttl_overrides.get(tool.name, tool.cache_ttl)
+        return ttl if ttl and ttl > 0 else None
+
+    def _digest(self, tool, args):
+        canonical = json.dumps(tool.cache_key_args(args), sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(f"{tool.name}\0{canonical}".encode("utf-8")).hexdigest()
+
+    def get(self, tool, args):
+        """Cached result for this call, or None (also None for calls that are not cacheable)."""
+        if self.ttl_for(tool, args) is None: return None
+        digest = self._digest(tool, args); counters = self.counters[tool.name]
+        result = self.memory.get((tool.name, self._generations[tool.name], digest))
+        if result is not None: counters["hits"] += 1; return result
+        if self.disk is not None:
+            with self._lock: row = self.disk.execute("SELECT value, expires FROM tool_results WHERE key = ?", (digest,)).fetchone()
+            if row and row[1] > time.time():
+                result = json.loads(row[0]); counters["disk_hits"] += 1
+                self.memory.set((tool.name, self._generations[tool.name], digest), result, ttl=row[1] - time.time())
+                return result
+        counters["misses"] += 1
+        return None
+
+    def generation(self, tool_name):
+        """Invalidation generation of a tool; read it before executing a call and pass it to record()."""
+        with self._lock: return self._generations[tool_name]
+
+    def record(self, tool, args, result, generation=None):
+        """Stores a successful result, or invalidates the tool's entries after a mutating call.
+
+        A result is not stored if the tool was invalidated since `generation` was read: the call may
+        have run before the write and would otherwise be served as current.
+        """
+        if not self.enabled: return
+        if tool.invalidates_cache(args): self.invalidate(tool.name); return
+        ttl = self.ttl_for(tool, args)
+        if ttl is None or result is None: return
+        digest = self._digest(tool, args)
+        with self._lock:
+            if generation is not None and generation != self._generations[tool.name]: return
+            self.counters[tool.name]["stores"] += 1
+            self.memory.set((tool.name, self._generations[tool.name], digest), result, ttl=ttl)
+            if self.disk is not None:
+                self.disk.execute("INSERT OR REPLACE INTO tool_results (key, tool, value, expires) VALUES (?, ?, ?, ?)", (digest, tool.name, json.dumps(result, default=str), time.time() + ttl))
+                self._disk_stores += 1
+                if self._disk_stores % 100 == 0: self._prune_disk()
+
+    def _prune_disk(self):
+        self.disk.execute("DELETE FROM tool_results WHERE expires <= ?", (time.time(),))
+        self.disk.execute("DELETE FROM tool_results WHERE key IN (SELECT key FROM tool_results ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.disk_max_rows,))
+
+    def invalidate(self, tool_name):
+        with self._lock:
+            self._generations[tool_name] += 1 # Older memory entries become unreachable and age out of the LRU
+            if self.disk is not None: self.disk.execute("DELETE FROM tool_results WHERE tool = ?", (tool_name,))
+        self.counters[tool_name]["invalidations"] += 1
+        logger.info(f"Tool cache invalidated for '{tool_name}'.")
+
+    def stats(self):
+        return {"memory": self.memory.stats(), "disk": self.disk is not None, "tools": {name: dict(c) for name, c in self.counters.items()}}
+
+tool_result_cache = ToolResultCache()
+
+# --- Shared HTTP Connection Pools ---
+# Every HTTP call goes through one keep-alive pool (requests for threads, httpx for the event loop),
+# so short API calls reuse connections instead of paying a TCP+TLS handshake each time.
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("AGENT_HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.environ.get("AGENT_HTTP_READ_TIMEOUT", 30))
+HTTP_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+HTTP_SLOW_TIMEOUT = (HTTP_CONNECT_TIMEOUT, float(os.environ.get("AGENT_HTTP_SLOW_READ_TIMEOUT", 120))) # Image generation, scraping
+HTTP_POOL_HOSTS = int(os.environ.get("AGENT_HTTP_POOL_HOSTS", 16)) # Hosts that keep a connection pool
+HTTP_POOL_SIZE = int(os.environ.get("AGENT_HTTP_POOL_SIZE", 16)) # Keep-alive connections per host
+HTTP_ASYNC_MAX_CONNECTIONS = int(os.environ.get("AGENT_HTTP_ASYNC_MAX_CONNECTIONS", 200))
+_http_session = None; _http_session_lock = threading.Lock()
+_async_http_clients = weakref.WeakKeyDictionary()
+_async_http_counters = defaultdict(int)
+
+def get_http_session():
+    """Process-wide requests.Session: per-host keep-alive pools and HTTP_TIMEOUT unless a call passes its own."""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                requests = lazy_import("requests")
+                class PooledSession(requests.Session):
+                    def request(self, method, url, **kwargs):
+                        kwargs.setdefault("timeout", HTTP_TIMEOUT); return super().request(method, url, **kwargs)
+                session = PooledSession()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter); session.mount("https://", adapter)
+                _http_session = session
+    return _http_session
+
+def async_timeout(timeout=HTTP_TIMEOUT):
+    return lazy_import("httpx").Timeout(timeout[1], connect=timeout[0])
+
+def get_async_http_client():
+    """Shared httpx.AsyncClient for the running loop (HTTP/2 when `h2` is installed); None without httpx (tools then fall back to threads)."""
+    try: httpx = lazy_import("httpx")
+    except ImportError: return None
+    loop = asyncio.get_running_loop(); client = _async_http_clients.get(loop)
+    if client is None or client.is_closed:
+        async def count_response(response): _async_http_counters["requests"] += 1; _async_http_counters[response.http_version] += 1
+        http2 = lazy_import("importlib.util").find_spec("h2") is not None
+        client = _async_http_clients[loop] = httpx.AsyncClient(http2=http2, timeout=async_timeout(), event_hooks={"response": [count_response]},
+                                                               limits=httpx.Limits(max_connections=HTTP_ASYNC_MAX_CONNECTIONS, max_keepalive_connections=HTTP_POOL_SIZE * 4))
+    return client
+
+def http_pool_stats():
+    """Connection reuse for the shared pools: requests sent vs. new connections opened (sync), requests per HTTP version (async)."""
+    stats = {"requests": 0, "connections": 0, "hosts": 0}
+    if _http_session is not None:
+        for adapter in {id(a): a for a in _http_session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None: continue
+                stats["requests"] += pool.num_requests; stats["connections"] += pool.num_connections; stats["hosts"] += 1
+    stats["reuse_rate"] = round(1 - stats["connections"] / stats["requests"], 3) if stats["requests"] else 0.0
+    stats["async"] = dict(_async_http_counters)
+    return stats
 
 class WeatherTool(Tool):
+    max_concurrency = 8
+    cache_ttl = 600 # Conditions change slowly
+    def cache_key_args(self, args): return {"location": " ".join(str(args.get("location", "")).split()).casefold(), "unit": args.get("unit") or "celsius"}
     def __init__(self): super().__init__(name="get_current_weather", description="Retrieves real-time weather conditions for a specific city.", parameters={"type": "object", "properties": { "location": {"type": "string", "description": "City name."}, "unit": {"type": "string", "enum": ["celsius", "fahrenheit"], "description": "Temp unit."}}}, required=["location"])
     def execute(self, **kwargs):
-        self.validate_args(kwargs); l = kwargs.get("location"); u = kwargs.get("unit", "celsius")
+        self.validate_args(kwargs); l = kwargs.get("location"); u = kwargs.get("unit", "celsius"); requests = lazy_import("requests")
         if not openweathermap_api_key: raise ToolExecutionError("Weather key missing.")
-        url="http://api.openweathermap.org/data/2.5/weather";unts="metric" if u=="celsius" else "imperial";sym="°C" if u=="celsius" else "°F";p={"q":l,"appid":openweathermap_api_key,"units":unts}
+        url, p, sym = self._request(l, u)
         retries=3;delay=1
         for attempt in range(retries):
             try:
-                r=requests.get(url, params=p, timeout=10);r.raise_for_status();data=r.json()
-                if data.get("cod") != 200: raise ToolExecutionError(f"Weather API Error: {data.get('message', 'Unknown')}")
-                m=data.get("main",{});w=data.get("weather",[{}]);d=w[0].get('description',"");t=m.get('temp');f=m.get('feels_like');h=m.get('humidity')
-                res=f"Weather in {data.get('name', l)}: {d}, Temp: {t}{sym} (feels like {f}{sym}), Humidity: {h}%"
+                r=get_http_session().get(url, params=p);r.raise_for_status();res=self._format(r.json(), l, sym)
                 if vector_db.is_ready(): vector_db.add(f"Weather: {l}({u}): {res}", {"type": "weather", "location": l, "time": datetime.now().isoformat()})
                 return res
             except requests.exceptions.Timeout: logger.warning(f"Weather timeout {l} (try {attempt+1}). Retrying...")
-            except requests.exceptions.HTTPError as e:
-                 if e.response.status_code == 404: raise ToolExecutionError(f"City '{l}' not found.")
-                 elif e.response.status_code == 401: raise ToolExecutionError("Invalid Weather API key.")
-                 else: logger.error(f"Weather HTTP error: {e}"); raise ToolExecutionError(f"HTTP error {e.response.status_code}")
+            except requests.exceptions.HTTPError as e: self._raise_status(e, l)
             except requests.exceptions.RequestException as e: logger.error(f"Weather network error: {e}"); raise ToolExecutionError(f"Network error: {e}")
             except Exception as e: logger.error(f"Unexpected weather error: {e}"); raise ToolExecutionError(f"Unexpected error: {e}")
             time.sleep(delay); delay *= 2
         raise ToolExecutionError(f"Weather fetch failed after {retries} attempts.")
+    async def aexecute(self, **kwargs):
+        client = get_async_http_client()
+        if client is None: return await super().aexecute(**kwargs)
+        self.validate_args(kwargs); l = kwargs.get("location"); u = kwargs.get("unit", "celsius"); httpx = lazy_import("httpx")
+        if not openweathermap_api_key: raise ToolExecutionError("Weather key missing.")
+        url, p, sym = self._request(l, u)
+        retries=3;delay=1
+        for attempt in range(retries):
+            try:
+                r=await client.get(url, params=p);r.raise_for_status();res=self._format(r.json(), l, sym)
+                if vector_db.is_ready(): await vector_db.aadd(f"Weather: {l}({u}): {res}", {"type": "weather", "location": l, "time": datetime.now().isoformat()})
+                return res
+            except httpx.TimeoutException: logger.warning(f"Weather timeout {l} (try {attempt+1}). Retrying...")
+            except httpx.HTTPStatusError as e: self._raise_status(e, l)
+            except httpx.RequestError as e: logger.error(f"Weather network error: {e}"); raise ToolExecutionError(f"Network error: {e}")
+            except ToolExecutionError: raise
+            except Exception as e: logger.error(f"Unexpected weather error: {e}"); raise ToolExecutionError(f"Unexpected error: {e}")
+            await asyncio.sleep(delay); delay *= 2
+        raise ToolExecutionError(f"Weather fetch failed after {retries} attempts.")
+    @staticmethod
+    def _request(l, u):
+        unts="metric" if u=="celsius" else "imperial";sym="°C" if u=="celsius" else "°F"
+        return "http://api.openweathermap.org/data/2.5/weather", {"q":l,"appid":openweathermap_api_key,"units":unts}, sym
+    @staticmethod
+    def _format(data, l, sym):
+        if data.get("cod") != 200: raise ToolExecutionError(f"Weather API Error: {data.get('message', 'Unknown')}")
+        m=data.get("main",{});w=data.get("weather",[{}]);d=w[0].get('description',"");t=m.get('temp');f=m.get('feels_like');h=m.get('humidity')
+        return f"Weather in {data.get('name', l)}: {d}, Temp: {t}{sym} (feels like {f}{sym}), Humidity: {h}%"
+    @staticmethod
+    def _raise_status(e, l):
+        if e.response.status_code == 404: raise ToolExecutionError(f"City '{l}' not found.")
+        elif e.response.status_code == 401: raise ToolExecutionError("Invalid Weather API key.")
+        else: logger.error(f"Weather HTTP error: {e}"); raise ToolExecutionError(f"HTTP error {e.response.status_code}")
 class SearchTool(Tool):
+    max_concurrency = 2 # DuckDuckGo rate-limits bursts
+    cache_ttl = 3600
+    def cache_key_args(self, args): return {"query": " ".join(str(args.get("query", "")).split()).casefold()}
     def __init__(self): super().__init__(name="perform_web_search", description="General web search for facts/current info.", parameters={"type": "object", "properties": {"query": {"type": "string", "description": "Search query."}}}, required=["query"])
     def execute(self, **kwargs):
         self.validate_args(kwargs); q = kwargs.get("query"); logger.info(f"Searching: {q}")
         try:
+            DDGS = lazy_import("duckduckgo_search").DDGS
             with DDGS() as ddgs: results = list(ddgs.text(q, max_results=5))
             if not results: return f"No results for '{q}'."
-            fmt = []
-            for r in results:
-                txt = f"Title: {r.get('title','N/A')}\nSnippet: {r.get('body','N/A')}\nURL: {r.get('href','N/A')}"
-                fmt.append(txt)
-                if vector_db.is_ready(): vector_db.add(f"Search snippet '{q}': {r.get('title', '')} - {r.get('body', '')}", {"type": "search_result", "url": r.get('href'), "query": q, "time": datetime.now().isoformat()})
-            return f"Search results for '{q}':\n\n" + "\n\n---\n\n".join(fmt)
+            if vector_db.is_ready(): vector_db.add_many(*self._memory_records(q, results))
+            return self._format(q, results)
+        except Exception as e: logger.error(f"Search error: {e}"); raise ToolExecutionError(f"Search failed: {e}")
+    async def aexecute(self, **kwargs):
+        try: AsyncDDGS = getattr(lazy_import("duckduckgo_search"), "AsyncDDGS", None)
+        except ImportError: AsyncDDGS = None
+        if AsyncDDGS is None or not hasattr(AsyncDDGS, "atext"): return await super().aexecute(**kwargs) # duckduckgo_search>=7 dropped AsyncDDGS
+        self.validate_args(kwargs); q = kwargs.get("query"); logger.info(f"Searching: {q}")
+        try:
+            async with AsyncDDGS() as ddgs: results = list(await ddgs.atext(q, max_results=5) or [])
+            if not results: return f"No results for '{q}'."
+            if vector_db.is_ready(): await vector_db.aadd_many(*self._memory_records(q, results))
+            return self._format(q, results)
         except Exception as e: logger.error(f"Search error: {e}"); raise ToolExecutionError(f"Search failed: {e}")
+    @staticmethod
+    def _format(q, results):
+        fmt = [f"Title: {r.get('title','N/A')}\nSnippet: {r.get('body','N/A')}\nURL: {r.get('href','N/A')}" for r in results]
+        return f"Search results for '{q}':\n\n" + "\n\n---\n\n".join(fmt)
+    @staticmethod
+    def _memory_records(q, results):
+        now = datetime.now().isoformat()
+        return ([f"Search snippet '{q}': {r.get('title', '')} - {r.get('body', '')}" for r in results],
+                [{"type": "search_result", "url": r.get('href'), "query": q, "time": now} for r in results])
 class WebScraperTool(Tool):
+    max_concurrency = 4
+    speculative = False # Paid API call (Firecrawl credits)
+    cache_ttl = 86400
+    def cache_key_args(self, args):
+        # Scheme/host are case-insensitive and fragments never reach the server
+        parts = lazy_import("urllib.parse").urlsplit(str(args.get("url", "")).strip())
+        return {"url": parts._replace(scheme=parts.scheme.lower(), netloc=parts.netloc.lower(), path=parts.path or "/", fragment="").geturl()}
     def __init__(self): super().__init__(name="scrape_website_for_llm", description="Fetches main content of a specific URL as Markdown.", parameters={"type": "object", "properties": {"url": {"type": "string", "description": "URL to scrape."}}}, required=["url"])
+    # Firecrawl's REST endpoint is called directly so the sync and async paths share the pooled HTTP clients
+    # (and the SDK's call signatures differ across versions)
+    @staticmethod
+    def _endpoint(): return f"{os.environ.get('FIRECRAWL_API_URL', 'https://api.firecrawl.dev').rstrip('/')}/v1/scrape"
+    @staticmethod
+    def _markdown(url, body):
+        markdown_content = (body.get("data") or {}).get("markdown")
+        if not markdown_content:
+            error_msg = body.get('error', 'Markdown content not found or scrape failed.'); logger.warning(f"Scrape failed for {url}: {error_msg}"); raise ToolExecutionError(f"Scraping failed: {error_msg}")
+        logger.info(f"Scrape success: {url}")
+        return markdown_content
+    @staticmethod
+    def _http_error(e):
+        logger.error(f"Scrape HTTP error: {e}"); msg = f"Status {e.response.status_code}"
+        try: details = e.response.json(); msg += f". Details: {details.get('error', details.get('message', json.dumps(details)))}"
+        except json.JSONDecodeError: msg += f". Response: {e.response.text}"
+        return ToolExecutionError(f"Firecrawl API request failed. {msg}")
     def execute(self, **kwargs):
-        self.validate_args(kwargs); url = kwargs.get("url"); logger.info(f"Scraping URL: {url}")
+        self.validate_args(kwargs); url = kwargs.get("url"); logger.info(f"Scraping URL: {url}"); requests = lazy_import("requests")
         if not firecrawl_api_key: raise ToolExecutionError("Firecrawl API key missing.")
         try:
-            app = FirecrawlApp(api_key=firecrawl_api_key)
-            # Using user-specified call structure
-            scraped_data = app.scrape_url(url=url, params={'formats': ['markdown']})
-            markdown_content = None
-            if isinstance(scraped_data, dict): markdown_content = scraped_data.get('markdown')
-            elif isinstance(scraped_data, str): markdown_content = scraped_data
-            if markdown_content:
-                logger.info(f"Scrape success: {url}")
-                if vector_db.is_ready():
-                    chunks = self._chunk_content(markdown_content); logger.info(f"Storing {len(chunks)} chunks from {url} in VDB.")
-                    for i, chunk in enumerate(chunks): vector_db.add(chunk, {"type": "web_content", "url": url, "chunk": i+1, "total_chunks": len(chunks), "time": datetime.now().isoformat()})
-                return markdown_content
-            else:
-                error_msg = scraped_data.get('error', 'Markdown content not found or scrape failed.') if isinstance(scraped_data, dict) else "Scrape returned empty/unexpected data."
-                logger.warning(f"Scrape failed for {url}: {error_msg}"); raise ToolExecutionError(f"Scraping failed: {error_msg}")
-        except requests.exceptions.HTTPError as e:
-             logger.error(f"Scrape HTTP error: {e}"); msg = f"Status {e.response.status_code}"
-             try: details = e.response.json(); msg += f". Details: {details.get('error', details.get('message', json.dumps(details)))}"
-             except json.JSONDecodeError: msg += f". Response: {e.response.text}"
-             raise ToolExecutionError(f"Firecrawl API request failed. {msg}")
+            r = get_http_session().post(self._endpoint(), json={"url": url, "formats": ["markdown"]}, headers={"Authorization": f"Bearer {firecrawl_api_key}"}, timeout=HTTP_SLOW_TIMEOUT)
+            r.raise_for_status(); markdown_content = self._markdown(url, r.json())
+            if vector_db.is_ready(): vector_db.add_many(*self._memory_records(url, markdown_content))
+            return markdown_content
+        except requests.exceptions.HTTPError as e: raise self._http_error(e)
+        except ToolExecutionError: raise
         except Exception as e: logger.error(f"Scrape exception: {e}"); traceback.print_exc(); raise ToolExecutionError(f"Unexpected scrape error: {e}")
+    async def aexecute(self, **kwargs):
+        client = get_async_http_client()
+        if client is None: return await super().aexecute(**kwargs)
+        self.validate_args(kwargs); url = kwargs.get("url"); logger.info(f"Scraping URL: {url}"); httpx = lazy_import("httpx")
+        if not firecrawl_api_key: raise ToolExecutionError("Firecrawl API key missing.")
+        try:
+            r = await client.post(self._endpoint(), json={"url": url, "formats": ["markdown"]}, headers={"Authorization": f"Bearer {firecrawl_api_key}"}, timeout=async_timeout(HTTP_SLOW_TIMEOUT))
+            r.raise_for_status(); markdown_content = self._markdown(url, r.json())
+            if vector_db.is_ready(): await vector_db.aadd_many(*(await asyncio.to_thread(self._memory_records, url, markdown_content)))
+            return markdown_content
+        except httpx.HTTPStatusError as e: raise self._http_error(e)
+        except ToolExecutionError: raise
+        except Exception as e: logger.error(f"Scrape exception: {e}"); raise ToolExecutionError(f"Unexpected scrape error: {e}")
+    def _memory_records(self, url, markdown_content):
+        chunks = self._chunk_content(markdown_content); logger.info(f"Storing {len(chunks)} chunks from {url} in VDB.")
+        now = datetime.now().isoformat()
+        return chunks, [{"type": "web_content", "url": url, "chunk": i+1, "total_chunks": len(chunks), "time": now} for i in range(len(chunks))]
     def _chunk_content(self, content, max_chars=1500, overlap=100):
         if not isinstance(content, str) or not content: return []
         if len(content) <= max_chars: return [content]
@@ -320,7 +1357,133 @@ class WebScraperTool(Tool):
             start += max_chars - overlap;
             if start >= len(content): break; start = max(0, start)
         return [c for c in chunks if c]
+SANDBOX_ENV_KEYS = ("PATH", "LANG", "LC_ALL", "TMPDIR", "TEMP", "TMP", "SYSTEMROOT")
+# Runs in each sandbox worker process (python -I -c), so it must not import anything from this file.
+_SANDBOX_WORKER_SOURCE = r'''
+import builtins, contextlib, dis, io, json, os, sys, traceback
+from types import SimpleNamespace
+config = json.loads(sys.argv[1]); cap = config["max_output"]
+channel = os.fdopen(os.dup(1), "w"); requests = os.fdopen(os.dup(0), "r") # Protocol pipes; the snippet gets /dev/null
+devnull = os.open(os.devnull, os.O_RDWR); os.dup2(devnull, 0); os.dup2(devnull, 1)
+exposed = {}
+for name, allowed in config["modules"].items():
+    try: module = __import__(name, fromlist=["_"])
+    except Exception: continue
+    exposed[name] = module if allowed == "*" else SimpleNamespace(**{item: getattr(module, item) for item in allowed if hasattr(module, item)})
+partial = {name: set(allowed) for name, allowed in config["modules"].items() if allowed != "*"}
+roots = {name.split(".")[0] for name in exposed}; IMPORT_NAME = dis.opmap["IMPORT_NAME"]
+def guarded_import(name, globals=None, locals=None, fromlist=(), level=0):
+    caller = sys._getframe(1)
+    if caller.f_code.co_code[caller.f_lasti] != IMPORT_NAME: # C code (numpy printing, ...) importing its own, already loaded internals
+        if level or "." not in name or name not in sys.modules or name.split(".")[0] not in roots: raise ImportError(f"Import of '{name}' is not allowed")
+        return sys.modules[name]
+    # An import statement gets the exposed object, never the real module: submodule paths and attribute chains stay out of reach
+    if level or "." in name or name not in exposed: raise ImportError(f"Import of '{name}' is not allowed")
+    if name in partial and not (fromlist and set(fromlist) <= partial[name]):
+        raise ImportError(f"Only {sorted(partial[name])} can be imported from '{name}' (e.g. 'from {name} import {min(partial[name])}')")
+    return exposed[name]
+safe_builtins = {name: getattr(builtins, name) for name in dir(builtins) if name not in ("exec", "eval", "__import__", "open")}
+safe_builtins["__import__"] = guarded_import
+channel.write(json.dumps({"ready": True}) + "\n"); channel.flush()
+for line in requests:
+    code = json.loads(line)["code"]; out, err = io.StringIO(), io.StringIO(); result = error = None
+    env = {"__builtins__": safe_builtins, "__name__": "__sandbox__", **exposed}
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            exec(compile(code, "<string>", "exec"), env)
+        if "_return_value" in env: result = str(env["_return_value"])
+    except BaseException as e:
+        error = f"Error: {e}\n{traceback.format_exc()}"
+    if "matplotlib.pyplot" in sys.modules: sys.modules["matplotlib.pyplot"].close("all")
+    channel.write(json.dumps({"stdout": out.getvalue()[:cap], "stderr": err.getvalue()[:cap], "error": error, "result": result and result[:cap]}) + "\n"); channel.flush()
+'''
+
+class CodeSandboxPool:
+    """Pool of prewarmed Python worker processes that run code_execution snippets.
+
+    Each worker imports the allowed modules once at start-up and then executes one snippet at a
+    time in a fresh namespace, so a call costs a pipe round trip instead of an import pass. A
+    snippet that exceeds its timeout (or crashes its worker) gets the worker killed and replaced,
+    so runaway code cannot keep burning CPU in the agent process. Workers are also recycled
+    after `max_runs` snippets to bound state leaking between runs.
+    """
+    def __init__(self, modules, size=None, max_runs=None, start_timeout=None, max_output=None):
+        self.size = int(size or os.environ.get("AGENT_SANDBOX_WORKERS", 2))
+        self.max_runs = int(max_runs or os.environ.get("AGENT_SANDBOX_MAX_RUNS", 100))
+        self.start_timeout = float(start_timeout or os.environ.get("AGENT_SANDBOX_START_TIMEOUT", 60))
+        self.config = json.dumps({"modules": modules, "max_output": int(max_output or os.environ.get("AGENT_SANDBOX_MAX_OUTPUT", 100_000))})
+        self._idle = queue.Queue(); self._workers = {}; self._lock = threading.Lock(); self._started = False
+        self.counters = {"runs": 0, "timeouts": 0, "crashes": 0, "spawned": 0, "recycled": 0, "total_ms": 0.0}
+
+    def start(self):
+        with self._lock:
+            if self._started: return self
+            self._started = True; atexit.register(self.close)
+        for _ in range(self.size): self._idle.put(self._spawn())
+        return self
+
+    def _spawn(self):
+        env = {k: os.environ[k] for k in SANDBOX_ENV_KEYS if k in os.environ} # No API keys or tokens reach the snippet
+        env.update(MPLBACKEND="Agg", PYTHONDONTWRITEBYTECODE="1")
+        proc = subprocess.Popen([sys.executable, "-I", "-c", _SANDBOX_WORKER_SOURCE, self.config], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, text=True, bufsize=1, env=env)
+        worker = SimpleNamespace(proc=proc, lines=queue.Queue(), runs=0, ready=False)
+        threading.Thread(target=self._pump, args=(worker,), daemon=True, name="sandbox-pump").start()
+        with self._lock: self._workers[proc.pid] = worker; self.counters["spawned"] += 1
+        return worker
+
+    @staticmethod
+    def _pump(worker):
+        for line in worker.proc.stdout: worker.lines.put(line)
+        worker.lines.put(None) # EOF: the worker exited
+
+    def _kill(self, worker):
+        with self._lock: self._workers.pop(worker.proc.pid, None)
+        try: worker.proc.kill(); worker.proc.wait(timeout=5)
+        except Exception: pass
+
+    def _replace(self, worker):
+        self._kill(worker); return self._spawn()
+
+    def run(self, code, timeout):
+        """Executes `code` in an idle worker; returns {stdout, stderr, error, result}. Raises ToolExecutionError on timeout/crash."""
+        self.start(); worker = self._idle.get()
+        try:
+            if not worker.ready:
+                try: line = worker.lines.get(timeout=self.start_timeout)
+                except queue.Empty: line = None
+                if line is None: worker = self._replace(worker); raise ToolExecutionError("Sandbox worker failed to start.")
+                worker.ready = True
+            t0 = time.perf_counter()
+            try: worker.proc.stdin.write(json.dumps({"code": code}) + "\n"); worker.proc.stdin.flush(); line = worker.lines.get(timeout=timeout)
+            except queue.Empty:
+                logger.warning(f"Sandboxed code exceeded {timeout}s; killing worker pid {worker.proc.pid}") # File only
+                worker = self._replace(worker); self._count(timeouts=1)
+                raise ToolExecutionError(f"Code execution timed out after {timeout} seconds")
+            except OSError: line = None # Broken pipe: the worker is gone
+            if line is None:
+                worker = self._replace(worker); self._count(crashes=1)
+                raise ToolExecutionError("Code execution crashed the sandbox worker (out of memory or a fatal error).")
+            self._count(runs=1, total_ms=(time.perf_counter() - t0) * 1000); worker.runs += 1
+            if worker.runs >= self.max_runs: worker = self._replace(worker); self._count(recycled=1)
+            return json.loads(line)
+        finally:
+            self._idle.put(worker)
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items(): self.counters[key] += value
+
+    def stats(self):
+        with self._lock: counters = dict(self.counters); alive = len(self._workers)
+        return {**counters, "total_ms": round(counters["total_ms"], 1), "avg_ms": round(counters["total_ms"] / counters["runs"], 2) if counters["runs"] else 0.0, "workers": alive}
+
+    def close(self):
+        with self._lock: workers = list(self._workers.values())
+        for worker in workers: self._kill(worker)
+
 class CodeExecutionTool(Tool):
+    max_concurrency = 2
     def __init__(self):
         super().__init__(
             name="code_execution",
@@ -400,6 +1563,8 @@ class CodeExecutionTool(Tool):
             'matplotlib.pyplot': ['plot', 'scatter', 'hist', 'bar', 'pie', 'title', 'xlabel', 'ylabel', 'show', 'savefig', 'close'],
             'seaborn': ['scatterplot', 'lineplot', 'histplot', 'boxplot', 'heatmap']
         }
+        self.pool = CodeSandboxPool(self.safe_modules)
+        if os.environ.get("AGENT_SANDBOX_PREWARM", "1").lower() not in ("0", "false", "no"): self.pool.start() # Workers import in the background
 
     def is_safe_import(self, node):
         """Check if an import is safe"""
@@ -436,8 +1601,8 @@ class CodeExecutionTool(Tool):
                 
                 # Check for exec/eval calls
                 if isinstance(node, ast.Call):
-                    if isinstance(node.func, ast.Name) and node.func.id in ['exec', 'eval']:
-                        raise ToolExecutionError("exec/eval calls are not allowed")
+                    if isinstance(node.func, ast.Name) and node.func.id in ['exec', 'eval', '__import__']:
+                        raise ToolExecutionError("exec/eval/__import__ calls are not allowed")
                 
                 # Check for file operations
                 if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
@@ -455,79 +1620,17 @@ class CodeExecutionTool(Tool):
         code = kwargs.get("code")
         timeout = kwargs.get("timeout", 10)
 
-        import ast
-        import sys
-        import io
-        import contextlib
-        import signal
-        import threading
-        import traceback
-        from types import ModuleType
-
         logger.info(f"Executing code (timeout: {timeout}s):\n{code}")
 
         # Check code safety
         self.check_code_safety(code)
 
-        # Prepare restricted globals
-        restricted_globals = {
-            '__builtins__': {
-                name: getattr(__builtins__, name)
-                for name in dir(__builtins__)
-                if name not in ['exec', 'eval', '__import__', 'open']
-            }
-        }
-
-        # Add safe imports
-        for module_name, allowed_items in self.safe_modules.items():
-            try:
-                module = __import__(module_name)
-                if allowed_items == '*':
-                    restricted_globals[module_name] = module
-                else:
-                    restricted_globals[module_name] = {item: getattr(module, item) for item in allowed_items}
-            except ImportError:
-                pass
-
-        # Capture output
-        output = io.StringIO()
-        error_output = io.StringIO()
-
-        # Execute with timeout
-        result = None
-        error = None
-
-        def execute_with_timeout():
-            nonlocal result, error
-            try:
-                with contextlib.redirect_stdout(output), contextlib.redirect_stderr(error_output):
-                    # Compile and execute in restricted environment
-                    compiled_code = compile(code, '<string>', 'exec')
-                    exec(compiled_code, restricted_globals)
-                    
-                    # If there's a value to return, it will be in locals()
-                    if '_return_value' in restricted_globals:
-                        result = restricted_globals['_return_value']
-            except Exception as e:
-                error = f"Error: {str(e)}\n{traceback.format_exc()}"
-
-        # Run in thread with timeout
-        thread = threading.Thread(target=execute_with_timeout)
-        thread.daemon = True
-        thread.start()
-        thread.join(timeout)
-
-        if thread.is_alive():
-            thread.join(0)  # Clean up the thread
-            raise ToolExecutionError(f"Code execution timed out after {timeout} seconds")
-
-        # Collect output
-        stdout_content = output.getvalue()
-        stderr_content = error_output.getvalue()
-
-        # Clean up
-        output.close()
-        error_output.close()
+        # Execute in a prewarmed worker process (killed and replaced on timeout)
+        outcome = self.pool.run(code, timeout)
+        stdout_content = outcome["stdout"]
+        stderr_content = outcome["stderr"]
+        error = outcome["error"]
+        result = outcome["result"]
 
         # Format response
         response_parts = []
@@ -561,18 +1664,818 @@ class DateTimeTool(Tool):
     def __init__(self): super().__init__( name="get_current_datetime", description="Returns current date and time.", parameters={"type": "object", "properties": {}})
     def execute(self, **kwargs): now = datetime.now(); fmt = now.strftime("%A, %d %B %Y, %H:%M:%S %Z"); return f"Current date and time: {fmt}"
 class VectorSearchTool(Tool):
-    def __init__(self): super().__init__(name="semantic_memory_search", description="Searches agent's long-term memory (VDB) for relevant info.", parameters={"type": "object", "properties": { "query": {"type": "string", "description": "Search query for memory."}, "results_count": {"type": "integer", "description": "Num results (default: 3)."}}}, required=["query"])
+    max_concurrency = 4
+    MEMORY_TYPES = ["weather", "search_result", "web_content", "code_execution", "user_message", "assistant_response", "github_action", "generated_image", "file_provided"]
+    def __init__(self): super().__init__(name="semantic_memory_search", description="Searches agent's long-term memory (VDB) for relevant info, optionally filtered by type, time range, URL or session.", parameters={"type": "object", "properties": {
+        "query": {"type": "string", "description": "Search query for memory."}, "results_count": {"type": "integer", "description": "Num results (default: 3)."},
+        "types": {"type": "array", "items": {"type": "string", "enum": self.MEMORY_TYPES}, "description": "Only these memory types."},
+        "since": {"type": "string", "description": "ISO date/time; only memories at or after it."}, "until": {"type": "string", "description": "ISO date/time; only memories at or before it."},
+        "url": {"type": "string", "description": "Only memories from this URL (* wildcards allowed)."},
+        "session": {"type": "string", "description": "'current' for this conversation only, or a session id."}}}, required=["query"])
+    def _filters(self, kwargs):
+        filters = {"type": kwargs.get("types"), "url": kwargs.get("url")}
+        for key in ("since", "until"):
+            if kwargs.get(key):
+                try: filters[key] = datetime.fromisoformat(kwargs[key]).timestamp()
+                except ValueError: raise ToolExecutionError(f"Invalid '{key}' date: {kwargs[key]}")
+        session = kwargs.get("session")
+        filters["session"] = CURRENT_SESSION.get() if session == "current" else session
+        return filters
     def execute(self, **kwargs):
         self.validate_args(kwargs); q = kwargs.get("query"); c = kwargs.get("results_count", 3)
         if not vector_db or not vector_db.is_ready(): raise ToolExecutionError("Vector DB unavailable.")
-        try:
-            res = vector_db.search(q, top_k=c)
-            if not res: return "No relevant info found in memory."
-            fmt = [f"Memory {i+1} (Relevance: {r['similarity']:.2f}):\nMetadata: {r.get('metadata', {})}\nContent: {r['text']}" for i, r in enumerate(res)]
-            return "Semantic Memory Search Results:\n\n" + "\n\n---\n\n".join(fmt)
+        filters = self._filters(kwargs)
+        try: return self._format(vector_db.search(q, top_k=c, filters=filters))
         except VectorDBError as e: logger.error(f"VDB search failed: {e}"); raise ToolExecutionError(f"Error searching memory: {e}")
         except Exception as e: logger.error(f"Unexpected VDB search error: {e}"); traceback.print_exc(); raise ToolExecutionError(f"Unexpected error searching memory: {e}")
+    async def aexecute(self, **kwargs):
+        self.validate_args(kwargs); q = kwargs.get("query"); c = kwargs.get("results_count", 3)
+        if not vector_db or not vector_db.is_ready(): raise ToolExecutionError("Vector DB unavailable.")
+        filters = self._filters(kwargs)
+        try: return self._format(await vector_db.asearch(q, top_k=c, filters=filters))
+        except VectorDBError as e: logger.error(f"VDB search failed: {e}"); raise ToolExecutionError(f"Error searching memory: {e}")
+        except Exception as e: logger.error(f"Unexpected VDB search error: {e}"); raise ToolExecutionError(f"Unexpected error searching memory: {e}")
+    @staticmethod
+    def _format(res):
+        if not res: return "No relevant info found in memory."
+        fmt = [f"Memory {i+1} (Relevance: {r['similarity']:.2f}):\nMetadata: {r.get('metadata', {})}\nContent: {r['text']}" for i, r in enumerate(res)]
+        return "Semantic Memory Search Results:\n\n" + "\n\n---\n\n".join(fmt)
+_GITHUB_OP = contextvars.ContextVar("github_op", default=None) # Request counters of the operation in progress
+GITHUB_INLINE_BLOB_BYTES = int(os.environ.get("GITHUB_INLINE_BLOB_BYTES", 32768)) # batch_commit: text up to this size goes inline in the tree request
+GITHUB_BLOB_WORKERS = int(os.environ.get("GITHUB_BLOB_WORKERS", 8)) # batch_commit: concurrent blob uploads
+GITHUB_LIST_LIMIT = 30 # Default 'limit' of list operations
+GITHUB_LIST_MAX = 100 # Largest accepted 'limit' (one API page)
+GITHUB_RATE_RETRIES = int(os.environ.get("GITHUB_RATE_RETRIES", 3)) # Re-sends of a request rejected by a rate limit
+
+_GITHUB_PRIORITY = contextvars.ContextVar("github_priority", default=1) # GitHubRateScheduler.READ
+
+class GitHubRateScheduler:
+    """Admission control for GitHub REST calls, driven by the rate-limit headers of every response.
+
+    Callers queue by priority (writes, then interactive reads, then bulk reads such as sync
+    crawls; FIFO within a priority) and at most `max_inflight` requests run at once. GitHub keeps
+    a separate budget per resource (X-RateLimit-Resource: "core", "search", ...), and so does
+    the scheduler: each request is admitted against the budget of its resource. Reads must
+    leave `write_reserve` (bulk reads `bulk_reserve`) of that budget untouched; the reserves are
+    given for the 5000/h core limit and scale down with smaller limits (search allows 30/min).
+    Once less than `throttle_fraction` of a budget remains, reads are spaced out so the rest
+    lasts until the reset instead of failing in a burst. A rate-limit response blocks its
+    resource until the reset; one with Retry-After (or a secondary limit, held for 60s without
+    a hint) blocks everyone. A caller that would have to wait longer than `max_wait` gets a
+    GitHubRateLimitError naming the retry time.
+    """
+    WRITE, READ, BULK = 0, 1, 2
+    CORE_LIMIT = 5000 # Hourly core budget the reserves are configured against
+    def __init__(self, max_inflight=None, write_reserve=None, bulk_reserve=None, max_wait=None, throttle_fraction=None):
+        self.max_inflight = int(max_inflight or os.environ.get("GITHUB_MAX_INFLIGHT", 8))
+        self.reserve = {self.WRITE: 0, self.READ: int(write_reserve if write_reserve is not None else os.environ.get("GITHUB_WRITE_RESERVE", 50)),
+                        self.BULK: int(bulk_reserve if bulk_reserve is not None else os.environ.get("GITHUB_BULK_RESERVE", 500))}
+        self.max_wait = float(max_wait if max_wait is not None else os.environ.get("GITHUB_MAX_WAIT", 60))
+        self.throttle_fraction = float(throttle_fraction if throttle_fraction is not None else os.environ.get("GITHUB_THROTTLE_FRACTION", 0.2))
+        self.blocked_until = 0.0; self.inflight = 0; self._budgets = {} # resource -> budget learned from its responses
+        self._cond = threading.Condition(); self._queue = []; self._seq = itertools.count()
+        self.counters = {"granted": 0, "queued": 0, "wait_s": 0.0, "rate_limited": 0, "rejected": 0}
+
+    @staticmethod
+    def resource_for(path):
+        """Rate-limit resource a request path (relative to the API root) is counted against."""
+        return "search" if path.startswith("/search/") else "core"
+
+    def _budget(self, resource):
+        budget = self._budgets.get(resource)
+        if budget is None: budget = self._budgets[resource] = SimpleNamespace(limit=None, remaining=None, reset=None, blocked_until=0.0, last_grant=0.0)
+        return budget
+
+    def _reserve(self, priority, limit):
+        return int(self.reserve[priority] * min(1.0, limit / self.CORE_LIMIT)) if limit else self.reserve[priority]
+
+    def _delay(self, priority, budget, now):
+        """Seconds before a request of this priority may go, ignoring queue order and concurrency (0 = now)."""
+        blocked_until = max(self.blocked_until, budget.blocked_until)
+        if blocked_until > now: return blocked_until - now
+        if budget.remaining is None: return 0.0
+        if budget.reset and now >= budget.reset: budget.remaining, budget.reset = budget.limit, None # Window rolled over
+        available = budget.remaining - self._reserve(priority, budget.limit)
+        if available <= 0: return max(budget.reset - now, 0.05) if budget.reset else 0.0 # Reset unknown: let it go and re-learn the budget from its headers
+        if priority != self.WRITE and budget.reset and budget.limit and budget.remaining < budget.limit * self.throttle_fraction:
+            interval = (budget.reset - now) / available # Spread what is left over the rest of the window
+            return max(0.0, budget.last_grant + interval - now)
+        return 0.0
+
+    def acquire(self, priority=None, resource="core"):
+        priority = _GITHUB_PRIORITY.get() if priority is None else priority
+        with self._cond:
+            budget = self._budget(resource)
+            ticket = (priority, next(self._seq)); heapq.heappush(self._queue, ticket)
+            t0 = time.time(); deadline = t0 + self.max_wait; waited = False
+            try:
+                while True:
+                    now = time.time(); delay = self._delay(priority, budget, now)
+                    if not delay and self._queue[0] == ticket and self.inflight < self.max_inflight: break
+                    if now + delay > deadline:
+                        self.counters["rejected"] += 1
+                        reason = f"{resource} budget exhausted ({budget.remaining}/{budget.limit} left)" if delay else f"{len(self._queue)} requests queued ahead"
+                        raise GitHubRateLimitError(429, reason, now + (delay or self.max_wait))
+                    waited = True; self._cond.wait(timeout=min(delay or 1.0, deadline - now))
+            except BaseException:
+                self._queue.remove(ticket); heapq.heapify(self._queue); self._cond.notify_all(); raise
+            heapq.heappop(self._queue); self.inflight += 1; budget.last_grant = granted = time.time()
+            if budget.remaining is not None: budget.remaining -= 1 # Provisional until the response headers arrive
+            self.counters["granted"] += 1; self.counters["queued"] += waited; self.counters["wait_s"] += granted - t0
+            self._cond.notify_all() # The next ticket may be able to go too
+
+    def release(self, response=None, resource="core"):
+        """Ends one request; learns from its headers. True if it was rejected by a rate limit (retry it)."""
+        with self._cond:
+            self.inflight -= 1; limited = False
+            if response is not None:
+                headers = response.headers; resource = headers.get("X-RateLimit-Resource") or resource
+                if "X-RateLimit-Remaining" in headers:
+                    budget = self._budget(resource)
+                    budget.limit = int(headers.get("X-RateLimit-Limit") or 0) or budget.limit
+                    budget.remaining = int(headers["X-RateLimit-Remaining"]); budget.reset = float(headers.get("X-RateLimit-Reset") or 0) or None
+                limited = response.status_code == 429 or (response.status_code == 403 and (headers.get("X-RateLimit-Remaining") == "0" or "rate limit" in response.text.lower()))
+                if limited: self.penalise(headers, resource)
+            self._cond.notify_all()
+            return limited
+
+    def penalise(self, headers, resource="core"):
+        """Holds requests after a rate-limit rejection, for as long as GitHub asks. Returns the retry time.
+
+        An exhausted primary budget holds only its resource until the reset; Retry-After and
+        secondary limits apply to the whole token, so they hold everyone.
+        """
+        with self._cond:
+            headers = {k.lower(): v for k, v in (headers or {}).items()}; now = time.time()
+            resource = headers.get("x-ratelimit-resource") or resource
+            if headers.get("retry-after"): until = self.blocked_until = max(self.blocked_until, now + float(headers["retry-after"]))
+            elif headers.get("x-ratelimit-remaining") == "0" and headers.get("x-ratelimit-reset"):
+                budget = self._budget(resource); until = budget.blocked_until = max(budget.blocked_until, float(headers["x-ratelimit-reset"]))
+            else: until = self.blocked_until = max(self.blocked_until, now + 60) # Secondary limit without a hint: GitHub asks for at least a minute
+            self.counters["rate_limited"] += 1
+            logger.warning(f"GitHub rate limit hit ({resource}); holding requests for {until - now:.0f}s") # File only
+            self._cond.notify_all()
+            return until
+
+    def retry_at(self, resource="core"):
+        """Time a request against this resource may go again after a rate-limit rejection."""
+        with self._cond: return max(self.blocked_until, self._budget(resource).blocked_until)
+
+    @contextmanager
+    def priority(self, level):
+        token = _GITHUB_PRIORITY.set(level)
+        try: yield
+        finally: _GITHUB_PRIORITY.reset(token)
+
+    def admit(self, priority=None):
+        """Waits for this priority's turn without holding a request slot (for calls made through PyGithub).
+
+        PyGithub's responses never reach release(), so those calls do not update `remaining`: the
+        budget is only re-learned from the next call made through GitHubClient.request(), and a
+        burst of PyGithub writes can spend more than the reserves account for.
+        """
+        self.acquire(priority); self.release()
+
+    def stats(self):
+        with self._cond:
+            now = time.time(); core = self._budget("core")
+            return {**self.counters, "wait_s": round(self.counters["wait_s"], 2), "inflight": self.inflight, "queued_now": len(self._queue),
+                    "remaining": core.remaining, "limit": core.limit, "blocked_for_s": round(max(0.0, self.blocked_until - now), 1),
+                    "resources": {r: {"remaining": b.remaining, "limit": b.limit, "blocked_for_s": round(max(0.0, b.blocked_until - now), 1)} for r, b in self._budgets.items()}}
+
+class GitHubClient:
+    """Long-lived GitHub access shared by every GitHubTool call.
+
+    One PyGithub `Github` instance (keeps its connections) plus a TTL cache of the authenticated
+    user and of repository data/handles, so an operation no longer starts with get_user()/get_repo()
+    round trips. Read operations use `request()`: REST calls through the shared HTTP pool with an
+    ETag cache, so an unchanged resource comes back as a 304, which GitHub does not count against
+    the rate limit. Per-operation latency and request/304 counts plus the last seen rate-limit
+    budget of each resource are available from `stats()`.
+    """
+    def __init__(self, token, api_url=None, repo_ttl=None, etag_entries=None):
+        self.token = token
+        self.api_url = (api_url or os.environ.get("GITHUB_API_URL", "https://api.github.com")).rstrip("/")
+        self.headers = {"Authorization": f"Bearer {token}", "Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"}
+        self.repos = LRUTTLCache(max_entries=256, ttl=float(repo_ttl if repo_ttl is not None else os.environ.get("GITHUB_REPO_CACHE_TTL", 300)))
+        self.etag_entries = int(etag_entries or os.environ.get("GITHUB_ETAG_CACHE_SIZE", 1024))
+        self._etags = OrderedDict() # request key -> (etag, data, link header), LRU
+        self._github = None; self._user = None; self._login = None; self._lock = threading.RLock()
+        self.rate = {} # resource -> last seen {"limit", "remaining", "used", "reset"}
+        self.scheduler = GitHubRateScheduler()
+        self.counters = {"requests": 0, "not_modified": 0}
+        self.op_stats = defaultdict(lambda: {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "requests": 0, "not_modified": 0})
+
+    @property
+    def github(self):
+        if self._github is None:
+            with self._lock:
+                if self._github is None:
+                    github = lazy_import("github")
+                    kwargs = {"base_url": self.api_url, "per_page": 100, "pool_size": HTTP_POOL_SIZE}
+                    if hasattr(github, "Auth"): kwargs["auth"] = github.Auth.Token(self.token)
+                    else: kwargs["login_or_token"] = self.token
+                    self._github = github.Github(**kwargs)
+        return self._github
+
+    def user(self):
+        if self._user is None: self._user = self.github.get_user() # Lazy object: no request until an attribute is read
+        return self._user
+
+    def login(self):
+        if self._login is None: self._login = self.request("GET", "/user")[0]["login"]
+        return self._login
+
+    def full_name(self, repo_name):
+        if not repo_name: raise GitHubToolError("'repo_name' required.")
+        return repo_name if "/" in repo_name else f"{self.login()}/{repo_name}"
+
+    def request(self, method, path, params=None, json_body=None):
+        """One REST call via the shared HTTP pool; GETs are conditional on a cached ETag. Returns (data, link header)."""
+        url = path if path.startswith(("http://", "https://")) else f"{self.api_url}{path}"
+        key = f"{url}?{json.dumps(params, sort_keys=True)}" if params else url
+        headers = dict(self.headers); cached = None
+        if method == "GET":
+            with self._lock: cached = self._etags.get(key)
+            if cached: headers["If-None-Match"] = cached[0]
+        priority = GitHubRateScheduler.WRITE if method != "GET" else None
+        resource = GitHubRateScheduler.resource_for(url[len(self.api_url):] if url.startswith(self.api_url) else "")
+        for attempt in range(GITHUB_RATE_RETRIES + 1):
+            self.scheduler.acquire(priority, resource)
+            try: r = get_http_session().request(method, url, params=params, json=json_body, headers=headers)
+            except BaseException: self.scheduler.release(resource=resource); raise
+            self._note(r, cached)
+            if not self.scheduler.release(r, resource): break
+            if attempt == GITHUB_RATE_RETRIES: # Rejected by a rate limit every time; the scheduler waited out each Retry-After
+                raise GitHubRateLimitError(r.status_code, self._message(r), self.scheduler.retry_at(resource))
+        if r.status_code == 304 and cached:
+            with self._lock: self._etags.move_to_end(key)
+            return cached[1], cached[2]
+        if r.status_code >= 400: raise GitHubAPIError(r.status_code, self._message(r))
+        data = r.json() if r.content else None
+        if method == "GET" and r.headers.get("ETag"):
+            with self._lock:
+                self._etags[key] = (r.headers["ETag"], data, r.headers.get("Link")); self._etags.move_to_end(key)
+                while len(self._etags) > self.etag_entries: self._etags.popitem(last=False)
+        return data, r.headers.get("Link")
+
+    @staticmethod
+    def _message(response):
+        try: return response.json().get("message", response.text)
+        except ValueError: return response.text
+
+    def get_slice(self, path, params=None, offset=0, limit=GITHUB_LIST_LIMIT, per_page=100):
+        """Items [offset, offset + limit) of a list (or search) endpoint, fetching only the pages that cover them. Returns (items, more)."""
+        items = []; skip = offset % per_page; url = path
+        params = {**(params or {}), "per_page": per_page, "page": offset // per_page + 1}
+        while url and len(items) < limit:
+            data, link = self.request("GET", url, params)
+            items.extend((data["items"] if isinstance(data, dict) else data or [])[skip:]); skip = 0
+            url = self.next_link(link); params = None
+        return items[:limit], len(items) > limit or url is not None
+
+    @staticmethod
+    def next_link(link):
+        match = re.search(r'<([^>]+)>;\s*rel="next"', link or "")
+        return match.group(1) if match else None
+
+    def _note(self, response, cached):
+        op = _GITHUB_OP.get(); not_modified = response.status_code == 304 and cached is not None
+        with self._lock:
+            self.counters["requests"] += 1; self.counters["not_modified"] += not_modified
+            if op is not None: op["requests"] += 1; op["not_modified"] += not_modified
+            if "X-RateLimit-Remaining" in response.headers:
+                self.rate[response.headers.get("X-RateLimit-Resource") or "core"] = {k: int(response.headers.get(f"X-RateLimit-{k.title()}") or 0) for k in ("limit", "remaining", "used", "reset")}
+
+    def _repo_entry(self, repo_name):
+        full_name = self.full_name(repo_name); key = full_name.casefold()
+        entry = self.repos.get(key)
+        if entry is None:
+            try: data, _ = self.request("GET", f"/repos/{full_name}")
+            except GitHubAPIError as e:
+                if e.status == 404: raise GitHubToolError(f"Repo '{full_name}' not found/accessible.")
+                raise
+            entry = SimpleNamespace(data=data, handle=None); self.repos.set(key, entry)
+        return entry
+
+    def repo_data(self, repo_name): return self._repo_entry(repo_name).data
+
+    def repo(self, repo_name):
+        """PyGithub Repository built from the cached repo JSON (no extra round trip)."""
+        entry = self._repo_entry(repo_name)
+        if entry.handle is None: entry.handle = self.github.create_from_raw_data(lazy_import("github.Repository").Repository, entry.data)
+        return entry.handle
+
+    def forget_repo(self, repo_name):
+        self.repos.invalidate(self.full_name(repo_name).casefold())
+
+    def commit_changes(self, full_name, branch, changes, message, retries=2):
+        """Apply many writes/deletes as ONE commit via the Git Data API: blobs -> tree -> commit -> ref.
+
+        Small text files go inline in the tree request; larger or binary ones are uploaded as blobs
+        concurrently. A ref update that loses a race (422, not a fast-forward) is rebuilt on the new
+        head, reusing the uploaded blobs. Returns (commit sha, writes, deletes).
+        """
+        entries = []; uploads = []
+        for change in changes:
+            path = (change.get("path") or "").strip("/")
+            if not path: raise GitHubToolError("Every change needs a 'path'.")
+            mode = "100755" if change.get("executable") else "100644"
+            if change.get("delete"): entries.append({"path": path, "mode": mode, "type": "blob", "sha": None}); continue
+            if change.get("content") is None and change.get("content_base64") is None: raise GitHubToolError(f"Change '{path}' needs 'content', 'content_base64' or 'delete': true.")
+            entry = {"path": path, "mode": mode, "type": "blob"}; entries.append(entry)
+            if change.get("content_base64") is None and len(change["content"].encode("utf-8")) <= GITHUB_INLINE_BLOB_BYTES: entry["content"] = change["content"]
+            else: uploads.append((entry, change.get("content_base64") or base64.b64encode(change["content"].encode("utf-8")).decode("ascii")))
+        deletes = sum(1 for change in changes if change.get("delete"))
+        if uploads:
+            def upload(item):
+                return item[0], self.request("POST", f"/repos/{full_name}/git/blobs", json_body={"content": item[1], "encoding": "base64"})[0]["sha"]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(GITHUB_BLOB_WORKERS, len(uploads)), thread_name_prefix="gh-blob") as pool:
+                for entry, sha in pool.map(lambda item: contextvars.copy_context().run(upload, item), uploads): entry["sha"] = sha
+        for attempt in range(retries + 1):
+            try: head = self.request("GET", f"/repos/{full_name}/git/ref/heads/{branch}")[0]["object"]["sha"]
+            except GitHubAPIError as e:
+                if e.status == 404: raise GitHubToolError(f"Branch '{branch}' not found in '{full_name}'.")
+                raise
+            base_tree = self.request("GET", f"/repos/{full_name}/git/commits/{head}")[0]["tree"]["sha"]
+            tree = self.request("POST", f"/repos/{full_name}/git/trees", json_body={"base_tree": base_tree, "tree": entries})[0]["sha"]
+            commit = self.request("POST", f"/repos/{full_name}/git/commits", json_body={"message": message, "tree": tree, "parents": [head]})[0]["sha"]
+            try:
+                self.request("PATCH", f"/repos/{full_name}/git/refs/heads/{branch}", json_body={"sha": commit, "force": False})
+                return commit, len(entries) - deletes, deletes
+            except GitHubAPIError as e:
+                if e.status != 422 or attempt == retries: raise
+                logger.warning(f"Branch '{branch}' of '{full_name}' moved during batch commit; retrying on the new head") # File only
+
+    @contextmanager
+    def track(self, operation, priority=GitHubRateScheduler.READ):
+        """Times one tool operation and attributes its REST requests to it; its GETs queue at `priority`."""
+        counters = {"requests": 0, "not_modified": 0}; token = _GITHUB_OP.set(counters); prio = _GITHUB_PRIORITY.set(priority); t0 = time.perf_counter(); ok = False
+        try: yield counters; ok = True
+        finally:
+            _GITHUB_OP.reset(token); _GITHUB_PRIORITY.reset(prio); ms = (time.perf_counter() - t0) * 1000
+            with self._lock:
+                s = self.op_stats[operation]; s["calls"] += 1; s["errors"] += not ok; s["total_ms"] += ms; s["max_ms"] = max(s["max_ms"], ms)
+                s["requests"] += counters["requests"]; s["not_modified"] += counters["not_modified"]
+            logger.info(f"GitHub op '{operation}': {ms:.0f} ms, {counters['requests']} REST request(s), {counters['not_modified']} not modified (free); rate limit remaining {self.rate.get('core', {}).get('remaining')}/{self.rate.get('core', {}).get('limit')}") # File only
+
+    def stats(self):
+        with self._lock:
+            ops = {op: {**s, "avg_ms": round(s["total_ms"] / s["calls"], 1) if s["calls"] else 0.0, "total_ms": round(s["total_ms"], 1), "max_ms": round(s["max_ms"], 1)} for op, s in self.op_stats.items()}
+            return {"rate_limit": {r: dict(v) for r, v in self.rate.items()}, **self.counters, "etag_entries": len(self._etags), "repo_cache": self.repos.stats(), "scheduler": self.scheduler.stats(), "operations": ops}
+
+class RepoMirrorCache:
+    """On-disk cache of bare partial clones (`--filter=blob:none`), one per repo, kept current with `git fetch`.
+
+    `clone_repo` creates or refreshes a mirror; afterwards read_file/list_files/list_branches for that
+    repo are answered from it with local git plumbing. A mirror older than `ttl` seconds (or marked
+    stale by one of our own writes) is fetched incrementally before use; file contents missing from
+    the partial clone are pulled on demand by git. Any URL git understands works, so a local bare
+    repository (`file:///...`) can stand in for GitHub. The least recently used mirrors beyond
+    `max_repos` are removed.
+    """
+    STAMP = "agent-fetched" # Touched after every successful clone/fetch; its mtime is the mirror's age
+    def __init__(self, root=None, ttl=None, max_repos=None, timeout=None):
+        self.root = Path(root or os.environ.get("GITHUB_MIRROR_DIR", os.path.join(".agent_cache", "mirrors")))
+        self.ttl = float(ttl if ttl is not None else os.environ.get("GITHUB_MIRROR_TTL", 300))
+        self.max_repos = int(max_repos or os.environ.get("GITHUB_MIRROR_MAX_REPOS", 20))
+        self.timeout = float(timeout or os.environ.get("GITHUB_MIRROR_TIMEOUT", 600))
+        self._locks = defaultdict(threading.Lock); self._lock = threading.Lock()
+        self.counters = {"clones": 0, "fetches": 0, "reads": 0, "evictions": 0}
+
+    def path(self, full_name):
+        owner, _, name = full_name.casefold().partition("/")
+        return self.root / owner / f"{name}.git"
+
+    def _git(self, args, cwd=None, token=None, input=None, text=True):
+        env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+        if token: # Via GIT_CONFIG_* so the token is neither on the command line nor written to the mirror's config
+            basic = base64.b64encode(f"x-access-token:{token}".encode()).decode()
+            env.update(GIT_CONFIG_COUNT="1", GIT_CONFIG_KEY_0="http.extraHeader", GIT_CONFIG_VALUE_0=f"Authorization: Basic {basic}")
+        try: return subprocess.run(["git", *args], cwd=cwd, env=env, input=input, capture_output=True, text=text, check=True, timeout=self.timeout).stdout
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr if isinstance(e.stderr, str) else (e.stderr or b"").decode("utf-8", "replace")
+            raise GitHubToolError(f"git {args[0]} failed: {stderr.strip()}")
+        except subprocess.TimeoutExpired: raise GitHubToolError(f"git {args[0]} timed out after {self.timeout:.0f}s.")
+        except FileNotFoundError: raise GitHubToolError("Git command not found.")
+
+    def age(self, full_name):
+        try: return time.time() - (self.path(full_name) / self.STAMP).stat().st_mtime
+        except OSError: return None
+
+    def exists(self, full_name): return (self.path(full_name) / "HEAD").exists()
+
+    def sync(self, full_name, url, token=None, force=False):
+        """Clone the mirror if missing, fetch it if stale (or `force`). Returns (path, action) with action in clone/fetch/fresh."""
+        path = self.path(full_name)
+        with self._lock: lock = self._locks[full_name.casefold()]
+        with lock:
+            age = self.age(full_name)
+            if not (path / "HEAD").exists():
+                if path.exists(): shutil.rmtree(path) # Leftover of an interrupted clone
+                path.parent.mkdir(parents=True, exist_ok=True)
+                logger.info(f"Mirroring '{full_name}' into {path}") # File only
+                self._git(["clone", "--bare", "--filter=blob:none", "--quiet", url, str(path)], token=token)
+                self._git(["config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"], cwd=path)
+                action = "clone"
+            elif force or age is None or age > self.ttl:
+                self._git(["fetch", "--prune", "--quiet", "--filter=blob:none", "origin"], cwd=path, token=token)
+                action = "fetch"
+            else: return path, "fresh"
+            (path / self.STAMP).touch(); os.utime(path / "HEAD")
+            with self._lock: self.counters["clones" if action == "clone" else "fetches"] += 1
+        self.evict()
+        return path, action
+
+    def mark_stale(self, full_name):
+        """Force a fetch before the next read (after we changed the repo through the API)."""
+        try: (self.path(full_name) / self.STAMP).unlink()
+        except OSError: pass
+
+    def read_file(self, path, rev, file_path, token=None):
+        """Bytes of `rev:file_path`, or None if it does not exist; IsADirectoryError if it is a directory."""
+        out = self._git(["cat-file", "--batch"], cwd=path, token=token, input=f"{rev}:{file_path.strip('/')}\n".encode(), text=False)
+        header, _, body = out.partition(b"\n")
+        if header.endswith(b" missing") or header.endswith(b" ambiguous"): return None
+        _, kind, size = header.decode().split()
+        if kind != "blob": raise IsADirectoryError(file_path)
+        self._touch_read(path)
+        return body[:int(size)]
+
+    def list_dir(self, path, rev, dir_path, token=None):
+        """[(path, is_dir)] of one directory level of `rev`."""
+        spec = dir_path.strip("/")
+        out = self._git(["ls-tree", "-z", rev, *([f"{spec}/"] if spec else [])], cwd=path, token=token)
+        entries = []
+        for line in filter(None, out.split("\0")):
+            meta, _, name = line.partition("\t"); entries.append((name, meta.split()[1] == "tree"))
+        self._touch_read(path)
+        return entries
+
+    def branches(self, path): return [b for b in self._git(["for-each-ref", "--format=%(refname:short)", "refs/heads"], cwd=path).splitlines() if b]
+
+    def head(self, path, rev):
+        try: return self._git(["rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}"], cwd=path).strip()
+        except GitHubToolError: return None
+
+    def forget(self, full_name): shutil.rmtree(self.path(full_name), ignore_errors=True)
+
+    def _touch_read(self, path):
+        with self._lock: self.counters["reads"] += 1
+        try: os.utime(path / "HEAD") # HEAD's mtime records last use for eviction
+        except OSError: pass
+
+    def evict(self):
+        if not self.root.exists(): return
+        mirrors = sorted((p for p in self.root.glob("*/*.git") if (p / "HEAD").exists()), key=lambda p: (p / "HEAD").stat().st_mtime, reverse=True)
+        for stale in mirrors[self.max_repos:]:
+            logger.info(f"Evicting repo mirror {stale}") # File only
+            shutil.rmtree(stale, ignore_errors=True)
+            with self._lock: self.counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock: return {**self.counters, "mirrors": len(list(self.root.glob("*/*.git"))) if self.root.exists() else 0, "root": str(self.root)}
+
+class CodeSearchIndex:
+    """Full-text and symbol index of one commit of a mirrored repo, stored next to the mirror.
+
+    Text search uses an SQLite FTS5 table with the trigram tokenizer, so any substring of three or
+    more characters is an index lookup; matching lines are then located in the candidate files.
+    Python and JS/TS definitions (functions, classes, methods, top-level names) go into a symbol
+    table. `update(commit)` re-indexes only the files that differ from the indexed commit
+    (`git diff-tree`), and fetches the contents a partial clone lacks in one batch.
+    """
+    MAX_FILE_BYTES = int(os.environ.get("GITHUB_INDEX_MAX_FILE_BYTES", 1_000_000))
+    SYMBOL_PATTERNS = {
+        "python": [("class", re.compile(r"^\s*class\s+([A-Za-z_]\w*)")), ("function", re.compile(r"^\s*(?:async\s+)?def\s+([A-Za-z_]\w*)")),
+                   ("variable", re.compile(r"^([A-Za-z_]\w*)\s*(?::[^=]+)?=(?!=)"))],
+        "javascript": [("class", re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)")),
+                       ("function", re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)")),
+                       ("interface", re.compile(r"^\s*(?:export\s+)?interface\s+([A-Za-z_$][\w$]*)")),
+                       ("type", re.compile(r"^\s*(?:export\s+)?type\s+([A-Za-z_$][\w$]*)\s*(?:<[^=]*>)?\s*=")),
+                       ("enum", re.compile(r"^\s*(?:export\s+)?(?:const\s+)?enum\s+([A-Za-z_$][\w$]*)")),
+                       ("variable", re.compile(r"^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*(?::[^=]+)?=")),
+                       ("method", re.compile(r"^\s+(?:(?:public|private|protected|static|async|readonly|get|set)\s+)*([A-Za-z_$][\w$]*)\s*(?:<[^>]*>)?\([^)]*\)\s*(?::[^{]+)?\{\s*$"))],
+    }
+    LANGUAGES = {".py": "python", ".pyi": "python", ".js": "javascript", ".jsx": "javascript", ".mjs": "javascript", ".cjs": "javascript", ".ts": "javascript", ".tsx": "javascript"}
+    NOT_METHODS = {"if", "for", "while", "switch", "catch", "function", "return", "with", "constructor"}
+
+    def __init__(self, repo_path, git):
+        self.repo_path = Path(repo_path); self.git = git # RepoMirrorCache._git
+        self._lock = threading.RLock(); self.db = sqlite3.connect(str(self.repo_path / "agent-index.sqlite"), check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        try:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, oid TEXT NOT NULL);
+                CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(content, tokenize='trigram');
+                CREATE TABLE IF NOT EXISTS symbols (name TEXT NOT NULL, kind TEXT NOT NULL, path TEXT NOT NULL, line INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS symbols_by_name ON symbols (name COLLATE NOCASE);
+                CREATE INDEX IF NOT EXISTS symbols_by_path ON symbols (path);
+            """)
+        except sqlite3.OperationalError as e: raise GitHubToolError(f"Code search needs SQLite with the FTS5 trigram tokenizer (3.34+): {e}")
+        self.counters = {"updates": 0, "full_builds": 0, "files_indexed": 0, "files_removed": 0, "searches": 0}
+
+    @property
+    def commit(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'commit'").fetchone()
+        return row[0] if row else None
+
+    def _changes(self, old, new, token):
+        """[(path, oid or None for removed)] between the indexed commit and `new`; None if a full build is needed."""
+        if not old: return None
+        try: out = self.git(["diff-tree", "-r", "-z", "--no-renames", old, new], cwd=self.repo_path, token=token)
+        except GitHubToolError: return None # Old commit gone (force push + gc): rebuild
+        fields = out.split("\0"); changes = []
+        for meta, path in zip(fields[0::2], fields[1::2]):
+            _, new_mode, _, oid, status = meta.lstrip(":").split()
+            changes.append((path, None if status == "D" or not new_mode.startswith("100") else oid))
+        return changes
+
+    def _load(self, oids, commit, token):
+        """{oid: bytes} for `oids` (blobs of `commit`), first fetching any the partial clone lacks in one request."""
+        if not oids: return {}
+        wanted = set(oids) # --no-walk: only the commit's own tree, not the blobs of all history
+        missing = [line[1:] for line in self.git(["rev-list", "--objects", "--missing=print", "--no-walk", commit], cwd=self.repo_path, token=token).splitlines() if line.startswith("?") and line[1:] in wanted]
+        if missing: self.git(["fetch", "--no-tags", "--no-write-fetch-head", "--recurse-submodules=no", "--stdin", "origin"], cwd=self.repo_path, token=token, input="\n".join(missing) + "\n")
+        out = self.git(["cat-file", "--batch"], cwd=self.repo_path, token=token, input="\n".join(oids).encode() + b"\n", text=False)
+        blobs = {}; pos = 0
+        while pos < len(out):
+            end = out.index(b"\n", pos); header = out[pos:end].decode().split(); pos = end + 1
+            if len(header) < 3: continue # "<oid> missing"
+            size = int(header[2]); blobs[header[0]] = out[pos:pos + size]; pos += size + 1
+        return blobs
+
+    def _symbols(self, path, text):
+        patterns = self.SYMBOL_PATTERNS.get(self.LANGUAGES.get(os.path.splitext(path)[1].lower()))
+        if not patterns: return []
+        rows = []
+        for lineno, line in enumerate(text.splitlines(), 1):
+            for kind, pattern in patterns:
+                match = pattern.match(line)
+                if match and not (kind == "method" and match.group(1) in self.NOT_METHODS):
+                    rows.append((match.group(1), kind, path, lineno)); break
+        return rows
+
+    def update(self, commit, token=None):
+        """Brings the index to `commit`, re-indexing only changed files. Returns the number of files (re)indexed."""
+        with self._lock:
+            old = self.commit
+            if old == commit: return 0
+            changes = self._changes(old, commit, token); full = changes is None
+            if full:
+                out = self.git(["ls-tree", "-r", "-z", commit], cwd=self.repo_path, token=token)
+                changes = []
+                for entry in filter(None, out.split("\0")):
+                    meta, _, path = entry.partition("\t"); mode, kind, oid = meta.split()
+                    if kind == "blob" and mode.startswith("100"): changes.append((path, oid))
+            blobs = self._load(sorted({oid for _, oid in changes if oid}), commit, token)
+            db = self.db; db.execute("BEGIN"); indexed = removed = 0
+            try:
+                if full: db.execute("DELETE FROM files"); db.execute("DELETE FROM docs"); db.execute("DELETE FROM symbols")
+                for path, oid in changes:
+                    row = db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+                    if row: db.execute("DELETE FROM docs WHERE rowid = ?", row); db.execute("DELETE FROM files WHERE id = ?", row); db.execute("DELETE FROM symbols WHERE path = ?", (path,)); removed += oid is None
+                    data = blobs.get(oid) if oid else None
+                    if data is None or len(data) > self.MAX_FILE_BYTES or b"\0" in data[:8192]: continue # Removed, oversized or binary
+                    text = data.decode("utf-8", "replace")
+                    file_id = db.execute("INSERT INTO files (path, oid) VALUES (?, ?)", (path, oid)).lastrowid
+                    db.execute("INSERT INTO docs (rowid, content) VALUES (?, ?)", (file_id, text))
+                    db.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?)", self._symbols(path, text)); indexed += 1
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('commit', ?)", (commit,))
+                db.execute("COMMIT")
+            except BaseException: db.execute("ROLLBACK"); raise
+            self.counters["updates"] += 1; self.counters["full_builds"] += full; self.counters["files_indexed"] += indexed; self.counters["files_removed"] += removed
+            logger.info(f"Code index {self.repo_path}: {'built' if full else 'updated'} to {commit[:7]}, {indexed} file(s) indexed, {removed} removed") # File only
+            return indexed
+
+    def search_text(self, query, path_prefix="", offset=0, limit=GITHUB_LIST_LIMIT):
+        """([(path, line number, line)], more) for lines containing `query` (case-insensitive)."""
+        needle = query.casefold(); matches = []; prefix = path_prefix.strip("/")
+        where, params = ("docs MATCH ?", ['"' + query.replace('"', '""') + '"']) if len(query) >= 3 else ("instr(lower(docs.content), ?) > 0", [query.lower()])
+        if prefix: where += " AND (f.path = ? OR f.path LIKE ? ESCAPE '\\')"; params += [prefix, prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%"]
+        with self._lock:
+            self.counters["searches"] += 1
+            for path, content in self.db.execute(f"SELECT f.path, docs.content FROM docs JOIN files f ON f.id = docs.rowid WHERE {where} ORDER BY f.path", params):
+                for lineno, line in enumerate(content.splitlines(), 1):
+                    if needle in line.casefold():
+                        matches.append((path, lineno, line.strip()[:200]))
+                        if len(matches) > offset + limit: return matches[offset:offset + limit], True
+        return matches[offset:offset + limit], False
+
+    def search_symbols(self, name, path_prefix="", offset=0, limit=GITHUB_LIST_LIMIT):
+        """([(kind, name, path, line)], more) for definitions named `name` (case-insensitive; '*' is a wildcard)."""
+        pattern = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("*", "%")
+        where, params = "name LIKE ? ESCAPE '\\'", [pattern]; prefix = path_prefix.strip("/")
+        if prefix: where += " AND (path = ? OR substr(path, 1, ?) = ?)"; params += [prefix, len(prefix) + 1, prefix + "/"]
+        with self._lock:
+            self.counters["searches"] += 1
+            rows = self.db.execute(f"SELECT kind, name, path, line FROM symbols WHERE {where} ORDER BY name = ? DESC, path, line LIMIT ? OFFSET ?", [*params, name, limit + 1, offset]).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    def stats(self):
+        with self._lock: return {**self.counters, "commit": self.commit, "files": self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]}
+
+    def close(self):
+        with self._lock: self.db.close()
+
+class GitHubSyncStore:
+    """SQLite cache of a repo's issues, pull requests and commits, kept current incrementally.
+
+    Issues and PRs (one stream on GitHub's issues endpoint) are fetched oldest update first with
+    `since=<newest updated_at seen>`, so a re-sync only pulls what changed. Commits are fetched
+    from the branch head until the head recorded at the previous sync turns up; if it never does
+    (force push), the branch is replaced. The first commit sync keeps only the newest
+    `commit_backfill` commits (GITHUB_SYNC_COMMIT_BACKFILL); older history stays on the API.
+
+    Every page is committed as it arrives, together with the cursor, so a sync cut short by the
+    rate limit resumes where it stopped. Until a (repo, kind) has caught up once, its sync runs in
+    a background thread and the sync methods return False: callers answer from the API meanwhile.
+    A caught-up repo is re-synced at most every `ttl` seconds (GITHUB_SYNC_TTL) unless marked
+    stale by one of our own writes. Listing then runs as an indexed query with state, label,
+    author and date filters, whatever the size of the repo.
+    """
+    BACKFILLING = -1.0 # sync_state.synced_at of a (repo, kind) whose sync has not caught up yet
+
+    def __init__(self, path=None, ttl=None, commit_backfill=None, inline_pages=None):
+        self.path = path or os.environ.get("GITHUB_SYNC_DB", os.path.join(".agent_cache", "github.sqlite"))
+        self.ttl = float(ttl if ttl is not None else os.environ.get("GITHUB_SYNC_TTL", 60))
+        self.commit_backfill = int(commit_backfill or os.environ.get("GITHUB_SYNC_COMMIT_BACKFILL", 1000))
+        self.inline_pages = int(inline_pages or os.environ.get("GITHUB_SYNC_INLINE_PAGES", 1))
+        self.db = None; self._lock = threading.Lock(); self._sync_locks = defaultdict(threading.Lock)
+        self.counters = {"syncs": 0, "skipped": 0, "background": 0, "interrupted": 0, "issues_fetched": 0, "commits_fetched": 0, "queries": 0}
+
+    def _conn(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS issues (repo TEXT NOT NULL, number INTEGER NOT NULL, is_pr INTEGER NOT NULL, state TEXT NOT NULL, title TEXT NOT NULL,
+                    author TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL, PRIMARY KEY (repo, number));
+                CREATE INDEX IF NOT EXISTS issues_by_state ON issues (repo, is_pr, state, updated_at);
+                CREATE INDEX IF NOT EXISTS issues_by_author ON issues (repo, author, updated_at);
+                CREATE TABLE IF NOT EXISTS issue_labels (repo TEXT NOT NULL, label TEXT NOT NULL, number INTEGER NOT NULL, PRIMARY KEY (repo, label, number)) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS commits (repo TEXT NOT NULL, branch TEXT NOT NULL, sha TEXT NOT NULL, author TEXT, date TEXT NOT NULL, message TEXT NOT NULL,
+                    PRIMARY KEY (repo, branch, sha));
+                CREATE INDEX IF NOT EXISTS commits_by_date ON commits (repo, branch, date);
+                CREATE TABLE IF NOT EXISTS sync_state (repo TEXT NOT NULL, kind TEXT NOT NULL, cursor TEXT, synced_at REAL NOT NULL, PRIMARY KEY (repo, kind));
+            """)
+            self.db = db
+        return self.db
+
+    def _state(self, repo, kind):
+        with self._lock: return self._conn().execute("SELECT cursor, synced_at FROM sync_state WHERE repo = ? AND kind = ?", (repo, kind)).fetchone()
+
+    def _transaction(self, statements):
+        with self._lock:
+            db = self._conn(); db.execute("BEGIN")
+            try:
+                for sql, rows in statements: db.executemany(sql, rows)
+                db.execute("COMMIT")
+            except BaseException: db.execute("ROLLBACK"); raise
+
+    def mark_stale(self, repo):
+        with self._lock: self._conn().execute("UPDATE sync_state SET synced_at = 0 WHERE repo = ? AND synced_at > 0", (repo.casefold(),))
+
+    def _sync(self, client, repo, kind, fetch):
+        """Runs `fetch(cursor, max_pages)` unless this (repo, kind) was synced within the TTL; one sync at a time per key.
+
+        True when the store can answer queries for the key now. A caught-up key gets at most
+        `inline_pages` pages (GITHUB_SYNC_INLINE_PAGES) on the caller's thread; a longer catch-up,
+        like a first sync, continues in a background thread, and False tells the caller to use the API.
+        """
+        with self._lock: lock = self._sync_locks[(repo, kind)]
+        state = self._state(repo, kind)
+        if state is not None and state[1] != self.BACKFILLING:
+            with lock:
+                state = self._state(repo, kind)
+                if state[1] != self.BACKFILLING and time.time() - state[1] < self.ttl:
+                    with self._lock: self.counters["skipped"] += 1
+                    return True
+                if state[1] != self.BACKFILLING:
+                    try:
+                        with client.scheduler.priority(GitHubRateScheduler.BULK): fetch(state[0], self.inline_pages)
+                    except GitHubAPIError as e: # Pages already committed are kept; the rest is picked up by the next call
+                        with self._lock: self.counters["interrupted"] += 1
+                        logger.warning(f"Sync of {repo} ({kind}) stopped: {e}") # File only
+                    state = self._state(repo, kind)
+                    if state[1] != self.BACKFILLING:
+                        with self._lock: self.counters["syncs"] += 1
+                        return True
+        if lock.acquire(blocking=False):
+            threading.Thread(target=self._backfill, args=(client, repo, kind, fetch, lock), daemon=True, name=f"github-sync-{kind}").start()
+        return False
+
+    def _backfill(self, client, repo, kind, fetch, lock):
+        try:
+            with client.scheduler.priority(GitHubRateScheduler.BULK):
+                state = self._state(repo, kind); fetch(state[0] if state else None, None)
+            with self._lock: self.counters["syncs"] += 1; self.counters["background"] += 1
+        except Exception as e:
+            with self._lock: self.counters["interrupted"] += 1
+            logger.warning(f"Background sync of {repo} ({kind}) stopped, resuming on the next call: {e}") # File only
+        finally: lock.release()
+
+    def sync_issues(self, client, full_name):
+        """Brings the issues/PRs of `full_name` up to date; False while a longer (e.g. first) sync runs in the background."""
+        repo = full_name.casefold()
+        def fetch(cursor, max_pages):
+            url = f"/repos/{full_name}/issues"; params = {"state": "all", "sort": "updated", "direction": "asc", "per_page": 100, **({"since": cursor} if cursor else {})}; pages = 0
+            while url and pages != max_pages: # An unfinished crawl leaves the key BACKFILLING, to be resumed from the cursor
+                pages += 1; items, link = client.request("GET", url, params); items = items or []; url = client.next_link(link); params = None # The next URL carries the query
+                rows = [(repo, i["number"], int("pull_request" in i), i["state"], i["title"], (i.get("user") or {}).get("login"), i["created_at"], i["updated_at"]) for i in items]
+                labels = [(repo, l["name"] if isinstance(l, dict) else l, i["number"]) for i in items for l in i.get("labels") or []]
+                cursor = max([cursor or "", *(i["updated_at"] for i in items)]) or None
+                self._transaction([
+                    ("INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows),
+                    ("DELETE FROM issue_labels WHERE repo = ? AND number = ?", [(repo, r[1]) for r in rows]),
+                    ("INSERT OR IGNORE INTO issue_labels VALUES (?, ?, ?)", labels),
+                    ("INSERT OR REPLACE INTO sync_state VALUES (?, 'issues', ?, ?)", [(repo, cursor, self.BACKFILLING if url else time.time())])])
+                with self._lock: self.counters["issues_fetched"] += len(items)
+        return self._sync(client, repo, "issues", fetch)
+
+    @staticmethod
+    def _commit_cursor(cursor):
+        """(head sha, truncated) from a commits sync_state cursor."""
+        try: state = json.loads(cursor or "null")
+        except ValueError: return cursor, False # Plain head sha
+        return (state["head"], state["truncated"]) if isinstance(state, dict) else (None, False)
+
+    def sync_commits(self, client, full_name, branch):
+        """Brings the history of `branch` up to date; False while a longer (e.g. first) sync runs in the background."""
+        repo = full_name.casefold(); kind = f"commits:{branch}"
+        def fetch(cursor, max_pages):
+            known_head, truncated = self._commit_cursor(cursor)
+            url = f"/repos/{full_name}/commits"; params = {"sha": branch, "per_page": 100}; fetched = []; found = False; pages = 0
+            while url and not found and len(fetched) < self.commit_backfill:
+                if pages == max_pages: return # Budget spent (the last page left the key BACKFILLING); the rest runs in the background
+                pages += 1; page, link = client.request("GET", url, params); new = []
+                for c in page or []:
+                    if c["sha"] == known_head: found = True; break
+                    new.append((repo, branch, c["sha"], (c.get("author") or {}).get("login") or c["commit"]["author"]["name"], c["commit"]["committer"]["date"], c["commit"]["message"]))
+                fetched += [r[2] for r in new]; url = client.next_link(link); params = None
+                if url and not found and len(fetched) < self.commit_backfill: # More pages to come: keep this one, queries wait for the rest
+                    self._transaction([("INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?, ?, ?)", new),
+                                       ("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)", [(repo, kind, cursor, self.BACKFILLING)])])
+                    with self._lock: self.counters["commits_fetched"] += len(new)
+            if not found: # First sync, history rewritten (old head unreachable) or more new commits than the backfill cap
+                keep = set(fetched)
+                with self._lock: stored = [sha for (sha,) in self._conn().execute("SELECT sha FROM commits WHERE repo = ? AND branch = ?", (repo, branch))]
+                truncated = url is not None
+            head = fetched[0] if fetched else known_head
+            self._transaction([
+                ("DELETE FROM commits WHERE repo = ? AND branch = ? AND sha = ?", [] if found else [(repo, branch, sha) for sha in stored if sha not in keep]),
+                ("INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?, ?, ?)", new),
+                ("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)", [(repo, kind, json.dumps({"head": head, "truncated": truncated}), time.time())])])
+            with self._lock: self.counters["commits_fetched"] += len(new)
+        return self._sync(client, repo, kind, fetch)
+
+    def commits_truncated(self, full_name, branch):
+        """True if only the newest part of the branch's history is stored (see commit_backfill)."""
+        state = self._state(full_name.casefold(), f"commits:{branch}")
+        return bool(state) and self._commit_cursor(state[0])[1]
+
+    def _query(self, sql, params, offset, limit):
+        with self._lock:
+            self.counters["queries"] += 1
+            db = self._conn(); total = db.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+            return db.execute(f"{sql} LIMIT ? OFFSET ?", [*params, limit, offset]).fetchall(), total
+
+    def issues(self, full_name, pull_requests=False, state="open", labels=None, author=None, since=None, until=None, offset=0, limit=GITHUB_LIST_LIMIT):
+        """(rows of (number, title, state), total matching), most recently updated first."""
+        where = ["i.repo = ?", "i.is_pr = ?"]; params = [full_name.casefold(), int(pull_requests)]
+        if state and state != "all": where.append("i.state = ?"); params.append(state)
+        if author: where.append("i.author = ?"); params.append(author)
+        if since: where.append("i.updated_at >= ?"); params.append(since)
+        if until: where.append("i.updated_at <= ?"); params.append(until)
+        for label in labels or []:
+            where.append("EXISTS (SELECT 1 FROM issue_labels l WHERE l.repo = i.repo AND l.label = ? AND l.number = i.number)"); params.append(label)
+        return self._query(f"SELECT i.number, i.title, i.state FROM issues i WHERE {' AND '.join(where)} ORDER BY i.updated_at DESC, i.number DESC", params, offset, limit)
+
+    def commits(self, full_name, branch, author=None, since=None, until=None, offset=0, limit=GITHUB_LIST_LIMIT):
+        """(rows of (sha, message), total matching), newest first."""
+        where = ["repo = ?", "branch = ?"]; params = [full_name.casefold(), branch]
+        if author: where.append("author = ?"); params.append(author)
+        if since: where.append("date >= ?"); params.append(since)
+        if until: where.append("date <= ?"); params.append(until)
+        return self._query(f"SELECT sha, message FROM commits WHERE {' AND '.join(where)} ORDER BY date DESC, sha", params, offset, limit)
+
+    def stats(self):
+        with self._lock: return dict(self.counters, path=str(self.path))
+
 class GitHubTool(Tool):
+    max_concurrency = 4
+    speculative = False # Mutating operations must wait for the complete response
+    cache_ttl = 300
+    READ_OPERATIONS = {"list_repos", "read_file", "list_files", "list_branches", "list_pull_requests", "get_commit_history", "list_issues", "get_repo_info", "search_code"}
+    NON_MUTATING_OPERATIONS = READ_OPERATIONS | {"clone_repo"}
+    def cacheable(self, args): return args.get("operation") in self.READ_OPERATIONS
+    def invalidates_cache(self, args): return args.get("operation") not in self.NON_MUTATING_OPERATIONS
+    def cache_key_args(self, args):
+        canonical = super().cache_key_args(args)
+        if "repo_name" in canonical: canonical["repo_name"] = canonical["repo_name"].casefold() # GitHub names are case-insensitive
+        return canonical
     def __init__(self):
         super().__init__(
             name="github_operations",
@@ -604,7 +2507,9 @@ class GitHubTool(Tool):
                             "comment_on_issue",
                             "close_issue",
                             "get_repo_info",
-                            "fork_repo"
+                            "fork_repo",
+                            "batch_commit",
+                            "search_code"
                         ],
                         "description": "GitHub operation."
                     },
@@ -623,26 +2528,203 @@ class GitHubTool(Tool):
                     "collaborator": {"type": "string", "description": "Username to add as collaborator."},
                     "permission": {"type": "string", "description": "Permission level for collaborator (pull/push/admin)."},
                     "state": {"type": "string", "description": "State for issue/PR (open/closed)."},
-                    "labels": {"type": "array", "items": {"type": "string"}, "description": "Labels for issue/PR."},
-                    "assignees": {"type": "array", "items": {"type": "string"}, "description": "Assignees for issue/PR."}
+                    "labels": {"type": "array", "items": {"type": "string"}, "description": "Labels for issue/PR (list_issues/list_pull_requests: must have all)."},
+                    "author": {"type": "string", "description": "Filter list_issues/list_pull_requests/get_commit_history by author login."},
+                    "since": {"type": "string", "description": "ISO date/time; list operations only return items updated (commits: committed) at or after it."},
+                    "until": {"type": "string", "description": "ISO date/time; list operations only return items updated (commits: committed) at or before it."},
+                    "query": {"type": "string", "description": "search_code: text to find (usages), or symbol name ('*' wildcard) to find definitions."},
+                    "search_type": {"type": "string", "enum": ["text", "symbol"], "description": "search_code: 'text' (default) for lines containing query, 'symbol' for Python/JS/TS definitions."},
+                    "limit": {"type": "integer", "description": "List operations: max items to return (default 30, max 100)."},
+                    "cursor": {"type": "string", "description": "List operations: cursor from a previous page's result, to continue after it."},
+                    "assignees": {"type": "array", "items": {"type": "string"}, "description": "Assignees for issue/PR."},
+                    "changes": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "path": {"type": "string", "description": "File path."},
+                                "content": {"type": "string", "description": "New file content (omit when deleting)."},
+                                "content_base64": {"type": "string", "description": "Base64 content for binary files."},
+                                "delete": {"type": "boolean", "description": "Delete this path."},
+                                "executable": {"type": "boolean", "description": "Mark file executable."}
+                            },
+                            "required": ["path"]
+                        },
+                        "description": "For batch_commit: file writes/deletes applied as a single commit."
+                    }
                 },
                 "required": ["operation"]
             },
             required=["operation"]
         )
+        self._client = None; self._client_lock = threading.Lock()
+        self.mirrors = RepoMirrorCache(); self.sync_store = GitHubSyncStore()
+        self._indexes = {}; self._indexes_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The shared GitHubClient (rebuilt if the API key changes)."""
+        with self._client_lock:
+            if self._client is None or self._client.token != github_api_key: self._client = GitHubClient(github_api_key)
+            return self._client
+
+    def stats(self):
+        with self._indexes_lock: indexes = {path: index.stats() for path, index in self._indexes.items()}
+        return {**(self._client.stats() if self._client else {}), "mirrors": self.mirrors.stats(), "sync": self.sync_store.stats(), "code_indexes": indexes}
+
+    def _code_index(self, repo_path):
+        key = str(repo_path)
+        with self._indexes_lock:
+            index = self._indexes.get(key)
+            if index is not None and not (Path(repo_path) / "agent-index.sqlite").exists(): index.close(); index = None # Mirror was evicted and re-cloned
+            if index is None: index = self._indexes[key] = CodeSearchIndex(repo_path, self.mirrors._git)
+            return index
 
-    def _get_repo(self, github, repo_name):
-        if not repo_name:
-            raise GitHubToolError("'repo_name' required.")
+    def _search_code(self, client, full_name, repo, br, kwargs, offset, limit):
+        """search_code: clones/fetches the mirror, brings its index up to the branch head, then queries it locally."""
+        query = kwargs.get("query"); search_type = kwargs.get("search_type") or "text"
+        if not query: raise GitHubToolError("'query' required for search_code.")
+        path, _ = self.mirrors.sync(full_name, repo["clone_url"], client.token)
+        commit = self.mirrors.head(path, br)
+        if not commit: raise GitHubToolError(f"Branch '{br}' not found in '{full_name}'.")
+        index = self._code_index(path)
+        index.update(commit, client.token)
+        if search_type == "symbol":
+            rows, more = index.search_symbols(query, kwargs.get("path", ""), offset, limit)
+            lines = [f"- {kind} {name}: {file_path}:{line}" for kind, name, file_path, line in rows]
+        else:
+            rows, more = index.search_text(query, kwargs.get("path", ""), offset, limit)
+            lines = [f"- {file_path}:{line}: {text}" for file_path, line, text in rows]
+        if not rows and not offset: return f"No {'definitions' if search_type == 'symbol' else 'matches'} for '{query}' in '{full_name}' (branch '{br}')."
+        return self._paged(f"Code search ({search_type}) for '{query}' in '{full_name}' branch '{br}' ({commit[:7]}):", lines, offset, more)
+
+    MIRROR_READ_OPERATIONS = ("read_file", "list_files", "list_branches")
+
+    def _read_mirror(self, client, operation, full_name, repo, br, kwargs):
+        """Serve a read from the local mirror (fetched first if stale); None means use the API instead."""
+        fp = kwargs.get("file_path"); dir_path = kwargs.get("path", ""); offset, limit = self._page_args(kwargs)
         try:
-            return github.get_repo(repo_name)
-        except GithubException as e:
-            if e.status == 404:
-                raise GitHubToolError(f"Repo '{repo_name}' not found/accessible.")
-            else:
-                raise GitHubToolError(f"Error accessing repo '{repo_name}': {e.status} - {e.data.get('message', str(e))}")
-        except Exception as e:
-            raise GitHubToolError(f"Error getting repo '{repo_name}': {str(e)}")
+            path, _ = self.mirrors.sync(full_name, repo["clone_url"], client.token)
+            if operation == "list_branches":
+                branches = self.mirrors.branches(path)
+                return self._paged(f"Branches in '{full_name}':", [f"- {b}" for b in branches[offset:offset + limit]], offset, offset + limit < len(branches))
+            if not self.mirrors.head(path, br): return None # Branch the mirror has not seen yet
+            if operation == "read_file": data = self.mirrors.read_file(path, br, fp, client.token)
+            else: entries = self.mirrors.list_dir(path, br, dir_path, client.token)
+        except GitHubToolError as e:
+            logger.warning(f"Mirror of '{full_name}' unavailable, using the API: {e}") # File only
+            return None
+        except IsADirectoryError: raise GitHubToolError(f"'{fp}' is a directory; use list_files.")
+        if operation == "read_file":
+            if data is None: raise GitHubToolError(f"Path '{fp}' not found in '{full_name}' (branch '{br}').")
+            return f"Content of '{fp}' in '{full_name}':\n```\n{data.decode('utf-8')}\n```"
+        if not entries: return f"Directory '{dir_path}' empty/not found."
+        return self._paged(f"Files/Dirs in '{full_name}/{dir_path}':", [f"- {'[DIR] ' if is_dir else ''}{name}" for name, is_dir in entries[offset:offset + limit]], offset, offset + limit < len(entries))
+
+    def _read(self, client, operation, repo_name, kwargs):
+        """Read operations over conditional REST GETs (unchanged data -> 304, free against the rate limit)."""
+        full_name = client.full_name(repo_name)
+        repo = client.repo_data(full_name)
+        br = kwargs.get("branch") or repo["default_branch"]
+        if operation == "read_file" and not kwargs.get("file_path"): raise GitHubToolError("'file_path' required.")
+        offset, limit = self._page_args(kwargs)
+        if operation == "search_code": return self._search_code(client, full_name, repo, br, kwargs, offset, limit)
+        if operation in self.MIRROR_READ_OPERATIONS and self.mirrors.exists(full_name):
+            served = self._read_mirror(client, operation, full_name, repo, br, kwargs)
+            if served is not None: return served
+        try:
+            if operation == "get_repo_info":
+                info = {
+                    "name": repo["name"],
+                    "full_name": repo["full_name"],
+                    "description": repo["description"],
+                    "url": repo["html_url"],
+                    "default_branch": repo["default_branch"],
+                    "private": repo["private"],
+                    "fork": repo["fork"],
+                    "stars": repo["stargazers_count"],
+                    "forks": repo["forks_count"],
+                    "open_issues": repo["open_issues_count"],
+                    "created_at": repo["created_at"],
+                    "updated_at": repo["updated_at"]
+                }
+                return f"Repository info for '{full_name}':\n" + json.dumps(info, indent=2)
+            elif operation == "read_file":
+                fp = kwargs.get("file_path")
+                if not fp:
+                    raise GitHubToolError("'file_path' required.")
+                logger.info(f"Reading '{fp}' from '{full_name}' branch '{br}'")
+                cf, _ = client.request("GET", f"/repos/{full_name}/contents/{fp.lstrip('/')}", {"ref": br})
+                if isinstance(cf, list): raise GitHubToolError(f"'{fp}' is a directory; use list_files.")
+                content = base64.b64decode(cf["content"]).decode('utf-8')
+                return f"Content of '{fp}' in '{full_name}':\n```\n{content}\n```"
+            elif operation == "list_files":
+                path = kwargs.get("path", "")
+                logger.info(f"Listing files in '{full_name}/{path}' branch '{br}'")
+                contents, _ = client.request("GET", f"/repos/{full_name}/contents/{path.strip('/')}", {"ref": br})
+                if not contents:
+                    return f"Directory '{path}' empty/not found."
+                contents = contents if isinstance(contents, list) else [contents] # The contents API returns a directory in one response
+                file_list = [f"- {'[DIR] ' if item['type'] == 'dir' else ''}{item['path']}" for item in contents[offset:offset + limit]]
+                return self._paged(f"Files/Dirs in '{full_name}/{path}':", file_list, offset, offset + limit < len(contents))
+            elif operation == "list_branches":
+                branches, more = client.get_slice(f"/repos/{full_name}/branches", offset=offset, limit=limit)
+                return self._paged(f"Branches in '{full_name}':", [f"- {b['name']}" for b in branches], offset, more)
+            elif operation in ("list_issues", "list_pull_requests"):
+                state = kwargs.get("state", "open"); pull_requests = operation == "list_pull_requests"
+                since, until = self._date_filter(kwargs, "since"), self._date_filter(kwargs, "until")
+                labels, author = kwargs.get("labels"), kwargs.get("author")
+                kind = "Pull requests" if pull_requests else "Issues"
+                if self.sync_store.sync_issues(client, full_name):
+                    rows, total = self.sync_store.issues(full_name, pull_requests, state, labels, author, since, until, offset, limit)
+                    more, shown = offset + len(rows) < total, f"{len(rows)} of {total} shown"
+                else: # First sync still running: the search API takes the same filters and order, and only the pages covering this slice are fetched
+                    q = [f"repo:{full_name}", "is:pr" if pull_requests else "is:issue", *([f"state:{state}"] if state != "all" else []), *(f'label:"{label}"' for label in labels or []),
+                         *([f"author:{author}"] if author else []), *([f"updated:>={since}"] if since else []), *([f"updated:<={until}"] if until else [])]
+                    items, more = client.get_slice("/search/issues", {"q": " ".join(q), "sort": "updated", "order": "desc"}, offset, limit)
+                    rows, shown = [(i["number"], i["title"], i["state"]) for i in items], f"{len(items)} shown"
+                return self._paged(f"{kind} in '{full_name}' ({state}, {shown}):", [f"- #{n}: {title} ({s})" for n, title, s in rows], offset, more)
+            elif operation == "get_commit_history":
+                fp = kwargs.get("file_path"); author = kwargs.get("author"); rows = None
+                since, until = self._date_filter(kwargs, "since"), self._date_filter(kwargs, "until")
+                if not fp and self.sync_store.sync_commits(client, full_name, br):
+                    rows, total = self.sync_store.commits(full_name, br, author, since, until, offset, limit)
+                    more, shown = offset + len(rows) < total, f"{len(rows)} of {total} shown"
+                    if not more and self.sync_store.commits_truncated(full_name, br): rows = None # The page reaches past the stored (newest) history
+                if rows is None: # Path-filtered or older history, or the first sync is still running: only the pages covering this slice are fetched
+                    params = {"sha": br, **{k: v for k, v in (("path", fp), ("author", author), ("since", since), ("until", until)) if v}}
+                    commits, more = client.get_slice(f"/repos/{full_name}/commits", params, offset, limit)
+                    rows, shown = [(c["sha"], c["commit"]["message"]) for c in commits], f"{len(commits)} shown"
+                scope = f"file '{fp}'" if fp else "repository"
+                return self._paged(f"Recent commits for {scope} in '{full_name}' ({shown}):", [f"- {sha[:7]}: {message}" for sha, message in rows], offset, more)
+        except GitHubAPIError as e:
+            if e.status == 404 and operation in ("read_file", "list_files"): raise GitHubToolError(f"Path '{kwargs.get('file_path') or kwargs.get('path', '')}' not found in '{full_name}' (branch '{br}').")
+            raise
+
+    CONDITIONAL_READ_OPERATIONS = ("get_repo_info", "read_file", "list_files", "list_branches", "list_issues", "list_pull_requests", "get_commit_history", "search_code")
+
+    @staticmethod
+    def _page_args(kwargs):
+        """(offset, limit) from a list operation's 'cursor' and 'limit' arguments."""
+        limit = kwargs["limit"] if kwargs.get("limit") is not None else GITHUB_LIST_LIMIT; cursor = str(kwargs.get("cursor") or 0)
+        if not isinstance(limit, int) or limit < 1: raise GitHubToolError("'limit' must be a positive integer.")
+        if not cursor.isdigit(): raise GitHubToolError(f"Invalid 'cursor': {cursor}")
+        return int(cursor), min(limit, GITHUB_LIST_MAX)
+
+    @staticmethod
+    def _paged(header, lines, offset, more):
+        """One page of a list result; ends with the cursor for the next page when there is one."""
+        text = header + "\n" + "\n".join(lines)
+        return text + f"\n(More available: pass cursor='{offset + len(lines)}' for the next page.)" if more else text
+
+    @staticmethod
+    def _date_filter(kwargs, key):
+        """ISO date/time argument normalised to GitHub's UTC timestamp format (comparable as text)."""
+        if not kwargs.get(key): return None
+        try: value = datetime.fromisoformat(kwargs[key])
+        except ValueError: raise GitHubToolError(f"Invalid '{key}' date: {kwargs[key]}")
+        if value.tzinfo is not None: value = value.astimezone(timezone.utc)
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ")
 
     def execute(self, **kwargs):
         self.validate_args(kwargs)
@@ -651,18 +2733,30 @@ class GitHubTool(Tool):
         
         if not github_api_key:
             raise GitHubToolError("GitHub API key missing.")
-            
+        client = self.client
+        with client.track(operation, GitHubRateScheduler.READ if operation in self.NON_MUTATING_OPERATIONS else GitHubRateScheduler.WRITE):
+            result = self._execute(client, operation, kwargs)
+        if operation not in self.NON_MUTATING_OPERATIONS and operation != "create_repo":
+            full_name = client.full_name(kwargs.get("repo_name")) # Our own write: refresh mirror and synced lists before the next read
+            self.mirrors.mark_stale(full_name); self.sync_store.mark_stale(full_name)
+        return result
+
+    def _execute(self, client, operation, kwargs):
+        GithubException = lazy_import("github").GithubException
         try:
-            g = Github(github_api_key)
-            user = g.get_user()
-            
+            if operation in self.CONDITIONAL_READ_OPERATIONS:
+                return self._read(client, operation, kwargs.get("repo_name"), kwargs)
             if operation == "list_repos":
-                repos = list(user.get_repos(affiliation='owner'))
-                if not repos:
+                offset, limit = self._page_args(kwargs)
+                repos, more = client.get_slice("/user/repos", {"affiliation": "owner"}, offset, limit)
+                if not repos and not offset:
                     return "No owned repositories found."
-                repo_list = [f"- {r.full_name} ({'private' if r.private else 'public'})" for r in repos[:30]]
-                return f"Your repositories ({min(len(repos), 30)} shown):\n" + "\n".join(repo_list)
-            elif operation == "create_repo":
+                repo_list = [f"- {r['full_name']} ({'private' if r['private'] else 'public'})" for r in repos]
+                return self._paged(f"Your repositories ({len(repos)} shown):", repo_list, offset, more)
+            client.scheduler.admit() # PyGithub calls below bypass request(); at least wait for our turn
+            user = client.user()
+            
+            if operation == "create_repo":
                 repo_name = kwargs.get("repo_name")
                 if not repo_name or "/" in repo_name:
                     raise GitHubToolError("Valid repo name (no owner) required.")
@@ -678,18 +2772,9 @@ class GitHubTool(Tool):
                 return f"Repository '{repo.full_name}' created: {repo.html_url}"
             
             repo_name = kwargs.get("repo_name")
-            repo = self._get_repo(g, repo_name)
+            repo = client.repo(repo_name)
             
-            if operation == "read_file":
-                fp = kwargs.get("file_path")
-                br = kwargs.get("branch", repo.default_branch)
-                if not fp:
-                    raise GitHubToolError("'file_path' required.")
-                logger.info(f"Reading '{fp}' from '{repo.full_name}' branch '{br}'")
-                cf = repo.get_contents(fp, ref=br)
-                content = base64.b64decode(cf.content).decode('utf-8')
-                return f"Content of '{fp}' in '{repo.full_name}':\n```\n{content}\n```"
-            elif operation == "write_file":
+            if operation == "write_file":
                 fp = kwargs.get("file_path")
                 fc = kwargs.get("file_content")
                 cm = kwargs.get("commit_message")
@@ -713,41 +2798,11 @@ class GitHubTool(Tool):
                         {"type": "github_action", "action": "write_file", "repo": repo.full_name, "path": fp, "time": datetime.now().isoformat()}
                     )
                 return f"File '{fp}' {action} in '{repo.full_name}'. Commit: {commit['commit'].sha}"
-            elif operation == "list_files":
-                path = kwargs.get("path", "")
-                br = kwargs.get("branch", repo.default_branch)
-                logger.info(f"Listing files in '{repo.full_name}/{path}' branch '{br}'")
-                contents = repo.get_contents(path, ref=br)
-                if not contents:
-                    return f"Directory '{path}' empty/not found."
-                file_list = [f"- {'[DIR] ' if item.type == 'dir' else ''}{item.path}" for item in contents]
-                return f"Files/Dirs in '{repo.full_name}/{path}':\n" + "\n".join(file_list)
             elif operation == "clone_repo":
-                clone_dir = Path(tempfile.mkdtemp())
-                repo_url = repo.clone_url
-                logger.info(f"Cloning '{repo.full_name}' to {clone_dir}")
-                try:
-                    process = subprocess.run(['git', 'clone', repo_url, str(clone_dir)], capture_output=True, text=True, check=True, timeout=120)
-                    logger.info(f"Clone success: {process.stdout}")
-                    result = f"Repo '{repo.full_name}' cloned temporarily to {clone_dir} (now removed)."
-                    shutil.rmtree(clone_dir)
-                    return result
-                except subprocess.CalledProcessError as e:
-                    logger.error(f"Git clone failed: {e.stderr}")
-                    shutil.rmtree(clone_dir)
-                    raise GitHubToolError(f"Git clone failed: {e.stderr}")
-                except subprocess.TimeoutExpired:
-                    logger.error("Git clone timed out.")
-                    shutil.rmtree(clone_dir)
-                    raise GitHubToolError("Git clone operation timed out.")
-                except FileNotFoundError:
-                    logger.error("Git command not found.")
-                    shutil.rmtree(clone_dir)
-                    raise GitHubToolError("Git command not found.")
-                except Exception as e:
-                    logger.error(f"Clone/cleanup error: {e}")
-                    shutil.rmtree(clone_dir)
-                    raise GitHubToolError(f"Cloning error: {str(e)}")
+                logger.info(f"Syncing local mirror of '{repo.full_name}'")
+                path, action = self.mirrors.sync(repo.full_name, repo.clone_url, client.token, force=True)
+                branches = self.mirrors.branches(path)
+                return f"Repo '{repo.full_name}' {'cloned into' if action == 'clone' else 'updated in'} local mirror {path} ({len(branches)} branch(es)); read_file, list_files and list_branches are now served from it."
             elif operation == "create_directory":
                 path = kwargs.get("path")
                 branch = kwargs.get("branch", repo.default_branch)
@@ -802,6 +2857,10 @@ class GitHubTool(Tool):
 
             elif operation == "delete_repo":
                 repo.delete()
+                client.forget_repo(repo.full_name)
+                with self._indexes_lock: index = self._indexes.pop(str(self.mirrors.path(repo.full_name)), None)
+                if index: index.close()
+                self.mirrors.forget(repo.full_name)
                 if vector_db.is_ready():
                     vector_db.add(
                         f"Deleted repository: {repo.full_name}",
@@ -878,17 +2937,6 @@ class GitHubTool(Tool):
                     )
                 return f"Pull request #{pr_number} merged successfully."
 
-            elif operation == "list_branches":
-                branches = repo.get_branches()
-                branch_list = [f"- {b.name}" for b in branches]
-                return f"Branches in '{repo.full_name}':\n" + "\n".join(branch_list)
-
-            elif operation == "list_pull_requests":
-                state = kwargs.get("state", "open")
-                prs = repo.get_pulls(state=state)
-                pr_list = [f"- #{pr.number}: {pr.title} ({pr.state})" for pr in prs]
-                return f"Pull requests in '{repo.full_name}' ({state}):\n" + "\n".join(pr_list)
-
             elif operation == "add_collaborator":
                 username = kwargs.get("collaborator")
                 permission = kwargs.get("permission", "push")
@@ -904,13 +2952,6 @@ class GitHubTool(Tool):
                     )
                 return f"Added {username} as collaborator to '{repo.full_name}' with {permission} permission."
 
-            elif operation == "get_commit_history":
-                fp = kwargs.get("file_path")
-                commits = repo.get_commits(path=fp) if fp else repo.get_commits()
-                commit_list = [f"- {c.sha[:7]}: {c.commit.message}" for c in commits[:30]]
-                scope = f"file '{fp}'" if fp else "repository"
-                return f"Recent commits for {scope} in '{repo.full_name}':\n" + "\n".join(commit_list)
-
             elif operation == "create_issue":
                 title = kwargs.get("title")
                 body = kwargs.get("body", "")
@@ -934,12 +2975,6 @@ class GitHubTool(Tool):
                     )
                 return f"Issue #{issue.number} created in '{repo.full_name}'"
 
-            elif operation == "list_issues":
-                state = kwargs.get("state", "open")
-                issues = repo.get_issues(state=state)
-                issue_list = [f"- #{issue.number}: {issue.title} ({issue.state})" for issue in issues]
-                return f"Issues in '{repo.full_name}' ({state}):\n" + "\n".join(issue_list)
-
             elif operation == "comment_on_issue":
                 number = kwargs.get("number")
                 body = kwargs.get("body")
@@ -973,22 +3008,20 @@ class GitHubTool(Tool):
                     )
                 return f"Issue #{number} closed in '{repo.full_name}'"
 
-            elif operation == "get_repo_info":
-                info = {
-                    "name": repo.name,
-                    "full_name": repo.full_name,
-                    "description": repo.description,
-                    "url": repo.html_url,
-                    "default_branch": repo.default_branch,
-                    "private": repo.private,
-                    "fork": repo.fork,
-                    "stars": repo.stargazers_count,
-                    "forks": repo.forks_count,
-                    "open_issues": repo.open_issues_count,
-                    "created_at": repo.created_at.isoformat(),
-                    "updated_at": repo.updated_at.isoformat()
-                }
-                return f"Repository info for '{repo.full_name}':\n" + json.dumps(info, indent=2)
+            elif operation == "batch_commit":
+                changes = kwargs.get("changes")
+                cm = kwargs.get("commit_message")
+                br = kwargs.get("branch", repo.default_branch)
+                if not changes or not cm:
+                    raise GitHubToolError("'changes' and 'commit_message' required for batch_commit.")
+                logger.info(f"Batch committing {len(changes)} change(s) to '{repo.full_name}' branch '{br}'")
+                sha, written, deleted = client.commit_changes(repo.full_name, br, changes, cm)
+                if vector_db.is_ready():
+                    vector_db.add(
+                        f"Batch commit to {repo.full_name}: {cm}",
+                        {"type": "github_action", "action": "batch_commit", "repo": repo.full_name, "branch": br, "paths": [c.get("path") for c in changes], "time": datetime.now().isoformat()}
+                    )
+                return f"Committed {written} write(s) and {deleted} delete(s) to '{repo.full_name}' (branch '{br}') in one commit: {sha}"
 
             elif operation == "fork_repo":
                 fork = user.create_fork(repo)
@@ -1004,12 +3037,20 @@ class GitHubTool(Tool):
 
         except GithubException as e:
             logger.error(f"GitHub API error: {e}")
+            message = (e.data or {}).get("message", str(e)) if isinstance(e.data, dict) else str(e)
+            if e.status == 429 or (e.status == 403 and "rate limit" in message.lower()):
+                raise GitHubRateLimitError(e.status, message, client.scheduler.penalise(getattr(e, "headers", None)))
             raise GitHubToolError(f"GitHub API error: {e.status} - {e.data.get('message', str(e))}")
+        except GitHubToolError as e:
+            logger.error(f"GitHub tool error: {e}")
+            raise
         except Exception as e:
             logger.error(f"GitHub tool error: {e}", exc_info=True)
             raise GitHubToolError(f"Unexpected GitHub tool error: {str(e)}")
 
 class DataVisualizationTool(Tool):
+    max_concurrency = 1 # pyplot's global figure state is not thread-safe
+    speculative = False # Writes the plot file
     def __init__(self):
         super().__init__(
             name="visualize_data",
@@ -1104,6 +3145,8 @@ class DataVisualizationTool(Tool):
             raise ToolExecutionError(f"Failed to create visualization: {e}")
 
 class AWSRekognitionTool(Tool):
+    max_concurrency = 4
+    speculative = False # Paid API call
     def __init__(self):
         super().__init__(
             name="aws_rekognition",
@@ -1132,10 +3175,22 @@ class AWSRekognitionTool(Tool):
                 "required": ["operation", "source_image"]
             }
         )
+        self._client = None
+
+    def _get_client(self):
+        # boto3 client construction is slow; build it once on first use
+        if self._client is None:
+            self._client = lazy_import("boto3").client(
+                'rekognition',
+                aws_access_key_id=aws_access_key,
+                aws_secret_access_key=aws_secret_key,
+                region_name='us-east-1'  # You can make this configurable if needed
+            )
+        return self._client
     
     def execute(self, **kwargs):
         self.validate_args(kwargs)
-        import boto3
+        boto3 = lazy_import("boto3")
         from pathlib import Path
         import base64
         
@@ -1144,12 +3199,7 @@ class AWSRekognitionTool(Tool):
                 raise ToolExecutionError("AWS credentials missing. Please set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
             
             # Initialize Rekognition client with credentials
-            rekognition = boto3.client(
-                'rekognition',
-                aws_access_key_id=aws_access_key,
-                aws_secret_access_key=aws_secret_key,
-                region_name='us-east-1'  # You can make this configurable if needed
-            )
+            rekognition = self._get_client()
             
             # Process source image
             source_image = kwargs.get("source_image")
@@ -1243,6 +3293,8 @@ class AWSRekognitionTool(Tool):
                '\n'.join([f"- {t['DetectedText']} ({t['Confidence']:.1f}%)" for t in texts])
 
 class ImageGenerationTool(Tool):
+    max_concurrency = 2
+    speculative = False # Paid API call
     def __init__(self):
         super().__init__(
             name="generate_image",
@@ -1265,9 +3317,7 @@ class ImageGenerationTool(Tool):
     
     def execute(self, **kwargs):
         self.validate_args(kwargs)
-        import requests
-        from pathlib import Path
-        import os
+        requests = lazy_import("requests")
         
         try:
             prompt = kwargs.get("prompt")
@@ -1283,7 +3333,7 @@ class ImageGenerationTool(Tool):
             logger.info(f"Generating image for prompt: {prompt}")
             
             # Generate image using Stability AI API
-            response = requests.post(
+            response = get_http_session().post(
                 "https://api.stability.ai/v2beta/stable-image/generate/core",
                 headers={
                     "authorization": f"Bearer {stability_api_key}",
@@ -1293,7 +3343,8 @@ class ImageGenerationTool(Tool):
                 data={
                     "prompt": prompt,
                     "output_format": "jpeg"
-                }
+                },
+                timeout=HTTP_SLOW_TIMEOUT
             )
             
             if response.status_code != 200:
@@ -1327,6 +3378,67 @@ class ImageGenerationTool(Tool):
             logger.error(f"Image generation error: {e}", exc_info=True)
             raise ToolExecutionError(f"Failed to generate image: {e}")
 
+    async def aexecute(self, **kwargs):
+        client = get_async_http_client()
+        if client is None: return await super().aexecute(**kwargs)
+        self.validate_args(kwargs)
+        httpx = lazy_import("httpx")
+
+        try:
+            prompt = kwargs.get("prompt")
+            file_name = kwargs.get("file_name")
+            output_dir = "generated_images"  # Fixed output directory
+
+            if not stability_api_key:
+                raise ToolExecutionError("Stability AI API key missing")
+
+            logger.info(f"Generating image for prompt: {prompt}")
+
+            response = await client.post(
+                "https://api.stability.ai/v2beta/stable-image/generate/core",
+                headers={
+                    "authorization": f"Bearer {stability_api_key}",
+                    "accept": "image/*"
+                },
+                files={"none": ""},
+                data={
+                    "prompt": prompt,
+                    "output_format": "jpeg"
+                },
+                timeout=async_timeout(HTTP_SLOW_TIMEOUT)
+            )
+
+            if response.status_code != 200:
+                raise ToolExecutionError(f"API Error: {response.json()}")
+
+            # Disk write off the event loop
+            output_path = Path(output_dir) / f"{file_name}.jpeg"
+            await asyncio.to_thread(lambda: (os.makedirs(output_dir, exist_ok=True), output_path.write_bytes(response.content)))
+
+            logger.info(f"Image saved to: {output_path}")
+
+            if vector_db.is_ready():
+                await vector_db.aadd(
+                    f"Generated image from prompt: {prompt}",
+                    {
+                        "type": "generated_image",
+                        "prompt": prompt,
+                        "file_path": str(output_path),
+                        "time": datetime.now().isoformat()
+                    }
+                )
+
+            return f"Image generated and saved to {output_path}"
+
+        except ToolExecutionError:
+            raise
+        except httpx.RequestError as e:
+            logger.error(f"API request error: {e}")
+            raise ToolExecutionError(f"Failed to connect to Stability AI API: {e}")
+        except Exception as e:
+            logger.error(f"Image generation error: {e}", exc_info=True)
+            raise ToolExecutionError(f"Failed to generate image: {e}")
+
 # --- Initialize Tools ---
 def initialize_tools():
     logger.info("Initializing tools...")
@@ -1350,7 +3462,8 @@ def initialize_tools():
     tool_map = {t.name: t for t in tools_list}
     logger.info(f"Tools initialized: {list(tool_map.keys())}")
     return schemas, tool_map
-active_tool_schemas, tool_map = initialize_tools()
+with startup_phase("tools"):
+    active_tool_schemas, tool_map = initialize_tools()
 
 # --- System Message Definition ---
 SYSTEM_MESSAGE = { 
@@ -1379,10 +3492,74 @@ SYSTEM_MESSAGE = {
 }
 logger.info(f"System message generated. Approx tokens: {len(SYSTEM_MESSAGE['content']) // 4}")
 
+# --- Attachment Store ---
+# File payloads are kept once on disk, addressed by sha256; history only holds
+# {"attachment_ref": sha} parts. materialize() expands refs for the last `keep_turns`
+# user turns (each file at most once per request) and stubs out older ones.
+class AttachmentStore:
+    ENCODED_CACHE_SIZE = 4 # Recently used data: URLs kept encoded in memory
+    def __init__(self, root=None, keep_turns=2):
+        self.root = Path(root or os.environ.get("AGENT_ATTACHMENT_DIR", ".agent_cache/attachments"))
+        self.keep_turns = keep_turns; self._meta = {}; self._encoded = OrderedDict(); self._lock = threading.Lock()
+    def _path(self, sha): return self.root / sha[:2] / sha
+    def put(self, data, mime_type, name=None):
+        """Stores `data` (deduplicated by content hash) and returns the file dict for a history part."""
+        sha = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            path = self._path(sha)
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(".tmp"); tmp.write_bytes(data); tmp.replace(path)
+                path.with_suffix(".json").write_text(json.dumps({"format": mime_type, "filename": name, "size": len(data)}))
+                logger.info(f"Attachment stored: {sha[:12]} ({len(data)} bytes)")
+            else: logger.info(f"Attachment deduplicated: {sha[:12]}")
+            self._meta[sha] = {"format": mime_type, "filename": name, "size": len(data)}
+        return {"attachment_ref": sha, "format": mime_type, "filename": name}
+    def get_meta(self, sha):
+        if sha not in self._meta:
+            meta_path = self._path(sha).with_suffix(".json")
+            if not meta_path.exists(): return None
+            self._meta[sha] = json.loads(meta_path.read_text())
+        return self._meta[sha]
+    def data_url(self, sha):
+        with self._lock:
+            if sha in self._encoded: self._encoded.move_to_end(sha); return self._encoded[sha]
+        meta = self.get_meta(sha)
+        url = f"data:{meta['format']};base64,{base64.b64encode(self._path(sha).read_bytes()).decode('utf-8')}"
+        with self._lock:
+            self._encoded[sha] = url
+            while len(self._encoded) > self.ENCODED_CACHE_SIZE: self._encoded.popitem(last=False)
+        return url
+    def stub(self, sha):
+        meta = self.get_meta(sha) or {}
+        return f"[Attachment {meta.get('filename') or 'file'} ({meta.get('format', 'unknown')}, {meta.get('size', '?')} bytes, sha256:{sha[:12]}) was shared earlier; payload omitted.]"
+    @staticmethod
+    def _is_ref(part): return isinstance(part, dict) and part.get("type") == "file" and "attachment_ref" in part.get("file", {})
+    def materialize(self, messages, keep_turns=None):
+        """Returns a copy of `messages` ready to send; stored messages are never mutated."""
+        keep_turns = self.keep_turns if keep_turns is None else keep_turns
+        out = list(messages); user_turns = 0; sent = set()
+        for i in range(len(out) - 1, -1, -1):
+            msg = out[i]
+            if msg.get("role") != "user": continue
+            user_turns += 1; content = msg.get("content")
+            if not isinstance(content, list) or not any(self._is_ref(p) for p in content): continue
+            parts = []
+            for part in content:
+                if not self._is_ref(part): parts.append(part); continue
+                sha = part["file"]["attachment_ref"]
+                if user_turns <= keep_turns and sha not in sent and self.get_meta(sha):
+                    parts.append({"type": "file", "file": {"file_data": self.data_url(sha), "format": part["file"].get("format")}}); sent.add(sha)
+                else: parts.append({"type": "text", "text": self.stub(sha)})
+            out[i] = {**msg, "content": parts}
+        return out
+attachment_store = AttachmentStore(keep_turns=int(os.environ.get("AGENT_ATTACHMENT_TURNS", 2)))
+
 # --- File Processing Helper (Updated) ---
 def process_file_input(file_identifier):
     """Process file input from URL, GCS, or local path - enhanced version with better error handling."""
     logger.info(f"Processing file: {file_identifier}")
+    requests = lazy_import("requests")
     content_part = {"type": "file"}
     file_data_dict = {}
     mime_type = None
@@ -1393,20 +3570,19 @@ def process_file_input(file_identifier):
         mime_type, _ = mimetypes.guess_type(file_identifier)
         if not mime_type:
             try:
-                r = requests.head(file_identifier, allow_redirects=True, timeout=10)
+                r = get_http_session().head(file_identifier, allow_redirects=True)
                 r.raise_for_status()
                 ct = r.headers.get('Content-Type')
                 mime_type = ct.split(';')[0].strip() if ct else None
                 # If HEAD request worked but didn't get mime type, try with GET to fetch content
                 if not mime_type:
-                    r = requests.get(file_identifier, timeout=15)
+                    r = get_http_session().get(file_identifier)
                     r.raise_for_status()
                     ct = r.headers.get('Content-Type')
                     mime_type = ct.split(';')[0].strip() if ct else "application/octet-stream"
                     # Try to download the content directly
                     file_content = r.content
-                    encoded_content = base64.b64encode(file_content).decode("utf-8")
-                    file_data_dict["file_data"] = f"data:{mime_type};base64,{encoded_content}"
+                    file_data_dict.update(attachment_store.put(file_content, mime_type, Path(file_identifier.split("?")[0]).name))
                     logger.info(f" Downloaded URL content: {len(file_content)} bytes with mime: {mime_type}")
                     # Skip file_id approach and use direct content
                     del file_data_dict["file_id"]
@@ -1445,12 +3621,11 @@ def process_file_input(file_identifier):
         
         try:
             fb = lp.read_bytes()
-            ed = base64.b64encode(fb).decode("utf-8")
             mime_type, _ = mimetypes.guess_type(lp)
             if not mime_type:
                 # Try to guess from content
-                import magic  # This might require installation
                 try:
+                    import magic  # This might require installation
                     mime_type = magic.from_buffer(fb, mime=True)
                 except (ImportError, AttributeError):
                     # Fallback to some basic checks
@@ -1468,7 +3643,7 @@ def process_file_input(file_identifier):
             else:
                 logger.info(f" Local MIME: {mime_type}")
             
-            file_data_dict["file_data"] = f"data:{mime_type};base64,{ed}"
+            file_data_dict.update(attachment_store.put(fb, mime_type, lp.name))
             if vector_db.is_ready():
                 fn = lp.name
                 vector_db.add(f"User file: {fn} ({mime_type})", {
@@ -1476,6 +3651,7 @@ def process_file_input(file_identifier):
                     "source": "local", 
                     "filename": fn, 
                     "mime_type": mime_type, 
+                    "sha256": file_data_dict["attachment_ref"],
                     "time": datetime.now().isoformat()
                 })
         except Exception as e:
@@ -1487,115 +3663,347 @@ def process_file_input(file_identifier):
     return content_part
 
 # --- Tool Execution Wrapper (Accepts Dict) ---
-def execute_tool_call(tool_call_data):
-    """Wrapper for executing tool calls using dictionary input."""
+def _resolve_tool_call(tool_call_data):
+    """Parses a tool call dict into (tool, args, None), or (None, None, error message)."""
     function_name = tool_call_data.get('function', {}).get('name')
     arguments_str = tool_call_data.get('function', {}).get('arguments')
-    if not function_name: error_msg = "Error: Tool call missing function name."; logger.error(error_msg); return error_msg
+    if not function_name: error_msg = "Error: Tool call missing function name."; logger.error(error_msg); return None, None, error_msg
     try:
         function_args = json.loads(arguments_str) if arguments_str else {}
         logger.info(f"Attempting execution: '{function_name}' args: {function_args}") # File only
-    except json.JSONDecodeError: error_msg = f"Error: Invalid JSON args for {function_name}"; logger.error(error_msg); return error_msg # Console ERROR
-    if function_name not in tool_map: error_msg = f"Error: Unknown function '{function_name}'"; logger.error(error_msg); return error_msg # Console ERROR
+    except json.JSONDecodeError: error_msg = f"Error: Invalid JSON args for {function_name}"; logger.error(error_msg); return None, None, error_msg # Console ERROR
+    if function_name not in tool_map: error_msg = f"Error: Unknown function '{function_name}'"; logger.error(error_msg); return None, None, error_msg # Console ERROR
+    return tool_map[function_name], function_args, None
+
+def _tool_succeeded(function_name, result):
+    logger.info(f"Tool '{function_name}' executed successfully.") # File only
+    logger.debug(f"Tool '{function_name}' result snippet: {str(result)[:200]}...") # File only
+    return result
+
+def _tool_failed(function_name, e):
+    if isinstance(e, ToolExecutionError): logger.error(f"Tool execution failed '{function_name}': {e}"); return f"Error executing tool {function_name}: {e}" # Console ERROR + return error msg
+    logger.critical(f"Unexpected critical error executing tool '{function_name}'", exc_info=e); return f"Critical Error executing tool {function_name}." # Console CRITICAL + return error msg
+
+def execute_tool_call(tool_call_data):
+    """Wrapper for executing tool calls using dictionary input."""
+    tool, function_args, error_msg = _resolve_tool_call(tool_call_data)
+    if error_msg: return error_msg
+    generation = tool_result_cache.generation(tool.name); cached = tool_result_cache.get(tool, function_args)
+    if cached is not None: logger.info(f"Tool '{tool.name}' served from cache."); return cached # File only
+    try: result = tool.execute(**function_args)
+    except Exception as e: return _tool_failed(tool.name, e)
+    tool_result_cache.record(tool, function_args, result, generation)
+    return _tool_succeeded(tool.name, result)
+
+async def aexecute_tool_call(tool_call_data):
+    """Async execute_tool_call(): awaits Tool.aexecute() under the tool's per-loop concurrency limit."""
+    tool, function_args, error_msg = _resolve_tool_call(tool_call_data)
+    if error_msg: return error_msg
+    generation = tool_result_cache.generation(tool.name); cached = tool_result_cache.get(tool, function_args)
+    if cached is not None: logger.info(f"Tool '{tool.name}' served from cache."); return cached # File only
     try:
-        tool = tool_map[function_name]; result = tool.execute(**function_args)
-        logger.info(f"Tool '{function_name}' executed successfully.") # File only
-        logger.debug(f"Tool '{function_name}' result snippet: {str(result)[:200]}...") # File only
-        return result
-    except ToolExecutionError as e: logger.error(f"Tool execution failed '{function_name}': {e}"); return f"Error executing tool {function_name}: {e}" # Console ERROR + return error msg
-    except Exception as e: logger.critical(f"Unexpected critical error executing tool '{function_name}'", exc_info=True); return f"Critical Error executing tool {function_name}." # Console CRITICAL + return error msg
+        async with tool.async_slot(): result = await tool.aexecute(**function_args)
+    except Exception as e: return _tool_failed(tool.name, e)
+    tool_result_cache.record(tool, function_args, result, generation)
+    return _tool_succeeded(tool.name, result)
+
+
+# --- Parallel Tool Execution ---
+TOOL_WORKERS = int(os.environ.get("AGENT_TOOL_WORKERS", 8))
+TOOL_TURN_DEADLINE = float(os.environ.get("AGENT_TOOL_DEADLINE", 120)) # Seconds for all tool calls of one turn
+SPECULATIVE_TOOLS = "--speculative-tools" in sys.argv or os.environ.get("AGENT_SPECULATIVE_TOOLS", "").lower() in ("1", "true", "yes")
+_tool_executor = None
+
+def get_tool_executor():
+    global _tool_executor
+    if _tool_executor is None: _tool_executor = concurrent.futures.ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+    return _tool_executor
+
+# Calls waiting for a concurrency slot of their tool, per tool name; they hold no pool thread while queued
+_tool_backlog = defaultdict(deque); _tool_backlog_lock = threading.Lock()
+
+def _run_in_slot(tool, future, ctx, tool_call_data):
+    """Runs one call that already holds a slot of its tool, then hands the slot to the tool's next queued call."""
+    try:
+        if future.set_running_or_notify_cancel(): # False if it was cancelled (turn deadline) while queued
+            try: future.set_result(ctx.run(execute_tool_call, tool_call_data))
+            except BaseException as e: future.set_exception(e)
+    finally:
+        with _tool_backlog_lock:
+            queued = _tool_backlog[tool.name].popleft() if _tool_backlog[tool.name] else None
+            if queued is None: tool.concurrency_slot().release()
+        if queued is not None: get_tool_executor().submit(_run_in_slot, tool, *queued)
+
+def submit_tool_call(tool_call_data):
+    """Schedules one tool call on the shared pool. A call of a tool at its concurrency limit waits in the
+    tool's backlog instead of on a pool thread, so it cannot hold up calls of other tools."""
+    ctx = contextvars.copy_context() # Carry CURRENT_SESSION etc. into the worker thread
+    tool = tool_map.get(tool_call_data.get('function', {}).get('name'))
+    if tool is None or not tool.max_concurrency: return get_tool_executor().submit(ctx.run, execute_tool_call, tool_call_data)
+    future = concurrent.futures.Future()
+    with _tool_backlog_lock:
+        acquired = tool.concurrency_slot().acquire(blocking=False)
+        if not acquired: _tool_backlog[tool.name].append((future, ctx, tool_call_data))
+    if acquired: get_tool_executor().submit(_run_in_slot, tool, future, ctx, tool_call_data)
+    return future
+
+def collect_tool_results(tool_calls, futures, deadline=None):
+    """Waits for `futures` until the turn deadline; returns result strings in tool_call order."""
+    timeout = TOOL_TURN_DEADLINE if deadline is None else deadline
+    done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    results = []
+    for tc_data, fut in zip(tool_calls, futures):
+        name = tc_data.get('function', {}).get('name')
+        if fut in not_done:
+            fut.cancel(); logger.error(f"Tool '{name}' missed the {timeout:.0f}s turn deadline.")
+            results.append(f"Error executing tool {name}: did not finish within the {timeout:.0f}s turn deadline.")
+        else:
+            try: results.append(fut.result())
+            except Exception as e: logger.critical(f"Unexpected critical error executing tool '{name}'", exc_info=True); results.append(f"Critical Error executing tool {name}.")
+    return results
+
+def execute_tool_calls(tool_calls, deadline=None):
+    """Runs all tool calls of one assistant turn concurrently; latency ~ the slowest call, not the sum."""
+    return collect_tool_results(tool_calls, [submit_tool_call(tc) for tc in tool_calls], deadline)
+
+async def aexecute_tool_calls(tool_calls, deadline=None, started=None):
+    """Async execute_tool_calls(): one task per call on the running loop, bounded by the turn deadline.
+    `started` maps tool_call id -> task already running (AsyncSpeculativeToolRunner)."""
+    timeout = TOOL_TURN_DEADLINE if deadline is None else deadline; started = started if started is not None else {}
+    tasks = [started.pop(tc.get("id"), None) or asyncio.ensure_future(aexecute_tool_call(tc)) for tc in tool_calls]
+    _, not_done = await asyncio.wait(tasks, timeout=timeout) if tasks else (set(), set())
+    results = []
+    for tc_data, task in zip(tool_calls, tasks):
+        name = tc_data.get('function', {}).get('name')
+        if task in not_done:
+            task.cancel(); logger.error(f"Tool '{name}' missed the {timeout:.0f}s turn deadline.")
+            results.append(f"Error executing tool {name}: did not finish within the {timeout:.0f}s turn deadline.")
+        elif task.cancelled(): results.append(f"Error executing tool {name}: cancelled.")
+        elif task.exception(): logger.critical(f"Unexpected critical error executing tool '{name}'", exc_info=task.exception()); results.append(f"Critical Error executing tool {name}.")
+        else: results.append(task.result())
+    return results
 
 
 # --- Handle Streaming Response ---
 # (Unchanged)
-def handle_streaming_response(stream):
-    full_response_content = ""; tool_calls_agg = defaultdict(lambda: {"id": None, "name": None, "arguments": ""}); final_tool_calls_list = []; completed_tool_call_indices = set(); current_tool_call_index = -1
+class SpeculativeToolRunner:
+    """Opt-in (AGENT_SPECULATIVE_TOOLS=1): starts a tool call as soon as its streamed arguments
+    are complete JSON, so tool latency overlaps with the rest of the generation.
+
+    Tools with `speculative = False` (side effects, cost) still wait for the stream to end.
+    If the stream errors, queued work is cancelled and the turn's tool calls are discarded.
+    """
+    def __init__(self): self.futures = {}; self.aborted = False
+    def start(self, tool_call):
+        tool = tool_map.get(tool_call["function"]["name"])
+        if self.aborted or not tool or not tool.speculative or not tool_call.get("id"): return # Without an id the result cannot be matched back
+        logger.info(f"Speculatively starting tool '{tool_call['function']['name']}' ({tool_call['id']}).") # File only
+        self.futures[tool_call["id"]] = submit_tool_call(tool_call)
+    def abort(self):
+        self.aborted = True
+        for fut in self.futures.values(): fut.cancel() # Already-running calls finish in the background
+        self.futures.clear()
+    def results(self, tool_calls, deadline=None):
+        futures = [self.futures.pop(tc.get("id"), None) or submit_tool_call(tc) for tc in tool_calls]
+        return collect_tool_results(tool_calls, futures, deadline)
+
+class AsyncSpeculativeToolRunner(SpeculativeToolRunner):
+    """Event-loop variant: completed calls start as tasks (aexecute_tool_call) while the stream continues."""
+    def start(self, tool_call):
+        tool = tool_map.get(tool_call["function"]["name"])
+        if self.aborted or not tool or not tool.speculative or not tool_call.get("id"): return # Without an id the result cannot be matched back
+        logger.info(f"Speculatively starting tool '{tool_call['function']['name']}' ({tool_call['id']}).") # File only
+        self.futures[tool_call["id"]] = asyncio.ensure_future(aexecute_tool_call(tool_call))
+    async def results(self, tool_calls, deadline=None): return await aexecute_tool_calls(tool_calls, deadline, self.futures)
+
+class JSONCompletenessTracker:
+    """Tracks bracket/string/escape state of a JSON document arriving in deltas, in O(len(delta)).
+
+    `closes` counts how often the top-level value has become balanced; a caller only needs
+    to json.loads() the accumulated text when that number changes, instead of on every delta.
+    """
+    _SPECIAL = re.compile(r'["\\{}\[\]]')
+    def __init__(self): self.depth = 0; self.in_string = False; self._escape = False; self.started = False; self.closes = 0
+    @property
+    def balanced(self): return self.started and self.depth == 0 and not self.in_string
+    def feed(self, delta):
+        start = 0; skip_to = -1
+        if self._escape: start = 1; self._escape = False # First char was escaped by a trailing backslash
+        for m in self._SPECIAL.finditer(delta, start):
+            pos = m.start()
+            if pos < skip_to: continue
+            ch = m.group()
+            if self.in_string:
+                if ch == "\\":
+                    if pos + 1 >= len(delta): self._escape = True
+                    else: skip_to = pos + 2
+                elif ch == '"': self.in_string = False
+            elif ch == '"': self.in_string = True
+            elif ch in "{[": self.depth += 1; self.started = True
+            else:
+                self.depth -= 1
+                if self.depth == 0: self.closes += 1
+        return self.balanced
+
+class StreamAccumulator:
+    """Folds streamed completion chunks into one assistant message (shared by the sync and async handlers).
+
+    Text and arguments are accumulated as lists of parts (joined once) and argument completeness
+    is tracked incrementally, so a large streamed argument costs O(n), not O(n^2).
+    """
+    def __init__(self, on_tool_call=None):
+        self.on_tool_call = on_tool_call; self.content_parts = []; self.tool_calls = []; self._completed = set()
+        self._agg = defaultdict(lambda: {"id": None, "name": None, "parts": [], "tracker": JSONCompletenessTracker(), "checked": 0})
+    def feed(self, chunk):
+        """Consumes one chunk and returns its text delta (or None); `on_tool_call` fires as each call's arguments complete."""
+        delta_content = chunk.choices[0].delta.content
+        if delta_content: self.content_parts.append(delta_content)
+        delta_tool_calls = chunk.choices[0].delta.tool_calls
+        if delta_tool_calls:
+            for tc_chunk in delta_tool_calls:
+                idx = tc_chunk.index
+                current_call = self._agg[idx]
+                if tc_chunk.id: current_call["id"] = tc_chunk.id
+                if tc_chunk.function and tc_chunk.function.name: current_call["name"] = tc_chunk.function.name
+                if tc_chunk.function and tc_chunk.function.arguments:
+                    current_call["parts"].append(tc_chunk.function.arguments); current_call["tracker"].feed(tc_chunk.function.arguments)
+                tracker = current_call["tracker"]
+                if current_call["id"] and current_call["name"] and idx not in self._completed and tracker.balanced and tracker.closes != current_call["checked"]:
+                     current_call["checked"] = tracker.closes
+                     args_str = "".join(current_call["parts"]); current_call["parts"] = [args_str]; is_complete_json = False
+                     try: json.loads(args_str); is_complete_json = True
+                     except json.JSONDecodeError: pass
+                     if is_complete_json:
+                          logger.debug(f"Stream: Finalizing tool {idx}...") # File only
+                          self.tool_calls.append({"id": current_call["id"], "type": "function", "function": {"name": current_call["name"], "arguments": args_str}})
+                          self._completed.add(idx)
+                          if self.on_tool_call: self.on_tool_call(self.tool_calls[-1])
+        return delta_content
+    def discard_tool_calls(self): self.tool_calls = []
+    def message(self):
+        full_response_content = "".join(self.content_parts)
+        return {"role": "assistant", "content": full_response_content if full_response_content else None, "tool_calls": self.tool_calls if self.tool_calls else None}
+
+def handle_streaming_response(stream, speculative_runner=None):
+    acc = StreamAccumulator(on_tool_call=speculative_runner.start if speculative_runner else None)
     print("\nOmniBot: ", end="", flush=True) # Console output
     try:
         for chunk in stream:
-            delta_content = chunk.choices[0].delta.content
-            if delta_content: print(delta_content, end="", flush=True); full_response_content += delta_content
-            delta_tool_calls = chunk.choices[0].delta.tool_calls
-            if delta_tool_calls:
-                for tc_chunk in delta_tool_calls:
-                    idx = tc_chunk.index
-                    if tc_chunk.id: tool_calls_agg[idx]["id"] = tc_chunk.id
-                    if tc_chunk.function and tc_chunk.function.name: tool_calls_agg[idx]["name"] = tc_chunk.function.name
-                    if tc_chunk.function and tc_chunk.function.arguments: tool_calls_agg[idx]["arguments"] += tc_chunk.function.arguments
-                    current_call = tool_calls_agg[idx]
-                    if current_call["id"] and current_call["name"] and idx not in completed_tool_call_indices:
-                         args_str = current_call["arguments"]; is_complete_json = False
-                         try: json.loads(args_str); is_complete_json = True
-                         except json.JSONDecodeError: pass
-                         if is_complete_json:
-                              logger.debug(f"Stream: Finalizing tool {idx}...") # File only
-                              final_tool_calls_list.append({"id": current_call["id"], "type": "function", "function": {"name": current_call["name"], "arguments": args_str}})
-                              completed_tool_call_indices.add(idx)
-    except Exception as e: logger.error(f"Stream error: {e}", exc_info=True); print(f"\n[Stream Error: {e}]") # Console ERROR
+            delta_content = acc.feed(chunk)
+            if delta_content: print(delta_content, end="", flush=True)
+    except Exception as e:
+        logger.error(f"Stream error: {e}", exc_info=True); print(f"\n[Stream Error: {e}]") # Console ERROR
+        if speculative_runner: speculative_runner.abort(); acc.discard_tool_calls()
     finally: print()
-    final_message_dict = {"role": "assistant", "content": full_response_content if full_response_content else None, "tool_calls": final_tool_calls_list if final_tool_calls_list else None}
-    return final_message_dict
+    return acc.message()
+
+async def _emit(on_event, kind, payload=None):
+    if on_event is None: return
+    result = on_event(kind, payload)
+    if inspect.isawaitable(result): await result
+
+async def ahandle_streaming_response(stream, on_event=None, speculative_runner=None):
+    """Async handle_streaming_response() for litellm.acompletion streams. Nothing is printed: output is
+    reported as on_event("stream_start"/"token"/"error"/"stream_end", payload), so many streams can share one loop."""
+    acc = StreamAccumulator(on_tool_call=speculative_runner.start if speculative_runner else None)
+    await _emit(on_event, "stream_start")
+    try:
+        async for chunk in stream:
+            delta_content = acc.feed(chunk)
+            if delta_content: await _emit(on_event, "token", delta_content)
+    except Exception as e:
+        logger.error(f"Stream error: {e}", exc_info=True); await _emit(on_event, "error", f"Stream Error: {e}")
+        if speculative_runner: speculative_runner.abort(); acc.discard_tool_calls()
+    finally: await _emit(on_event, "stream_end")
+    return acc.message()
 
 
 # --- Main Chat Loop ---
-def chat_agent():
-    model_name = "gemini/gemini-2.5-flash-preview-04-17"
-    memory = ConversationMemory(system_message=SYSTEM_MESSAGE, max_tokens=1_000_000) # Increased limit
+DEFAULT_MODEL = "gemini/gemini-2.5-flash-preview-04-17"
+ASYNC_CORE = "--async" in sys.argv or os.environ.get("AGENT_ASYNC", "").lower() in ("1", "true", "yes")
+
+def new_conversation_memory():
+    context_tokens = int(os.environ.get("AGENT_CONTEXT_TOKENS", 64_000)) # Per-turn prompt budget; older turns get summarised
+    return ConversationMemory(system_message=SYSTEM_MESSAGE, max_tokens=1_000_000, context_tokens=context_tokens) # Increased limit
 
+def print_banner(model_name):
     logger.info("\n--- OmniBot Initialized (v9.8 - Codespaces Ready) ---") # File only
     print(f"OmniBot v9.8 Initialized. Model: {model_name}. Type 'quit' to exit.") # Console output
     print(f"Vector DB Status: {'Ready' if vector_db.is_ready() else 'Unavailable'}") # Console output
+    logger.info(format_startup_timings()) # File only
+    print(format_startup_timings()) # Console output (time-to-first-prompt)
     print("-" * 65 + "\n") # Console output
 
+def read_user_turn():
+    """Console prompt (incl. `file: <path|url>`). Returns the user message content list, None to re-prompt, or "quit"."""
+    user_input = input("You: ") # Console output
+    if user_input.lower() == "quit": return "quit"
+
+    user_message_content = []
+    # Enhanced file handling
+    if user_input.lower().startswith("file:") and len(user_input.split(' ', 1)) > 1:
+        file_id = user_input.split(' ', 1)[1].strip()
+        if file_id:
+            print("OmniBot: Processing file, please wait...", flush=True)  # Console output
+            file_part = process_file_input(file_id)
+            if not file_part:
+                print("OmniBot: [Error processing file. Please check if the file exists or URL is accessible.]")
+                return None  # Console output
+
+            prompt = input("You (prompt for file): ")  # Console output
+            if prompt:
+                user_message_content.extend([{"type": "text", "text": prompt}, file_part])
+            else:
+                # Allow file without prompt - default prompt
+                user_message_content.extend([{"type": "text", "text": "Analyze this file for me."}, file_part])
+        else:
+            print("OmniBot: [File command needs path/URL.]")
+            return None  # Console output
+    else:
+        user_message_content.append({"type": "text", "text": user_input})
+    return user_message_content or None
+
+def _user_text(user_message_content):
+    return next((item.get("text", "") for item in user_message_content if item.get("type") == "text"), "")
+
+def _log_api_error(e):
+    logger.error(f"LiteLLM API Error: {e}", exc_info=True); print(f"\n!!! OmniBot Error: API Failure {e.status_code if hasattr(e, 'status_code') else ''} !!!", file=sys.stderr) # Console ERROR
+    try: logger.error(f"API Error Body: {json.dumps(e.response.json(), indent=2)}") # Console ERROR
+    except: logger.error(f"Raw API Error: {e.response.text if hasattr(e, 'response') else 'N/A'}") # Console ERROR
+
+def chat_agent():
+    model_name = DEFAULT_MODEL
+    with startup_phase("litellm"):
+        litellm = lazy_import("litellm")
+    memory = new_conversation_memory()
+    CURRENT_SESSION.set(uuid.uuid4().hex) # Tags this conversation's memory writes for session-filtered search
+    summarizer = make_llm_summarizer(os.environ.get("AGENT_SUMMARY_MODEL", model_name))
+    print_banner(model_name)
+
     while True:
         try:
-            user_input = input("You: ") # Console output
-            if user_input.lower() == "quit": logger.info("User quit."); break # File only
-
-            user_message_content = []
-            # Enhanced file handling
-            if user_input.lower().startswith("file:") and len(user_input.split(' ', 1)) > 1:
-                file_id = user_input.split(' ', 1)[1].strip()
-                if file_id:
-                    print("OmniBot: Processing file, please wait...", flush=True)  # Console output
-                    file_part = process_file_input(file_id)
-                    if not file_part:
-                        print("OmniBot: [Error processing file. Please check if the file exists or URL is accessible.]")
-                        continue  # Console output
-                    
-                    prompt = input("You (prompt for file): ")  # Console output
-                    if prompt:
-                        user_message_content.extend([{"type": "text", "text": prompt}, file_part])
-                    else:
-                        # Allow file without prompt - default prompt
-                        user_message_content.extend([{"type": "text", "text": "Analyze this file for me."}, file_part])
-                else:
-                    print("OmniBot: [File command needs path/URL.]")
-                    continue  # Console output
-            else:
-                user_message_content.append({"type": "text", "text": user_input})
-            
+            memory.compact_in_background(summarizer) # Fold old turns while the user is typing
+            user_message_content = read_user_turn()
+            if user_message_content == "quit": logger.info("User quit."); break # File only
             if not user_message_content:
                 continue
 
             user_message = {"role": "user", "content": user_message_content}
             if not memory.add_message(user_message): print("OmniBot: [Message too long.]"); continue # Console output
 
-            user_text = user_input
-            if isinstance(user_message_content, list):
-                for item in user_message_content:
-                    if item.get("type") == "text": user_text = item.get("text",""); break
+            user_text = _user_text(user_message_content)
             if vector_db.is_ready(): vector_db.add(f"User said: {user_text}", {"type": "user_message", "time": datetime.now().isoformat()})
 
             # --- CONSOLE OUTPUT: Thinking ---
             print("\nOmniBot: Thinking...", flush=True)
             logger.info("OmniBot: Thinking...") # File only
 
-            current_messages = memory.get_messages()
+            current_messages = attachment_store.materialize(memory.get_messages())
             response_stream = litellm.completion(model=model_name, messages=current_messages, tools=active_tool_schemas, tool_choice="auto", stream=True)
 
             # Prints stream to console via handle_streaming_response
-            response_message_dict = handle_streaming_response(response_stream)
+            speculative_runner = SpeculativeToolRunner() if SPECULATIVE_TOOLS else None
+            response_message_dict = handle_streaming_response(response_stream, speculative_runner)
             memory.add_message(response_message_dict)
 
             if response_message_dict.get("tool_calls"):
@@ -1604,9 +4012,9 @@ def chat_agent():
                 logger.info(f"LLM requested {len(response_message_dict['tool_calls'])} tool(s)...") # File only
 
                 tool_results = []
-                for tc_data in response_message_dict["tool_calls"]:
-                    # Pass dictionary directly to corrected execute_tool_call
-                    result_content = execute_tool_call(tc_data)
+                tool_calls = response_message_dict["tool_calls"]
+                tool_outputs = speculative_runner.results(tool_calls) if speculative_runner else execute_tool_calls(tool_calls)
+                for tc_data, result_content in zip(tool_calls, tool_outputs):
                     if isinstance(result_content, str) and result_content.lower().startswith("error"):
                         logger.warning(f"Tool '{tc_data.get('function', {}).get('name')}' failed. Error: {result_content}") # Console WARN + File
                     result_msg = {"role": "tool", "tool_call_id": tc_data.get('id'), "content": str(result_content)}
@@ -1617,7 +4025,7 @@ def chat_agent():
                 print("\nOmniBot: Processing tool results...", flush=True)
                 logger.info("OmniBot: Processing tool results...") # File only
 
-                messages_with_results = memory.get_messages()
+                messages_with_results = attachment_store.materialize(memory.get_messages())
                 final_stream = litellm.completion(model=model_name, messages=messages_with_results, stream=True)
 
                 # Prints stream to console via handle_streaming_response
@@ -1639,19 +4047,314 @@ def chat_agent():
                 logger.warning("OmniBot received empty initial response (no content or tools).") # Console WARN
 
         # --- Error Handling ---
-        except litellm.exceptions.APIError as e:
-             logger.error(f"LiteLLM API Error: {e}", exc_info=True); print(f"\n!!! OmniBot Error: API Failure {e.status_code if hasattr(e, 'status_code') else ''} !!!", file=sys.stderr) # Console ERROR
-             try: logger.error(f"API Error Body: {json.dumps(e.response.json(), indent=2)}") # Console ERROR
-             except: logger.error(f"Raw API Error: {e.response.text if hasattr(e, 'response') else 'N/A'}") # Console ERROR
+        except litellm.exceptions.APIError as e: _log_api_error(e)
         except AgentException as e: logger.error(f"Agent Error: {e}", exc_info=True); print(f"\n!!! OmniBot Error: {e} !!!", file=sys.stderr) # Console ERROR
         except KeyboardInterrupt: logger.info("User interrupted."); print("\nOmniBot: Exiting..."); break # File info, Console output
         except Exception as e: logger.critical(f"Critical error in main loop!", exc_info=True); print(f"\n!!! OmniBot Critical Error: {e} !!!", file=sys.stderr); break # Console CRITICAL
 
 
+# --- Async Core ---
+async def llm_acompletion(**kwargs):
+    """The async model call (litellm.acompletion); a single seam so load tests can substitute a stub model."""
+    return await lazy_import("litellm").acompletion(**kwargs)
+
+async def achat_turn(memory, user_message_content, model_name=DEFAULT_MODEL, on_event=None):
+    """One user turn on the event loop, same flow as chat_agent(): stream the reply, run its tool calls
+    concurrently, stream the follow-up. Nothing here blocks the loop, so one process can drive many
+    conversations. Progress goes to on_event(kind, payload) (sync or async): "status", "stream_start",
+    "token", "stream_end", "tool_calls", "tool_result", "error", "done". Returns the final assistant text.
+    """
+    user_message = {"role": "user", "content": user_message_content}
+    if not memory.add_message(user_message): await _emit(on_event, "error", "Message too long."); return None
+    if vector_db.is_ready(): await vector_db.aadd(f"User said: {_user_text(user_message_content)}", {"type": "user_message", "time": datetime.now().isoformat()})
+
+    await _emit(on_event, "status", "Thinking...")
+    logger.info("OmniBot: Thinking...") # File only
+    speculative_runner = AsyncSpeculativeToolRunner() if SPECULATIVE_TOOLS else None
+    try:
+        current_messages = await asyncio.to_thread(attachment_store.materialize, memory.get_messages()) # Attachment reads stay off the loop
+        response_stream = await llm_acompletion(model=model_name, messages=current_messages, tools=active_tool_schemas, tool_choice="auto", stream=True)
+        response_message_dict = await ahandle_streaming_response(response_stream, on_event, speculative_runner)
+        memory.add_message(response_message_dict)
+
+        tool_calls = response_message_dict.get("tool_calls")
+        if not tool_calls:
+            assistant_content = response_message_dict.get("content")
+            if assistant_content:
+                logger.info(f"OmniBot response: {assistant_content}") # File only
+                if vector_db.is_ready(): await vector_db.aadd(f"OmniBot response: {assistant_content}", {"type": "assistant_response", "after_tool_use": False, "time": datetime.now().isoformat()})
+            else: logger.warning("OmniBot received empty initial response (no content or tools).") # Console WARN
+            await _emit(on_event, "done", assistant_content); return assistant_content
+
+        await _emit(on_event, "tool_calls", [tc["function"]["name"] for tc in tool_calls])
+        logger.info(f"LLM requested {len(tool_calls)} tool(s)...") # File only
+        tool_outputs = await (speculative_runner.results(tool_calls) if speculative_runner else aexecute_tool_calls(tool_calls))
+        for tc_data, result_content in zip(tool_calls, tool_outputs):
+            if isinstance(result_content, str) and result_content.lower().startswith("error"):
+                logger.warning(f"Tool '{tc_data.get('function', {}).get('name')}' failed. Error: {result_content}") # Console WARN + File
+            memory.add_message({"role": "tool", "tool_call_id": tc_data.get('id'), "content": str(result_content)})
+            await _emit(on_event, "tool_result", {"name": tc_data.get('function', {}).get('name'), "content": str(result_content)})
+
+        await _emit(on_event, "status", "Processing tool results...")
+        logger.info("OmniBot: Processing tool results...") # File only
+        messages_with_results = await asyncio.to_thread(attachment_store.materialize, memory.get_messages())
+        final_stream = await llm_acompletion(model=model_name, messages=messages_with_results, stream=True)
+        final_response_dict = await ahandle_streaming_response(final_stream, on_event)
+        memory.add_message(final_response_dict)
+
+        final_content = final_response_dict.get("content")
+        if final_content:
+            logger.info(f"OmniBot final response (after tools): {final_content}") # File only
+            if vector_db.is_ready(): await vector_db.aadd(f"OmniBot response: {final_content}", {"type": "assistant_response", "after_tool_use": True, "time": datetime.now().isoformat()})
+        else: logger.info("OmniBot final response after tool use had no text.") # File only
+        await _emit(on_event, "done", final_content); return final_content
+    finally:
+        if speculative_runner: speculative_runner.abort() # Cancels speculative tasks orphaned by an error or cancellation
+
+def console_event_printer(kind, payload):
+    """on_event sink for achat_turn() that reproduces chat_agent()'s console output."""
+    if kind == "status": print(f"\nOmniBot: {payload}", flush=True) # Console output
+    elif kind == "stream_start": print("\nOmniBot: ", end="", flush=True)
+    elif kind == "token": print(payload, end="", flush=True)
+    elif kind == "stream_end": print()
+    elif kind == "tool_calls": print(f"OmniBot: Using {len(payload)} tool(s)...", flush=True)
+    elif kind == "error": print(f"\n[{payload}]") # Console ERROR
+
+async def achat_agent(model_name=DEFAULT_MODEL):
+    """`--async` console loop: chat_agent() driven by achat_turn(); input() runs on a thread so the loop stays free."""
+    with startup_phase("litellm"):
+        litellm = lazy_import("litellm")
+    memory = new_conversation_memory()
+    CURRENT_SESSION.set(uuid.uuid4().hex) # Tags this conversation's memory writes for session-filtered search
+    summarizer = make_llm_summarizer(os.environ.get("AGENT_SUMMARY_MODEL", model_name))
+    print_banner(model_name)
+
+    while True:
+        try:
+            memory.compact_in_background(summarizer) # Fold old turns while the user is typing
+            user_message_content = await asyncio.to_thread(read_user_turn)
+            if user_message_content == "quit": logger.info("User quit."); break # File only
+            if not user_message_content: continue
+            await achat_turn(memory, user_message_content, model_name, console_event_printer)
+        except litellm.exceptions.APIError as e: _log_api_error(e)
+        except AgentException as e: logger.error(f"Agent Error: {e}", exc_info=True); print(f"\n!!! OmniBot Error: {e} !!!", file=sys.stderr) # Console ERROR
+        except (KeyboardInterrupt, asyncio.CancelledError): logger.info("User interrupted."); print("\nOmniBot: Exiting..."); break # File info, Console output
+        except Exception as e: logger.critical(f"Critical error in main loop!", exc_info=True); print(f"\n!!! OmniBot Critical Error: {e} !!!", file=sys.stderr); break # Console CRITICAL
+
+
+# --- Server Mode ---
+SERVE_MODE = "--serve" in sys.argv or os.environ.get("AGENT_SERVE", "").lower() in ("1", "true", "yes")
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+class SessionManager:
+    """Conversations for server mode: one ConversationMemory per session, kept in RAM LRU-style.
+
+    Sessions idle longer than `idle_seconds` (AGENT_SESSION_IDLE), or beyond `max_live`
+    (AGENT_MAX_SESSIONS) live ones, are spilled to `spill_dir` (AGENT_SESSION_DIR) as JSON and
+    restored transparently on their next request; a session's file only exists while it is
+    spilled, so it can never hold an older state than the live one. All methods run on the
+    event loop; file I/O goes to worker threads.
+    """
+    def __init__(self, spill_dir=None, idle_seconds=None, max_live=None):
+        self.spill_dir = Path(spill_dir or os.environ.get("AGENT_SESSION_DIR", os.path.join(".agent_cache", "sessions"))); self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.idle_seconds = float(idle_seconds if idle_seconds is not None else os.environ.get("AGENT_SESSION_IDLE", 1800))
+        self.max_live = int(max_live if max_live is not None else os.environ.get("AGENT_MAX_SESSIONS", 1000))
+        self._live = OrderedDict() # session id -> SimpleNamespace(memory, lock, last_used), least recently used first
+        self._restore_lock = asyncio.Lock(); self._spilling = {} # Sessions whose JSON is still being written
+        self.counters = {"created": 0, "spilled": 0, "restored": 0, "deleted": 0}
+
+    def _path(self, session_id): return self.spill_dir / f"{session_id}.json"
+    def _touch(self, session_id, session): session.last_used = time.monotonic(); self._live.move_to_end(session_id); return session
+    @staticmethod
+    def _new_session(memory): return SimpleNamespace(memory=memory, lock=asyncio.Lock(), last_used=time.monotonic())
+
+    async def create(self):
+        session_id = uuid.uuid4().hex
+        self._live[session_id] = self._new_session(new_conversation_memory()); self.counters["created"] += 1
+        await self._enforce_capacity()
+        return session_id
+
+    async def get(self, session_id):
+        """Returns the live session, restoring it from disk if it was spilled; None if unknown."""
+        if not SESSION_ID_RE.match(session_id or ""): return None
+        session = self._live.get(session_id) or self._spilling.get(session_id)
+        if session is not None: self._live[session_id] = session; return self._touch(session_id, session)
+        async with self._restore_lock:
+            session = self._live.get(session_id) # Restored by a concurrent request meanwhile
+            if session is not None: return self._touch(session_id, session)
+            path = self._path(session_id)
+            try: state = json.loads(await asyncio.to_thread(path.read_text, encoding="utf-8"))
+            except FileNotFoundError: return None
+            self._live[session_id] = session = self._new_session(ConversationMemory.from_dict(state, system_message=SYSTEM_MESSAGE)); self.counters["restored"] += 1
+            await asyncio.to_thread(path.unlink, missing_ok=True) # Live again: the snapshot would go stale
+            logger.info(f"Session {session_id} restored from disk.")
+        await self._enforce_capacity()
+        return session
+
+    async def delete(self, session_id):
+        if not SESSION_ID_RE.match(session_id or ""): return False
+        found = (self._live.pop(session_id, None) is not None) | (self._spilling.pop(session_id, None) is not None) # A pending spill write is undone by _spill
+        try: await asyncio.to_thread(self._path(session_id).unlink); found = True
+        except FileNotFoundError: pass
+        if found: self.counters["deleted"] += 1
+        return found
+
+    async def _spill(self, session_id):
+        session = self._live.get(session_id)
+        if session is None or session.lock.locked() or session_id in self._spilling: return False # Never evict a session mid-turn or mid-write
+        del self._live[session_id]; self._spilling[session_id] = session
+        path = self._path(session_id); tmp = path.with_suffix(".tmp")
+        def write(): tmp.write_text(json.dumps(session.memory.to_dict()), encoding="utf-8"); os.replace(tmp, path)
+        try: await asyncio.to_thread(write); failed = None
+        except BaseException as e: failed = e
+        still_spilled = self._spilling.pop(session_id, None) is session
+        if failed is not None: # Keep the session live rather than lose it; the next spill retries
+            if still_spilled and session_id not in self._live: self._live[session_id] = session
+            if not isinstance(failed, Exception): raise failed # Cancelled: the session is back, let it propagate
+            logger.error(f"Spilling session {session_id} failed: {failed}")
+            await asyncio.to_thread(tmp.unlink, missing_ok=True)
+            return False
+        if not still_spilled or session_id in self._live: # Deleted, or revived by a request, while the file was written
+            await asyncio.to_thread(path.unlink, missing_ok=True); return False
+        self.counters["spilled"] += 1; logger.info(f"Session {session_id} spilled to disk.")
+        return True
+
+    async def _enforce_capacity(self):
+        for session_id in list(self._live)[:max(0, len(self._live) - self.max_live)]: await self._spill(session_id)
+
+    async def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = [sid for sid, s in self._live.items() if s.last_used < cutoff]
+        return sum([await self._spill(sid) for sid in idle])
+
+    async def spill_all(self):
+        for session_id in list(self._live): await self._spill(session_id)
+
+    def stats(self): return {"live": len(self._live), "busy": sum(s.lock.locked() for s in self._live.values()), **self.counters}
+
+class AgentServer:
+    """HTTP/1.1 + Server-Sent Events front end for achat_turn(), on asyncio streams (no extra dependencies).
+
+    POST /sessions                      -> {"session_id": ...}
+    POST /sessions/<id>/messages        {"message": "..."} -> text/event-stream of achat_turn events
+    GET  /sessions/<id>, DELETE /sessions/<id>, GET /health
+    Requests need `Authorization: Bearer <AGENT_SERVER_TOKEN>` when that variable is set.
+    Turns of one session are serialised; different sessions run concurrently and share
+    tool_map / vector_db (whose state is lock-protected).
+    """
+    MAX_BODY = 1_000_000
+
+    def __init__(self, host=None, port=None, sessions=None, model_name=DEFAULT_MODEL, token=None, summarizer=None):
+        self.host = host or os.environ.get("AGENT_SERVER_HOST", "127.0.0.1"); self.port = int(port if port is not None else os.environ.get("AGENT_SERVER_PORT", 8080))
+        self.sessions = sessions or SessionManager(); self.model_name = model_name
+        self.token = token if token is not None else os.environ.get("AGENT_SERVER_TOKEN")
+        self.summarizer = summarizer
+        self._server = None; self._evictor = None; self.turns = 0; self.active_turns = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port, backlog=int(os.environ.get("AGENT_SERVER_BACKLOG", 1024)))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._evictor = asyncio.create_task(self._evict_loop())
+        logger.info(f"Server listening on http://{self.host}:{self.port}")
+        return self
+
+    async def close(self):
+        if self._evictor: self._evictor.cancel()
+        if self._server: self._server.close(); await self._server.wait_closed()
+        await self.sessions.spill_all() # Live conversations survive a restart
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(max(1.0, min(60.0, self.sessions.idle_seconds / 4)))
+            try: await self.sessions.evict_idle()
+            except Exception as e: logger.error(f"Session eviction failed: {e}", exc_info=True)
+
+    def health(self):
+        github_tool = tool_map.get("github_operations")
+        return {"status": "ok", "turns": self.turns, "active_turns": self.active_turns, "sessions": self.sessions.stats(), "tool_cache": tool_result_cache.stats(),
+                "http": http_pool_stats(), "github": github_tool.stats() if github_tool else {}}
+
+    @staticmethod
+    async def _read_request(reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in lines[1:] if line)}
+        length = int(headers.get("content-length") or 0)
+        if length > AgentServer.MAX_BODY: raise OverflowError(f"Body exceeds {AgentServer.MAX_BODY} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0].rstrip("/") or "/", headers, body
+
+    @staticmethod
+    async def _send_json(writer, status, payload=None):
+        phrase = lazy_import("http").HTTPStatus(status).phrase
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        writer.write(f"HTTP/1.1 {status} {phrase}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            try: method, path, headers, body = await self._read_request(reader)
+            except OverflowError as e: return await self._send_json(writer, 413, {"error": str(e)})
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError): return await self._send_json(writer, 400, {"error": "Malformed request"})
+            parts = path.strip("/").split("/")
+            if path == "/health" and method == "GET": return await self._send_json(writer, 200, self.health())
+            if self.token and headers.get("authorization") != f"Bearer {self.token}": return await self._send_json(writer, 401, {"error": "Unauthorized"})
+            if parts == ["sessions"] and method == "POST": return await self._send_json(writer, 201, {"session_id": await self.sessions.create()})
+            if len(parts) == 2 and parts[0] == "sessions":
+                if method == "DELETE": return await self._send_json(writer, 204 if await self.sessions.delete(parts[1]) else 404)
+                if method == "GET":
+                    session = await self.sessions.get(parts[1])
+                    if session is None: return await self._send_json(writer, 404, {"error": "Unknown session"})
+                    return await self._send_json(writer, 200, {"session_id": parts[1], "messages": len(session.memory.to_dict()["messages"]), "tokens": session.memory.token_count, "summary": session.memory.summary})
+            if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages" and method == "POST": return await self._handle_message(parts[1], body, writer)
+            return await self._send_json(writer, 404, {"error": f"No route for {method} {path}"})
+        except ConnectionError: pass # Client went away
+        except Exception as e:
+            logger.error(f"Server request failed: {e}", exc_info=True)
+            try: await self._send_json(writer, 500, {"error": "Internal server error"})
+            except Exception: pass
+        finally:
+            writer.close()
+
+    async def _handle_message(self, session_id, body, writer):
+        try: text = json.loads(body or b"{}").get("message")
+        except (json.JSONDecodeError, AttributeError): text = None
+        if not text or not isinstance(text, str): return await self._send_json(writer, 400, {"error": "Body must be JSON with a non-empty 'message' string"})
+        session = await self.sessions.get(session_id)
+        if session is None: return await self._send_json(writer, 404, {"error": "Unknown session"})
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        client = {"open": True}
+        async def send_event(kind, payload=None):
+            if not client["open"]: return # Keep running the turn so the session's memory stays consistent
+            try: writer.write(f"event: {kind}\ndata: {json.dumps(payload, default=str)}\n\n".encode("utf-8")); await writer.drain()
+            except ConnectionError: client["open"] = False
+
+        async with session.lock: # One turn at a time per conversation
+            session_token = CURRENT_SESSION.set(session_id); self.active_turns += 1
+            try: await achat_turn(session.memory, [{"type": "text", "text": text}], self.model_name, send_event)
+            except Exception as e: logger.error(f"Session {session_id} turn failed: {e}", exc_info=True); await send_event("error", f"Turn failed: {e}")
+            finally: CURRENT_SESSION.reset(session_token); self.active_turns -= 1; self.turns += 1; session.last_used = time.monotonic()
+        if self.summarizer: session.memory.compact_in_background(self.summarizer)
+
+async def serve(host=None, port=None, model_name=DEFAULT_MODEL):
+    """`--serve` entry point: runs AgentServer until interrupted, then spills live sessions."""
+    server = await AgentServer(host, port, model_name=model_name, summarizer=make_llm_summarizer(os.environ.get("AGENT_SUMMARY_MODEL", model_name))).start()
+    print(f"OmniBot server on http://{server.host}:{server.port} (model {model_name}). Ctrl+C to stop.") # Console output
+    print(format_startup_timings()) # Console output
+    try: await asyncio.Event().wait()
+    finally: await server.close()
+
+
 # --- Start the Agent ---
 if __name__ == "__main__":
     try:
-        chat_agent()
+        if SERVE_MODE: asyncio.run(serve())
+        elif ASYNC_CORE: asyncio.run(achat_agent())
+        else: chat_agent()
+    except KeyboardInterrupt:
+        print("\nOmniBot: Exiting...") # Console output (server/async mode Ctrl+C)
     except APIKeyError:
         print("Execution stopped: Missing critical API key. Please set it in .env", file=sys.stderr) # Console output
     except Exception as main_e:
@@ -0,0 +1,81 @@
+"""
+Benchmark: code_execution per-run overhead, in-process (old) vs prewarmed worker pool.
+
+The old path rebuilt the restricted globals on every call (an __import__ pass over every
+allowed module) and ran the snippet in a daemon thread that could not be stopped on timeout.
+The pool keeps worker processes with the modules already imported; a run is one pipe round
+trip, and a timed-out worker is killed and replaced. The pool's "first ms" is measured from
+constructing the tool, so it includes spawning the worker and its module imports.
+
+Run: python benchmarks/bench_code_execution.py
+"""
+import builtins
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("AGENT_FAST_START", "1")
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import CodeExecutionTool  # noqa: E402
+
+SNIPPET = "total = sum(i * i for i in range(100))\nprint(total)"
+RUNS = 200
+
+
+def old_run(safe_modules, code, timeout=10):
+    restricted_globals = {"__builtins__": {n: getattr(builtins, n) for n in dir(builtins) if n not in ("exec", "eval", "__import__", "open")}}
+    for module_name, allowed_items in safe_modules.items():
+        try:
+            module = __import__(module_name)
+            restricted_globals[module_name] = module if allowed_items == "*" else {i: getattr(module, i, None) for i in allowed_items}
+        except ImportError:
+            pass
+    output = io.StringIO()
+
+    def target():
+        with contextlib.redirect_stdout(output):
+            exec(compile(code, "<string>", "exec"), restricted_globals)
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return output.getvalue()
+
+
+def per_run_ms(fn):
+    times = []
+    for _ in range(RUNS):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.99)]
+
+
+if __name__ == "__main__":
+    t0 = time.perf_counter()
+    tool = CodeExecutionTool()
+    tool.pool.run(SNIPPET, 10)  # A real first call: includes spawning the worker and its module imports
+    pool_first = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    old_run(tool.safe_modules, SNIPPET)
+    old_cold = (time.perf_counter() - t0) * 1000
+    old_p50, old_p99 = per_run_ms(lambda: old_run(tool.safe_modules, SNIPPET))
+    pool_p50, pool_p99 = per_run_ms(lambda: tool.pool.run(SNIPPET, 10))
+    print(f"{'path':>12} {'first ms':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    print(f"{'in-process':>12} {old_cold:>10.1f} {old_p50:>8.2f} {old_p99:>8.2f}")
+    print(f"{'pool':>12} {pool_first:>10.1f} {pool_p50:>8.2f} {pool_p99:>8.2f}")
+
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    try:
+        tool.pool.run("while True: pass", 0.5)
+    except Exception as e:
+        print(f"runaway snippet: {e} ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+    time.sleep(1)
+    print(f"agent CPU in the second after the timeout: {(time.process_time() - cpu0) * 1000:.0f} ms")
+    tool.pool.close()
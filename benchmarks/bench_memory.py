@@ -0,0 +1,44 @@
+"""
+Micro-benchmark: ConversationMemory add/prune cost as history grows.
+
+Fills memory to capacity with N messages, then times further add_message() calls
+(each of which triggers watermark pruning). With cached token counts and a deque
+body the per-add cost should stay flat across N.
+
+Run: python benchmarks/bench_memory.py
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("AGENT_FAST_START", "1")
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import ConversationMemory  # noqa: E402
+
+SYSTEM = {"role": "system", "content": "You are a benchmark."}
+ATTACHMENT = "A" * 4000  # stands in for a base64 payload kept in history
+
+
+def make_message(i):
+    return {"role": "user" if i % 2 else "assistant", "content": f"message {i} {ATTACHMENT}"}
+
+
+def bench(history_size, adds=2000):
+    per_msg = ConversationMemory(system_message=SYSTEM)._estimate_tokens(make_message(0))
+    memory = ConversationMemory(max_tokens=per_msg * history_size, system_message=SYSTEM)
+    for i in range(history_size):
+        memory.add_message(make_message(i))
+    t0 = time.perf_counter()
+    for i in range(adds):
+        memory.add_message(make_message(history_size + i))
+    elapsed = time.perf_counter() - t0
+    return elapsed / adds * 1e6, len(memory.get_messages())
+
+
+if __name__ == "__main__":
+    print(f"{'history':>10} {'us/add':>12} {'kept':>8}")
+    for size in (1_000, 10_000, 100_000):
+        us, kept = bench(size)
+        print(f"{size:>10} {us:>12.1f} {kept:>8}")
@@ -0,0 +1,105 @@
+"""
+Load test: server mode (AgentServer) under concurrent sessions with a stubbed model.
+
+Starts the HTTP/SSE server in-process, replaces llm_acompletion with a stub that streams
+STUB_TOKENS tokens STUB_DELAY seconds apart, then has N clients each open a session and
+send TURNS messages. Reports throughput and time-to-first-token / turn latency percentiles.
+Clients share the server's event loop, so the numbers are a lower bound for the server alone.
+
+Run: python benchmarks/bench_server.py [clients ...]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("AGENT_FAST_START", "1")
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("AGENT_SESSION_DIR", tempfile.mkdtemp(prefix="bench_sessions_"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+STUB_TOKENS = 20
+STUB_DELAY = 0.005  # ~100 ms per streamed reply
+TURNS = 5
+
+
+class StubStream:
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for i in range(STUB_TOKENS):
+            await asyncio.sleep(STUB_DELAY)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=f"tok{i} ", tool_calls=None))])
+
+
+async def stub_acompletion(**kwargs):
+    return StubStream()
+
+
+async def request(port, method, path, payload=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    return reader, writer
+
+
+async def create_session(port):
+    reader, writer = await request(port, "POST", "/sessions")
+    data = await reader.read()
+    writer.close()
+    return json.loads(data.split(b"\r\n\r\n", 1)[1])["session_id"]
+
+
+async def send_message(port, session_id, text):
+    """Returns (time to first token, time to 'done') in seconds."""
+    t0 = time.perf_counter()
+    reader, writer = await request(port, "POST", f"/sessions/{session_id}/messages", {"message": text})
+    ttft = None
+    async for line in reader:
+        if line.startswith(b"event: token") and ttft is None:
+            ttft = time.perf_counter() - t0
+        elif line.startswith(b"event: done"):
+            break
+    writer.close()
+    return ttft, time.perf_counter() - t0
+
+
+async def client(port, ttfts, latencies):
+    session_id = await create_session(port)
+    for turn in range(TURNS):
+        ttft, latency = await send_message(port, session_id, f"message {turn}")
+        ttfts.append(ttft)
+        latencies.append(latency)
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+
+
+async def bench(clients):
+    app.llm_acompletion = stub_acompletion
+    server = await app.AgentServer(host="127.0.0.1", port=0).start()
+    ttfts, latencies = [], []
+    t0 = time.perf_counter()
+    await asyncio.gather(*[client(server.port, ttfts, latencies) for _ in range(clients)])
+    elapsed = time.perf_counter() - t0
+    await server.close()
+    return len(latencies) / elapsed, pct(ttfts, 50), pct(ttfts, 99), pct(latencies, 50), pct(latencies, 99)
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1, 50, 200, 500]
+    ideal = STUB_TOKENS * STUB_DELAY * 1000
+    print(f"stub reply ~{ideal:.0f} ms, {TURNS} turns per client")
+    print(f"{'clients':>8} {'turns/s':>9} {'ttft p50':>10} {'ttft p99':>10} {'turn p50':>10} {'turn p99':>10}  (ms)")
+    for n in sizes:
+        tps, t50, t99, l50, l99 = asyncio.run(bench(n))
+        print(f"{n:>8} {tps:>9.1f} {t50:>10.1f} {t99:>10.1f} {l50:>10.1f} {l99:>10.1f}")
@@ -0,0 +1,71 @@
+"""
+Benchmark: streamed tool-call argument handling, old vs incremental.
+
+The old loop re-ran json.loads() on the whole accumulated argument string for every
+delta and grew it with +=, which is O(n^2) in the argument size. The incremental path
+feeds each delta to JSONCompletenessTracker and only parses once the value is balanced.
+
+Run: python benchmarks/bench_stream_parser.py
+"""
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("AGENT_FAST_START", "1")
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import JSONCompletenessTracker  # noqa: E402
+
+CHUNK_CHARS = 16  # roughly a few tokens per streamed delta
+
+
+def make_arguments(size):
+    line = 'print("hello {world}")  # \\ escaped [brackets]\n'
+    code = line * (size // len(line) + 1)
+    return json.dumps({"operation": "write_file", "file_path": "big.py", "file_content": code[:size]})
+
+
+def old_loop(deltas):
+    args = ""
+    for d in deltas:
+        args += d
+        try:
+            json.loads(args)
+            return args
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+def new_loop(deltas):
+    parts, tracker, checked = [], JSONCompletenessTracker(), 0
+    for d in deltas:
+        parts.append(d)
+        if tracker.feed(d) and tracker.closes != checked:
+            checked = tracker.closes
+            args = "".join(parts)
+            try:
+                json.loads(args)
+                return args
+            except json.JSONDecodeError:
+                pass
+    return None
+
+
+def timed(fn, deltas):
+    t0 = time.perf_counter()
+    result = fn(deltas)
+    return time.perf_counter() - t0, result
+
+
+if __name__ == "__main__":
+    print(f"{'args':>8} {'deltas':>8} {'old ms':>10} {'new ms':>10} {'speedup':>8}")
+    for size in (10_000, 50_000, 100_000):
+        args = make_arguments(size)
+        deltas = [args[i:i + CHUNK_CHARS] for i in range(0, len(args), CHUNK_CHARS)]
+        t_old, r_old = timed(old_loop, deltas)
+        t_new, r_new = timed(new_loop, deltas)
+        assert r_old == r_new == args
+        print(f"{len(args) // 1000:>7}K {len(deltas):>8} {t_old * 1000:>10.1f} {t_new * 1000:>10.1f} {t_old / t_new:>7.0f}x")